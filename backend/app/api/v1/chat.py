@@ -1,20 +1,43 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import weakref
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Request, Header
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from app.models.chat_models import ChatRequest, ChatResponse
-from app.core.agent import run_agent
+from app.core.agent import run_agent, stream_agent, remember_turn, session_has_history
+from app.core.answer_cache import answer_cache, ANSWER_CACHE_ENABLED
+from app.core.session_store import session_store
 from app.services.firebase_service import (
     verify_firebase_token,
-    save_message_to_firestore,
     get_conversations_from_firestore,
     delete_conversation_from_firestore,
     delete_single_session_from_firestore,
 )
-from app.services.vector_db_service import add_text_to_vector_db
-from app.core.crews.blog_crew import create_blog_post_crew
+from app.services.persistence_service import persistence_queue
+from app.services.job_service import job_manager
+from app.services.vector_db_service import embed_text
 from app.core.limiter import limiter
+from app.core.concurrency import run_blocking, IO_EXECUTOR, EMBEDDING_EXECUTOR
+from app.core import timing
+from app.core.singleflight import SingleFlight
+from app.core.admission import llm_admission, INTERACTIVE
 
 router = APIRouter()
 
+# Keeps fire-and-forget tasks referenced until they finish.
+_background_tasks = set()
+
+# Identical chat requests in flight at the same time (double submits, frontend
+# retries) share one agent run and one persisted turn.
+chat_flights = SingleFlight()
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+
 class CrewRequest(BaseModel):
     topic: str
 
@@ -43,44 +66,198 @@ def get_current_user(token: str = Depends(get_firebase_token)) -> dict:
 
 @router.post("", response_model=ChatResponse)
 @limiter.limit("20/minute")
-async def handle_chat(request: Request, body: ChatRequest, user_data: dict = Depends(get_current_user)):
-    user_id = user_data['uid']
+async def handle_chat(
+    request: Request,
+    body: ChatRequest,
+    user_data: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(default=None),
+):
+    """Answers a chat message.
 
-    add_text_to_vector_db(
-        user_id=user_id,
-        text=body.user_input,
-        metadata={'sender': 'user', 'session_id': body.session_id}
+    Concurrent identical requests share one execution. With an Idempotency-Key
+    header the response is also replayed for retries with the same key and the
+    same body for IDEMPOTENCY_TTL_SECONDS; a key reused for a different
+    message runs as a new request.
+    """
+    user_id = user_data['uid']
+    if idempotency_key:
+        body_hash = hashlib.sha256(json.dumps([body.session_id, body.user_input]).encode("utf-8")).hexdigest()
+        return await chat_flights.do(
+            ("idempotency", user_id, idempotency_key, body_hash),
+            lambda: _answer_chat(body, user_id),
+            ttl=IDEMPOTENCY_TTL_SECONDS,
+        )
+    return await chat_flights.do(
+        ("chat", user_id, body.session_id, body.user_input),
+        lambda: _answer_chat(body, user_id),
     )
-    save_message_to_firestore(user_id, body.session_id, 'user', body.user_input)
 
-    agent_result = run_agent(body.user_input, body.session_id, user_id)
+async def _answer_chat(body: ChatRequest, user_id: str) -> ChatResponse:
+    started_at = datetime.datetime.utcnow()
+
+    query_vector, cached_output = await _lookup_cached_answer(user_id, body.session_id, body.user_input)
+    if cached_output is not None:
+        _remember_cached_turn(body.session_id, user_id, body.user_input, cached_output)
+        await persistence_queue.enqueue_turn(user_id, body.session_id, body.user_input, cached_output, started_at, query_vector)
+        return ChatResponse(output=cached_output)
+
+    # Raises AdmissionRejected (503 + Retry-After) if no LLM slot frees up in time.
+    async with llm_admission.slot(INTERACTIVE):
+        agent_result = await run_agent(body.user_input, body.session_id, user_id, query_vector)
     agent_output = agent_result.get("output", "I'm sorry, I encountered an error and couldn't process your request.")
+    tools_used = agent_result.get("tools_used", [])
+
+    if query_vector is not None and agent_result.get("cacheable"):
+        answer_cache.store(user_id, query_vector, agent_output, tools_used)
+
+    # Both messages are written behind the response (see persistence_service).
+    with timing.span("persist_enqueue"):
+        await persistence_queue.enqueue_turn(user_id, body.session_id, body.user_input, agent_output, started_at, query_vector)
+
+    return ChatResponse(output=agent_output, tool_used=", ".join(tools_used) or None)
+
+@router.post("/stream")
+@limiter.limit("20/minute")
+async def handle_chat_stream(request: Request, body: ChatRequest, user_data: dict = Depends(get_current_user)):
+    """Streams agent progress and final-answer tokens as Server-Sent Events.
+
+    Event types: tool_start, tool_end, token and a closing final event with the
+    full answer. Both messages of the turn are persisted once the stream ends.
+    """
+    user_id = user_data['uid']
+    started_at = datetime.datetime.utcnow()
+    # Headers (and Server-Timing) go out before the body, so the stream logs its own timing.
+    timer = timing.current_timer()
+
+    query_vector, agent_output = await _lookup_cached_answer(user_id, body.session_id, body.user_input)
+    slot_released = agent_output is not None
+    if not slot_released:
+        # Admission happens before the response starts so a rejection is still a 503.
+        await llm_admission.acquire(INTERACTIVE)
+
+    def release_slot():
+        nonlocal slot_released
+        if not slot_released:
+            slot_released = True
+            llm_admission.release()
+
+    async def event_stream():
+        nonlocal agent_output
+        if agent_output is not None:
+            _remember_cached_turn(body.session_id, user_id, body.user_input, agent_output)
+            for event in ({"type": "token", "text": agent_output}, {"type": "final", "output": agent_output}):
+                yield _sse(event)
+        else:
+            try:
+                async for event in stream_agent(body.user_input, body.session_id, user_id, query_vector):
+                    if event["type"] == "final":
+                        agent_output = event["output"]
+                        if query_vector is not None and event.get("cacheable"):
+                            answer_cache.store(user_id, query_vector, agent_output, event.get("tools_used", []))
+                    yield _sse(event)
+            finally:
+                release_slot()
+
+        if agent_output:
+            await persistence_queue.enqueue_turn(user_id, body.session_id, body.user_input, agent_output, started_at, query_vector)
+        if timer is not None:
+            timing.log_if_slow(timer, 200)
 
-    add_text_to_vector_db(
-        user_id=user_id,
-        text=agent_output,
-        metadata={'sender': 'agent', 'session_id': body.session_id}
+    stream = event_stream()
+    # If the client disconnects before the body is iterated the generator never
+    # runs its finally block; the background task, run once the response is
+    # over, releases the slot then. As a last resort the slot is also released
+    # when the generator is collected, which can happen on any thread, so the
+    # release is handed to the event loop (the admission queue is loop-only).
+    loop = asyncio.get_running_loop()
+    weakref.finalize(stream, _call_soon_threadsafe, loop, release_slot)
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        # Stop proxies (nginx, Cloud Run's front end) from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_slot),
     )
-    save_message_to_firestore(user_id, body.session_id, 'agent', agent_output)
 
-    return ChatResponse(output=agent_output)
+def _call_soon_threadsafe(loop, callback):
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        # The loop is closed (shutdown); its slots are gone with it.
+        pass
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+async def _lookup_cached_answer(user_id: str, session_id: str, user_input: str):
+    """Embeds the question and checks the semantic answer cache. Returns (vector, answer or None).
+
+    Cached answers were produced without any conversation context, so they are
+    only served to the first message of a session: later messages may be
+    follow-ups ("tell me more") that only make sense in their conversation.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    try:
+        query_vector = await run_blocking(EMBEDDING_EXECUTOR, embed_text, user_input)
+    except Exception as e:
+        print(f"Could not embed question for the answer cache: {e}")
+        return None, None
+    try:
+        if await session_has_history(session_id, user_id):
+            return query_vector, None
+    except Exception as e:
+        print(f"Could not load the session history for the answer cache: {e}")
+        return query_vector, None
+    with timing.span("answer_cache"):
+        return query_vector, answer_cache.lookup(user_id, query_vector)
 
-@router.post("/invoke_crew")
+def _remember_cached_turn(session_id: str, user_id: str, user_input: str, output: str):
+    # Short-term memory still needs the turn so follow-up questions have context.
+    task = asyncio.ensure_future(remember_turn(session_id, user_id, user_input, output))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@router.post("/invoke_crew", status_code=202)
 @limiter.limit("5/minute")
 async def handle_crew_invocation(request: Request, body: CrewRequest, user_data: dict = Depends(get_current_user)):
+    """Starts a blog crew job and returns its id; poll or subscribe to the job for the result."""
     if not body.topic:
         raise HTTPException(status_code=400, detail="A topic is required.")
-    try:
-        result = create_blog_post_crew(body.topic)
-        return {"result": result}
-    except Exception as e:
-        print(f"Error during crew invocation: {e}")
-        raise HTTPException(status_code=500, detail="An error occurred while the AI crew was working.")
+    job = await job_manager.submit(user_data['uid'], body.topic)
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"{request.url.path}/{job['job_id']}",
+    }
+
+@router.get("/invoke_crew/{job_id}")
+async def get_crew_job(job_id: str, user_data: dict = Depends(get_current_user)):
+    job = await job_manager.get(job_id, user_data['uid'])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@router.get("/invoke_crew/{job_id}/events")
+async def stream_crew_job(job_id: str, user_data: dict = Depends(get_current_user)):
+    """Server-Sent Events with the job record on every status change, ending when it finishes."""
+    if await job_manager.get(job_id, user_data['uid']) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def event_stream():
+        async for job in job_manager.subscribe(job_id, user_data['uid']):
+            yield _sse({"type": "status", **job})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.get("/history")
 async def get_chat_history(user_data: dict = Depends(get_current_user)):
     user_id = user_data['uid']
-    conversations = get_conversations_from_firestore(user_id)
+    conversations = await run_blocking(IO_EXECUTOR, get_conversations_from_firestore, user_id)
     if conversations is None:
         raise HTTPException(status_code=500, detail="Could not fetch conversation history.")
     return {"history": conversations}
@@ -88,7 +265,9 @@ async def get_chat_history(user_data: dict = Depends(get_current_user)):
 @router.delete("/history")
 async def delete_chat_history(user_data: dict = Depends(get_current_user)):
     user_id = user_data['uid']
-    success = delete_conversation_from_firestore(user_id)
+    success = await run_blocking(IO_EXECUTOR, delete_conversation_from_firestore, user_id)
+    answer_cache.clear_user(user_id)
+    await run_blocking(IO_EXECUTOR, session_store.discard, user_id)
     if not success:
         raise HTTPException(status_code=500, detail="Failed to delete conversation history.")
     return {"message": "Conversation history deleted successfully."}
@@ -96,7 +275,8 @@ async def delete_chat_history(user_data: dict = Depends(get_current_user)):
 @router.delete("/history/{session_id}")
 async def delete_single_chat_session(session_id: str, user_data: dict = Depends(get_current_user)):
     user_id = user_data['uid']
-    success = delete_single_session_from_firestore(user_id, session_id)
+    success = await run_blocking(IO_EXECUTOR, delete_single_session_from_firestore, user_id, session_id)
+    await run_blocking(IO_EXECUTOR, session_store.discard, user_id, session_id)
     if not success:
         raise HTTPException(status_code=500, detail=f"Failed to delete session {session_id}.")
     return {"message": f"Session {session_id} deleted successfully."}
\ No newline at end of file
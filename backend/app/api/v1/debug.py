@@ -3,6 +3,21 @@ import firebase_admin
 from firebase_admin import auth
 import traceback
 import json
+from app.core.answer_cache import answer_cache
+from app.services.persistence_service import persistence_queue
+from app.core.tools.wrappers import tool_flights
+from app.core.tools.cache import tool_cache
+from app.core.cassette import cassette
+from app.core import startup
+from app.services.vector_db_service import embedder, embedding_cache, get_memory_store
+from app.api.v1.chat import chat_flights
+from app.core.agent import summarizer, llm_stats
+from app.core.admission import llm_admission
+from app.core.session_store import session_store
+from app.core.router import intent_router
+from app.core.token_budget import prompt_budget
+from app.services.job_service import job_manager
+from app.services.firebase_service import token_cache
 
 router = APIRouter()
 
@@ -93,4 +108,28 @@ async def debug_firebase():
             "success": False,
             "error": str(e),
             "traceback": traceback.format_exc()
-        }
\ No newline at end of file
+        }
+
+@router.get("/stats")
+async def debug_stats():
+    """Counters of the in-process caches and queues, for monitoring"""
+    return {
+        "llm_admission": llm_admission.stats(),
+        "llm_providers": llm_stats(),
+        "session_store": session_store.stats(),
+        "conversation_summary": summarizer.stats(),
+        "intent_router": intent_router.stats(),
+        "prompt_budget": prompt_budget.stats(),
+        "auth_token_cache": token_cache.stats(),
+        "crew_jobs": job_manager.stats(),
+        "answer_cache": answer_cache.stats(),
+        "persistence_queue": persistence_queue.stats(),
+        "chat_single_flight": chat_flights.stats(),
+        "tool_single_flight": tool_flights.stats(),
+        "tool_cache": tool_cache.stats(),
+        "cassette": cassette.stats(),
+        "startup": startup.stats(),
+        "embedding_batcher": embedder.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "vector_db": get_memory_store().stats(),
+    }
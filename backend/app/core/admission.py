@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from app.core import timing
+
+# Priorities: lower numbers are admitted first.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))
+# How long a request may wait for a slot before it is turned away with a 503.
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+LLM_BACKGROUND_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_BACKGROUND_QUEUE_TIMEOUT_SECONDS", "120"))
+# Slots background work (crews, summaries) may hold at once; the rest stay free for chat.
+LLM_BACKGROUND_MAX = int(os.getenv("LLM_BACKGROUND_MAX", str(max(1, LLM_MAX_CONCURRENCY // 2))))
+
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't get an LLM slot in time. Surfaced as 503 + Retry-After."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds how many LLM-backed runs (agent loops, crews) execute at once.
+
+    Requests over the cap wait in a priority queue, interactive chat ahead of
+    background work, and are rejected if they can't be admitted before their
+    deadline or if the queue is already full. Background work holds at most
+    `background_max` slots, so long crew runs can't take every slot from chat.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, background_max: int = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.background_max = max_concurrency if background_max is None else background_max
+        self._in_flight = 0
+        self._background_in_flight = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wait_ms = deque(maxlen=1000)
+        self._hold_seconds = deque(maxlen=200)
+        self._stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    async def acquire(self, priority: int = INTERACTIVE, timeout: float = None):
+        """Waits for a slot. Raises AdmissionRejected if none frees up within `timeout` seconds."""
+        if timeout is None:
+            timeout = LLM_QUEUE_TIMEOUT_SECONDS if priority == INTERACTIVE else LLM_BACKGROUND_QUEUE_TIMEOUT_SECONDS
+        start = time.monotonic()
+
+        if self._has_room(priority) and not self._queued(up_to=priority):
+            self._admit(start, priority)
+            return
+
+        if self._queued() >= self.max_queue:
+            self._stats["rejected_queue_full"] += 1
+            raise AdmissionRejected("LLM queue is full.", self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        timing.increment("llm_queued")
+        try:
+            with timing.span("llm_queue"):
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._stats["rejected_timeout"] += 1
+                raise AdmissionRejected("Timed out waiting for an LLM slot.", self._retry_after())
+        except asyncio.CancelledError:
+            if not future.cancel():
+                # The slot was granted just as the caller went away.
+                self.release(priority=priority)
+            raise
+        self._wait_ms.append((time.monotonic() - start) * 1000)
+
+    def release(self, held_since: float = None, priority: int = INTERACTIVE):
+        if held_since is not None:
+            self._hold_seconds.append(time.monotonic() - held_since)
+        self._in_flight -= 1
+        if priority == BACKGROUND:
+            self._background_in_flight -= 1
+        while self._waiters:
+            waiter_priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            # Interactive waiters sort first, so a blocked head means only blocked background work is left.
+            if not self._has_room(waiter_priority):
+                break
+            heapq.heappop(self._waiters)
+            self._in_flight += 1
+            if waiter_priority == BACKGROUND:
+                self._background_in_flight += 1
+            self._stats["admitted"] += 1
+            future.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, timeout: float = None):
+        """Holds an LLM slot for the duration of the block."""
+        await self.acquire(priority, timeout)
+        held_since = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(held_since, priority)
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_ms)
+        queued = {name: 0 for name in _PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued[_PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return {
+            **self._stats,
+            "in_flight": self._in_flight,
+            "background_in_flight": self._background_in_flight,
+            "max_concurrency": self.max_concurrency,
+            "background_max": self.background_max,
+            "queued": queued,
+            "wait_ms_p50": round(waits[len(waits) // 2], 2) if waits else 0.0,
+            "wait_ms_p99": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))], 2) if waits else 0.0,
+        }
+
+    def _admit(self, start: float, priority: int):
+        self._in_flight += 1
+        if priority == BACKGROUND:
+            self._background_in_flight += 1
+        self._stats["admitted"] += 1
+        self._wait_ms.append((time.monotonic() - start) * 1000)
+
+    def _has_room(self, priority: int) -> bool:
+        if self._in_flight >= self.max_concurrency:
+            return False
+        return priority != BACKGROUND or self._background_in_flight < self.background_max
+
+    def _queued(self, up_to: int = None) -> int:
+        """Waiters still queued, or only those of priority `up_to` or more urgent."""
+        return sum(1 for priority, _, future in self._waiters
+                   if not future.done() and (up_to is None or priority <= up_to))
+
+    def _retry_after(self) -> int:
+        """Estimates (seconds) when a slot should be free, from recent hold times and queue depth."""
+        average_hold = sum(self._hold_seconds) / len(self._hold_seconds) if self._hold_seconds else 5.0
+        backlog = self._queued() + 1
+        return max(1, math.ceil(average_hold * backlog / self.max_concurrency))
+
+
+llm_admission = AdmissionController(max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                                    background_max=LLM_BACKGROUND_MAX)
@@ -1,151 +1,317 @@
+import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
-from langchain import hub
-from langchain.agents import AgentExecutor, create_react_agent
+from langchain.agents import AgentExecutor, create_react_agent, create_tool_calling_agent
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain.memory import ConversationBufferWindowMemory
-from langchain_groq import ChatGroq
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.messages import AIMessage, HumanMessage
 
 # Tool Imports
-from app.core.tools.weather import weather_tool
-from app.core.tools.calendar_tool import calendar_tool
-from app.core.tools.wikipedia import wikipedia_tool
-from app.core.tools.news import news_tool
-from app.core.tools.financial_data import get_daily_stock_prices, get_multiple_stock_prices, create_stock_comparison_chart
-from app.core.tools.code_interpreter import code_interpreter_tool
-from langchain_community.tools import DuckDuckGoSearchRun
-
-# Import the function to search the user's memory
-from app.services.vector_db_service import search_user_memory
+from app.core.tools.cache import cache_tool
+from app.core.prompts import create_agent_prompt, create_react_prompt, SYSTEM_PROMPT, REACT_CHAT_TEMPLATE
+from app.core.token_budget import prompt_budget
+from app.core.llm_providers import create_llm
+from app.core.cassette import cassette_llm, cassette_tool
+from app.core.summary_memory import ConversationSummarizer, SESSION_MEMORY_MODE
+
 from app.services.firebase_service import get_recent_session_messages
+from app.core.context import assemble_context, resolve_memory
+from app.core.session_store import session_store, SESSION_WINDOW_TURNS
+from app.core import timing
+from app.core.timing import TimingCallbackHandler
+from app.core.concurrency import run_blocking, IO_EXECUTOR, EMBEDDING_EXECUTOR
+from app.core.router import intent_router, ROUTER_ENABLED, format_prompt, render_template, uses_llm_formatting
 
 load_dotenv()
 
-def get_groq_llm():
-    """
-    Initialize Groq LLM with proper error handling.
-    """
-    groq_api_key = os.getenv("GROQ_API_KEY")
-    
-    if not groq_api_key:
-        raise Exception("GROQ_API_KEY not found in .env file.")
-    
-    try:
-        llm = ChatGroq(
-            groq_api_key=groq_api_key,
-            model_name="llama3-8b-8192", # Using a faster model for better UX
-            temperature=0.7,
-            max_retries=3
-        )
-        print("✅ Using Groq (Llama 3 8B) for agent.")
-        return llm
-    except ImportError:
-        raise Exception("Could not import langchain-groq. Please run: pip install langchain-groq")
-    except Exception as e:
-        raise Exception(f"Failed to initialize Groq LLM: {str(e)}")
-
-# Initialize the LLM
-try:
-    llm = get_groq_llm()
-except Exception as e:
-    print(f"❌ LLM initialization failed: {e}")
-    llm = None
-
-# Instantiate the general search tool
-search_tool = DuckDuckGoSearchRun()
-
-# Gather all the tools for the main agent
-tools = [
-    search_tool,
-    weather_tool,
-    calendar_tool,
-    wikipedia_tool,
-    news_tool,
-    get_daily_stock_prices,
-    get_multiple_stock_prices,
-    create_stock_comparison_chart,
-    code_interpreter_tool,
-]
-
-# Create agent only if LLM is available
-agent = None
-if llm:
+# "react" parses one tool call per LLM round trip from text; "tool_calling" uses
+# the model's native tool calls, so several tools can run in the same step.
+AGENT_MODE = os.getenv("AGENT_MODE", "react").lower()
+
+# The LLM, the tools and the agent are built on first use (or by the startup
+# warm-up, see startup.py) rather than at import time, which keeps the server
+# quick to start. _NOT_BUILT marks what hasn't been built yet; None means
+# building failed (e.g. no LLM provider is configured).
+_NOT_BUILT = object()
+llm = _NOT_BUILT
+tools = _NOT_BUILT
+agent = _NOT_BUILT
+TOOLS_BY_NAME = {}
+_build_lock = threading.RLock()
+
+# Keeps the rolling summary of each session up to date when SESSION_MEMORY_MODE=summary.
+# Its LLM is set once the LLM has been built.
+summarizer = ConversationSummarizer(None)
+
+def _build_llm():
+    # The LLM is a failover chain over LLM_PROVIDERS (Groq first by default), with
+    # per-provider circuit breakers and optional hedging; see llm_providers.py.
+    # With CASSETTE_MODE set its calls are recorded or replayed (see cassette.py).
     try:
-        prompt = hub.pull("hwchase17/react-chat")
-        agent = create_react_agent(llm, tools, prompt)
-        print("✅ Agent initialized successfully with LangChain Hub prompt.")
+        model = cassette_llm(create_llm())
+        if model is None:
+            print("❌ LLM initialization failed: no LLM provider could be initialized (check GROQ_API_KEY / LLM_PROVIDERS).")
+        return model
     except Exception as e:
-        print(f"⚠ Hub prompt failed, using custom fallback prompt: {e}")
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a helpful AI assistant. You have access to a variety of tools to help you answer questions accurately."),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{input}"),
-            MessagesPlaceholder(variable_name="agent_scratchpad"),
-        ])
-        agent = create_react_agent(llm, tools, prompt)
-        print("✅ Agent initialized with custom prompt.")
-
-SESSION_STORE = {}
+        print(f"❌ LLM initialization failed: {e}")
+        return None
 
-def get_session_history(session_id: str, user_id: str) -> BaseChatMessageHistory:
-    """Retrieves session history from the in-memory cache, seeding from Firestore on a cold start."""
-    if session_id not in SESSION_STORE:
-        mem = ConversationBufferWindowMemory(
-            k=5,
-            memory_key="chat_history",
-            return_messages=True,
-        ).chat_memory
+def _build_tools() -> list:
+    # The tool modules pull in their client libraries, so they are imported here.
+    from langchain_community.tools import DuckDuckGoSearchRun
+    from app.core.tools.weather import weather_tool
+    from app.core.tools.calendar_tool import calendar_tool
+    from app.core.tools.wikipedia import wikipedia_tool
+    from app.core.tools.news import news_tool
+    from app.core.tools.financial_data import get_daily_stock_prices, get_multiple_stock_prices, create_stock_comparison_chart
+    from app.core.tools.code_interpreter import code_interpreter_tool
+
+    # Instantiate the general search tool
+    search_tool = DuckDuckGoSearchRun()
+
+    # Gather all the tools for the main agent. Results are cached per tool
+    # freshness policy (see tools/cache.py), and concurrent identical calls (same
+    # tool, same normalized arguments) share one upstream fetch. Upstream calls
+    # go through the cassette, so recordings hold what actually hit the network.
+    return [cache_tool(cassette_tool(tool)) for tool in [
+        search_tool,
+        weather_tool,
+        calendar_tool,
+        wikipedia_tool,
+        news_tool,
+        get_daily_stock_prices,
+        get_multiple_stock_prices,
+        create_stock_comparison_chart,
+        code_interpreter_tool,
+    ]]
+
+def get_llm():
+    """The agent's LLM, built on first call; None if no provider could be initialized."""
+    global llm
+    if llm is _NOT_BUILT:
+        with _build_lock:
+            if llm is _NOT_BUILT:
+                llm = _build_llm()
+                summarizer.llm = llm
+    return llm
+
+def get_tools() -> list:
+    """The agent's tools, built on first call."""
+    global tools
+    if tools is _NOT_BUILT:
+        with _build_lock:
+            if tools is _NOT_BUILT:
+                built = _build_tools()
+                for tool in built:
+                    TOOLS_BY_NAME.setdefault(tool.name, tool)
+                tools = built
+    return tools
+
+def get_agent():
+    """The agent, built (with the LLM and tools) on first call; None if the LLM is unavailable."""
+    global agent
+    if agent is _NOT_BUILT:
+        with _build_lock:
+            if agent is _NOT_BUILT:
+                model = get_llm()
+                # Create agent only if LLM is available
+                agent = create_agent(model, get_tools()) if model is not None else None
+    return agent
+
+def llm_stats():
+    """The LLM's provider stats, or None while it is unbuilt or unavailable (never builds it)."""
+    if llm is _NOT_BUILT or llm is None or not hasattr(llm, "stats"):
+        return None
+    return llm.stats()
 
+async def _ensure_agent():
+    """Builds the LLM, tools and agent off the event loop if a request needs them before the warm-up did."""
+    if agent is _NOT_BUILT or llm is _NOT_BUILT:
+        await run_blocking(IO_EXECUTOR, lambda: (get_llm(), get_agent()))
+
+def create_agent(llm, tools, mode: str = AGENT_MODE):
+    """
+    Builds the agent for `mode`: "react" (one tool per step, parsed from text)
+    or "tool_calling" (native tool calls, several per step, run concurrently).
+    """
+    if mode == "tool_calling":
+        agent = create_tool_calling_agent(llm, tools, create_agent_prompt())
+        print("✅ Agent initialized in tool-calling mode.")
+        return agent
+    # The hwchase17/react-chat prompt is vendored in prompts.py, so building
+    # the agent doesn't fetch it from LangChain Hub.
+    agent = create_react_agent(llm, tools, create_react_prompt())
+    print("✅ Agent initialized successfully.")
+    return agent
+
+def _seed_from_firestore(session_id: str, user_id: str):
+    def seed(history: BaseChatMessageHistory):
         # Seed from Firestore so context survives server restarts
-        past = get_recent_session_messages(user_id, session_id, limit=10)
+        past = get_recent_session_messages(user_id, session_id, limit=SESSION_WINDOW_TURNS * 2)
         for msg in past:
             if msg.get('sender') == 'user':
-                mem.add_user_message(msg['text'])
+                history.add_user_message(msg['text'])
             elif msg.get('sender') == 'agent':
-                mem.add_ai_message(msg['text'])
+                history.add_ai_message(msg['text'])
+    return seed
+
+def get_session_history(session_id: str, user_id: str) -> BaseChatMessageHistory:
+    """Retrieves session history from the in-memory cache, seeding from Firestore on a cold start."""
+    return session_store.get(user_id, session_id, seed=_seed_from_firestore(session_id, user_id))
+
+def _has_history(session_id: str, user_id: str) -> bool:
+    memory = get_session_history(session_id, user_id)
+    get_summary = getattr(memory, "get_summary", None)
+    return bool(memory.messages) or bool(get_summary and get_summary())
+
+async def session_has_history(session_id: str, user_id: str) -> bool:
+    """Whether the session already has turns (or a summary of them) that a new message could refer to."""
+    return await run_blocking(IO_EXECUTOR, _has_history, session_id, user_id)
+
+def _create_agent_executor() -> AgentExecutor:
+    return AgentExecutor(
+        agent=get_agent(),
+        tools=get_tools(),
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=5,
+        max_execution_time=60,
+        return_intermediate_steps=True,
+    )
+
+def _fixed_prompt_text() -> str:
+    """The parts of the prompt that don't change between requests: instructions and tool descriptions."""
+    instructions = REACT_CHAT_TEMPLATE if AGENT_MODE == "react" else SYSTEM_PROMPT
+    tool_text = "\n".join(f"{tool.name}: {tool.description} {json.dumps(tool.args)}" for tool in get_tools())
+    return f"{instructions}\n{tool_text}"
+
+async def _prepare_agent_inputs(user_input: str, session_id: str, user_id: str, query_vector: list = None):
+    """Assembles short-term memory and RAG context concurrently, fits them to the token budget and builds the executor inputs."""
+    context = await assemble_context(user_input, session_id, user_id, get_session_history, query_vector=query_vector)
+    with timing.span("prompt_budget"):
+        fitted = prompt_budget.fit(_fixed_prompt_text(), user_input, context["chat_history"], context["relevant_memories"])
+    relevant_memories = fitted["memories"]
+
+    if relevant_memories:
+        memory_context = "\n".join(relevant_memories)
+        enhanced_input = (
+            f"Here is some relevant context from our past conversations:\n"
+            f"<CONTEXT>\n{memory_context}\n</CONTEXT>\n\n"
+            f"Now, please answer the following question:\n{fitted['input']}"
+        )
+    else:
+        enhanced_input = fitted["input"]
+
+    context["used_history"] = bool(fitted["chat_history"])
+    context["used_memories"] = bool(relevant_memories)
+    return context, {"input": enhanced_input, "chat_history": fitted["chat_history"]}
+
+def _cacheable(context: dict, output: str, tools_used: list) -> bool:
+    """
+    Whether the answer cache may reuse this answer for a similar question in
+    another conversation: only complete answers that didn't draw on the chat
+    history, nor on recalled memories unless a tool's data grounds them.
+    """
+    if output.startswith("Agent stopped due to") or context.get("used_history"):
+        return False
+    return bool(tools_used) or not context.get("used_memories")
+
+def _summarize_later(session_id: str, user_id: str):
+    """Schedules the session's summary update; it runs after the answer has been returned."""
+    if SESSION_MEMORY_MODE == "summary":
+        summarizer.schedule((user_id, session_id), lambda: get_session_history(session_id, user_id))
 
-        SESSION_STORE[session_id] = mem
+async def _remember_turn(context: dict, session_id: str, user_id: str, user_input: str, output: str):
+    memory = await resolve_memory(context)
+    if memory is not None:
+        await run_blocking(IO_EXECUTOR, memory.add_messages, [HumanMessage(content=user_input), AIMessage(content=output)])
+        _summarize_later(session_id, user_id)
 
-    return SESSION_STORE[session_id]
+def record_turn(session_id: str, user_id: str, user_input: str, output: str):
+    """Appends a turn that was answered without running the agent (e.g. from the answer cache)."""
+    memory = get_session_history(session_id, user_id)
+    memory.add_messages([HumanMessage(content=user_input), AIMessage(content=output)])
 
-def run_agent(user_input: str, session_id: str, user_id: str) -> dict:
-    """Runs the agent executor with RAG, short-term memory, and robust error handling."""
+async def remember_turn(session_id: str, user_id: str, user_input: str, output: str):
+    """record_turn off the event loop, followed by the summary update."""
+    await run_blocking(IO_EXECUTOR, record_turn, session_id, user_id, user_input, output)
+    _summarize_later(session_id, user_id)
+
+def _tools_used(intermediate_steps) -> list:
+    # "_Exception" is the pseudo-tool AgentExecutor uses for parsing errors.
+    return [action.tool for action, _ in intermediate_steps if not action.tool.startswith("_")]
+
+async def _route(user_input: str, session_id: str, user_id: str):
+    """Returns the intent router's decision for the query, or None to run the full agent."""
+    if not ROUTER_ENABLED:
+        return None
+    try:
+        with timing.span("router"):
+            # Routed answers see neither the conversation nor memories, so a
+            # follow-up ("and in Paris?") has to go to the agent.
+            if await session_has_history(session_id, user_id):
+                return None
+            return await run_blocking(EMBEDDING_EXECUTOR, intent_router.classify, user_input)
+    except Exception as e:
+        print(f"⚠ Intent routing failed; using the agent: {e}")
+        return None
+
+async def _call_routed_tool(route: dict) -> str:
+    tool = TOOLS_BY_NAME.get(route["tool"]) or {tool.name: tool for tool in get_tools()}[route["tool"]]
+    output = await tool.ainvoke(route["arg"], config={"callbacks": [TimingCallbackHandler()]})
+    return str(output)
+
+async def _answer_routed(route: dict, user_input: str, session_id: str, user_id: str) -> str:
+    """Answers a routed query with one tool call plus a template or a single LLM formatting call."""
+    tool_output = await _call_routed_tool(route)
+    output = None
+    if uses_llm_formatting(route) and llm is not None:
+        try:
+            response = await llm.ainvoke(format_prompt(user_input, tool_output), config={"callbacks": [TimingCallbackHandler()]})
+            output = response.content
+        except Exception as e:
+            print(f"⚠ Formatting call failed; using the template: {e}")
+    if not output:
+        output = render_template(route, tool_output)
+    await remember_turn(session_id, user_id, user_input, output)
+    return output
+
+async def run_agent(user_input: str, session_id: str, user_id: str, query_vector: list = None) -> dict:
+    """Runs the agent executor with RAG, short-term memory, and robust error handling.
+
+    `query_vector` is the input's embedding when the caller already has it; the
+    memory search then reuses it instead of encoding the input again.
+
+    The LLM round trips are awaited natively; the blocking Firestore seeding and
+    embedding / Chroma lookups run concurrently on bounded executors (see context.py).
+    """
     
+    await _ensure_agent()
     if agent is None or llm is None:
         return {"output": "❌ Agent not initialized. Please check your GROQ_API_KEY and restart the server."}
     
+    started = time.perf_counter()
+    route = await _route(user_input, session_id, user_id)
+    if route is not None:
+        try:
+            output = await _answer_routed(route, user_input, session_id, user_id)
+            intent_router.record(route, (time.perf_counter() - started) * 1000)
+            return {"output": output, "tools_used": [route["tool"]], "cacheable": True, "routed": route["reason"]}
+        except Exception as e:
+            print(f"⚠ Routed tool call failed; using the agent: {e}")
+    
     try:
-        memory = get_session_history(session_id, user_id)
-        relevant_memories = search_user_memory(user_id, user_input)
-        
-        if relevant_memories:
-            memory_context = "\n".join(relevant_memories)
-            enhanced_input = (
-                f"Here is some relevant context from our past conversations:\n"
-                f"<CONTEXT>\n{memory_context}\n</CONTEXT>\n\n"
-                f"Now, please answer the following question:\n{user_input}"
-            )
-        else:
-            enhanced_input = user_input
-            
-        agent_executor = AgentExecutor(
-            agent=agent,
-            tools=tools,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=5,
-            max_execution_time=60
-        )
+        context, agent_inputs = await _prepare_agent_inputs(user_input, session_id, user_id, query_vector)
+        agent_executor = _create_agent_executor()
         
-        result = agent_executor.invoke({
-            "input": enhanced_input,
-            "chat_history": memory.messages,
-        })
+        result = await agent_executor.ainvoke(agent_inputs, config={"callbacks": [TimingCallbackHandler()]})
         
-        memory.add_user_message(user_input)
-        memory.add_ai_message(result.get("output", ""))
+        await _remember_turn(context, session_id, user_id, user_input, result.get("output", ""))
         
+        result["tools_used"] = _tools_used(result.get("intermediate_steps", []))
+        result["cacheable"] = _cacheable(context, result.get("output", ""), result["tools_used"])
+        intent_router.record(None, (time.perf_counter() - started) * 1000)
         return result
         
     except Exception as e:
@@ -155,7 +321,146 @@ def run_agent(user_input: str, session_id: str, user_id: str) -> dict:
         # Fallback to direct LLM call if the agent fails
         try:
             print("🔄 Falling back to direct LLM call...")
-            response = llm.invoke(user_input)
+            response = await llm.ainvoke(user_input, config={"callbacks": [TimingCallbackHandler()]})
             return {"output": response.content}
         except Exception as fallback_error:
             return {"output": f"I encountered an error while processing your request: {str(e)}"}
+
+class FinalAnswerFilter:
+    """Extracts the final-answer text from a streamed ReAct generation.
+
+    The ReAct prompt makes the model write "Thought: ... Final Answer: <answer>",
+    so tokens are held back until the marker has been seen and only the text
+    after it is released.
+    """
+    MARKER = "Final Answer:"
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buffer = ""
+        self._emitting = False
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        if not self._emitting:
+            self._buffer += text
+            index = self._buffer.find(self.MARKER)
+            if index == -1:
+                return ""
+            self._emitting = True
+            text = self._buffer[index + len(self.MARKER):]
+            self._buffer = ""
+        if not self._started:
+            # Drop the whitespace between the marker and the answer.
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+def _tool_output_preview(output, limit: int = 500) -> str:
+    text = getattr(output, "content", output)
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "…"
+
+async def stream_agent(user_input: str, session_id: str, user_id: str, query_vector: list = None):
+    """Runs the agent and yields progress events as they happen.
+
+    Yields dicts with a "type" of "tool_start", "tool_end", "token" (a chunk of
+    the final answer) and, always last, "final" carrying the complete output
+    (plus "tools_used" and "cacheable" when the agent run completed).
+    """
+    await _ensure_agent()
+    if agent is None or llm is None:
+        yield {"type": "final", "output": "❌ Agent not initialized. Please check your GROQ_API_KEY and restart the server."}
+        return
+
+    started = time.perf_counter()
+    route = await _route(user_input, session_id, user_id)
+    if route is not None:
+        try:
+            yield {"type": "tool_start", "tool": route["tool"], "input": route["arg"]}
+            tool_output = await _call_routed_tool(route)
+            yield {"type": "tool_end", "tool": route["tool"], "output": _tool_output_preview(tool_output)}
+            chunks = []
+            if uses_llm_formatting(route):
+                try:
+                    async for chunk in llm.astream(format_prompt(user_input, tool_output), config={"callbacks": [TimingCallbackHandler()]}):
+                        if chunk.content:
+                            chunks.append(chunk.content)
+                            yield {"type": "token", "text": chunk.content}
+                except Exception as e:
+                    print(f"⚠ Formatting call failed; using the template: {e}")
+            output = "".join(chunks)
+            if not chunks:
+                output = render_template(route, tool_output)
+                yield {"type": "token", "text": output}
+            await remember_turn(session_id, user_id, user_input, output)
+            intent_router.record(route, (time.perf_counter() - started) * 1000)
+            yield {"type": "final", "output": output, "tools_used": [route["tool"]], "cacheable": True}
+            return
+        except Exception as e:
+            print(f"⚠ Routed tool call failed; using the agent: {e}")
+
+    streamed_tokens = False
+    try:
+        context, agent_inputs = await _prepare_agent_inputs(user_input, session_id, user_id, query_vector)
+        agent_executor = _create_agent_executor()
+
+        # ReAct streams its thoughts too; only the text after "Final Answer:" goes to the client.
+        answer_filter = FinalAnswerFilter() if AGENT_MODE == "react" else None
+        output = None
+        tools_used = []
+        async for event in agent_executor.astream_events(
+            agent_inputs, config={"callbacks": [TimingCallbackHandler()]}, version="v2"
+        ):
+            kind = event["event"]
+            if kind == "on_chat_model_start":
+                if answer_filter is not None:
+                    answer_filter.reset()
+            elif kind == "on_chat_model_stream":
+                content = event["data"]["chunk"].content or ""
+                if not isinstance(content, str):
+                    content = ""
+                token = answer_filter.feed(content) if answer_filter is not None else content
+                if token:
+                    streamed_tokens = True
+                    yield {"type": "token", "text": token}
+            elif kind == "on_tool_start":
+                tools_used.append(event["name"])
+                yield {"type": "tool_start", "tool": event["name"], "input": event["data"].get("input")}
+            elif kind == "on_tool_end":
+                yield {"type": "tool_end", "tool": event["name"], "output": _tool_output_preview(event["data"].get("output"))}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                output = (event["data"].get("output") or {}).get("output")
+
+        if output is None:
+            raise Exception("Agent finished without producing an output.")
+
+        await _remember_turn(context, session_id, user_id, user_input, output)
+        intent_router.record(None, (time.perf_counter() - started) * 1000)
+        tools_used = [name for name in tools_used if not name.startswith("_")]
+        yield {
+            "type": "final",
+            "output": output,
+            "tools_used": tools_used,
+            "cacheable": _cacheable(context, output, tools_used),
+        }
+
+    except Exception as e:
+        print(f"❌ Agent streaming failed: {str(e)}")
+        if streamed_tokens:
+            yield {"type": "final", "output": f"I encountered an error while processing your request: {str(e)}"}
+            return
+
+        # Fallback to a direct (streamed) LLM call if the agent fails
+        try:
+            print("🔄 Falling back to direct LLM call...")
+            chunks = []
+            async for chunk in llm.astream(user_input, config={"callbacks": [TimingCallbackHandler()]}):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield {"type": "token", "text": chunk.content}
+            yield {"type": "final", "output": "".join(chunks)}
+        except Exception:
+            yield {"type": "final", "output": f"I encountered an error while processing your request: {str(e)}"}
@@ -0,0 +1,142 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Cosine similarity a new question needs with a cached one to reuse its answer.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# How long an answer stays fresh, by the tools the agent used to produce it.
+# The shortest TTL among the tools used wins; 0 means the answer is never cached.
+TOOL_TTL_SECONDS = {
+    "weather_tool": 10 * 60,
+    "news_tool": 15 * 60,
+    "get_daily_stock_prices": 15 * 60,
+    "get_multiple_stock_prices": 15 * 60,
+    "duckduckgo_search": 30 * 60,
+    "wikipedia_tool": 24 * 60 * 60,
+    # Personal, side-effecting or code-execution results are never reused.
+    "calendar_tool": 0,
+    "create_stock_comparison_chart": 0,
+    "code_interpreter_tool": 0,
+}
+UNKNOWN_TOOL_TTL_SECONDS = 5 * 60
+# Answers from the model alone; only those given without chat history or recalled memories are stored.
+NO_TOOL_TTL_SECONDS = 6 * 60 * 60
+
+# Rough per-entry overhead on top of the vector and answer text.
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+def answer_ttl(tools_used) -> int:
+    """Returns how long (seconds) an answer produced with these tools may be served from cache."""
+    tools_used = [name for name in tools_used if not name.startswith("_")]
+    if not tools_used:
+        return NO_TOOL_TTL_SECONDS
+    return min(TOOL_TTL_SECONDS.get(name, UNKNOWN_TOOL_TTL_SECONDS) for name in tools_used)
+
+
+class SemanticAnswerCache:
+    """
+    Per-user cache of agent answers keyed by the embedding of the question.
+    Callers only store answers that didn't depend on their conversation and
+    only look up the first message of a session (see chat.py and agent.py).
+
+    A lookup returns the freshest answer whose question embedding is at least
+    `similarity` cosine-similar to the new one. Entries expire by a TTL chosen
+    from the tools used, and the least recently used entries are evicted once
+    the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, similarity: float, max_bytes: int):
+        self.similarity = similarity
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._ids = itertools.count()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0}
+
+    def lookup(self, user_id: str, query_vector) -> str:
+        """Returns a cached answer for a semantically equivalent question, or None."""
+        query = np.asarray(query_vector, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            entry_ids = list(self._by_user.get(user_id, ()))
+            for entry_id in entry_ids:
+                if self._entries[entry_id]["expires_at"] <= now:
+                    self._remove(entry_id)
+                    self._stats["expirations"] += 1
+            entry_ids = list(self._by_user.get(user_id, ()))
+            if not entry_ids:
+                self._stats["misses"] += 1
+                return None
+
+            vectors = np.stack([self._entries[entry_id]["vector"] for entry_id in entry_ids])
+            scores = vectors @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                self._stats["misses"] += 1
+                return None
+
+            entry_id = entry_ids[best]
+            self._entries.move_to_end(entry_id)
+            self._stats["hits"] += 1
+            return self._entries[entry_id]["answer"]
+
+    def store(self, user_id: str, query_vector, answer: str, tools_used=()):
+        """Caches an answer unless one of the tools used makes it uncacheable."""
+        ttl = answer_ttl(tools_used)
+        if ttl <= 0:
+            return
+        vector = np.asarray(query_vector, dtype=np.float32)
+        size = vector.nbytes + len(answer.encode("utf-8")) + _ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "user_id": user_id,
+                "vector": vector,
+                "answer": answer,
+                "expires_at": time.time() + ttl,
+                "size": size,
+            }
+            self._by_user.setdefault(user_id, set()).add(entry_id)
+            self._bytes += size
+            self._stats["stores"] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def clear_user(self, user_id: str):
+        """Forgets every cached answer for a user (e.g. after their history is deleted)."""
+        with self._lock:
+            for entry_id in list(self._by_user.get(user_id, ())):
+                self._remove(entry_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._bytes -= entry["size"]
+        user_entries = self._by_user[entry["user_id"]]
+        user_entries.discard(entry_id)
+        if not user_entries:
+            del self._by_user[entry["user_id"]]
+
+
+answer_cache = SemanticAnswerCache(similarity=ANSWER_CACHE_SIMILARITY, max_bytes=ANSWER_CACHE_MAX_BYTES)
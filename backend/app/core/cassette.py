@@ -0,0 +1,395 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, message_chunk_to_message, messages_from_dict, messages_to_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from app.core.tools.wrappers import wrap_tool, invoke_tool, normalize_tool_args
+
+# "record" appends every LLM and tool call to CASSETTE_PATH, "replay" answers
+# them from it without touching the network, "off" leaves the calls alone.
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/session.jsonl")
+# Multiplier on the recorded latencies during replay: 0 answers instantly,
+# 1 reproduces the recorded timings.
+CASSETTE_REPLAY_LATENCY = float(os.getenv("CASSETTE_REPLAY_LATENCY", "0"))
+# When strict, a request that wasn't recorded verbatim fails instead of being
+# answered with the next unused recording of the same LLM or tool.
+CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "false").lower() == "true"
+
+CASSETTE_VERSION = 1
+
+# Inner calls don't report to the caller's callbacks; the cassette model already does.
+_INNER_CONFIG = {"callbacks": []}
+
+
+class CassetteMiss(LookupError):
+    """Raised during replay for a call the cassette has no recording for."""
+
+
+class RecordedError(Exception):
+    """A call that failed while recording fails again, with the recorded error, on replay."""
+
+
+def request_key(kind: str, name: str, request) -> str:
+    canonical = json.dumps([kind, name, request], sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded LLM and tool calls: the request, the response (or error) and how
+    long the call took.
+
+    The file is JSON lines: a header, then one recorded call per line. While
+    recording, each call is appended as one line under the lock, so parallel
+    calls (and a crew recording from its own process) never rewrite each
+    other's output; delete the file to record from scratch.
+
+    On replay a call gets the recording with the same request; if there is
+    none, it gets the next unused recording of the same LLM or tool (unless
+    strict), so small prompt changes don't break a cassette but still show up
+    in the stats as order matches.
+    """
+
+    def __init__(self, path: str, mode: str = "off", replay_latency: float = 0.0, strict: bool = False):
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._interactions = []
+        self._by_key = {}
+        self._by_name = {}
+        self._used = set()
+        self._stats = {"recorded": 0, "exact": 0, "repeated": 0, "by_order": 0, "misses": 0, "call_latency_ms": 0.0}
+        if mode == "replay":
+            try:
+                self.load()
+            except (OSError, ValueError) as e:
+                print(f"❌ Could not load cassette {path}; every call will miss: {e}")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def load(self):
+        interactions = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            # Cassettes recorded before the JSON-lines format are one JSON document.
+            interactions = json.loads(text).get("interactions", [])
+        except ValueError:
+            for line in text.splitlines():
+                if line.strip():
+                    entry = json.loads(line)
+                    if "version" not in entry:
+                        interactions.append(entry)
+        with self._lock:
+            self._interactions = []
+            self._by_key.clear()
+            self._by_name.clear()
+            self._used.clear()
+            for interaction in interactions:
+                self._index(interaction)
+        print(f"📼 Replaying {len(self._interactions)} recorded calls from {self.path}")
+
+    def save(self):
+        """Rewrites the whole file from the calls in memory; recording only appends."""
+        with self._lock:
+            self._ensure_directory()
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self._line({"version": CASSETTE_VERSION}))
+                f.writelines(self._line(interaction) for interaction in self._interactions)
+            os.replace(tmp_path, self.path)
+
+    def _ensure_directory(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _line(entry: dict) -> str:
+        return json.dumps(entry, default=str, separators=(",", ":")) + "\n"
+
+    def _append(self, interaction: dict):
+        # Called with the lock held. One write per line, in append mode, so
+        # lines from other threads or processes never interleave.
+        self._ensure_directory()
+        with open(self.path, "a", encoding="utf-8") as f:
+            if f.tell() == 0:
+                f.write(self._line({"version": CASSETTE_VERSION}))
+            f.write(self._line(interaction))
+
+    def record(self, kind: str, name: str, request, response=None, latency_ms: float = 0.0, error: Exception = None, **extra):
+        interaction = {
+            "kind": kind,
+            "name": name,
+            "key": request_key(kind, name, request),
+            "request": request,
+            "response": response,
+            "latency_ms": round(latency_ms, 3),
+            **extra,
+        }
+        if error is not None:
+            interaction["error"] = {"type": type(error).__name__, "message": str(error)}
+        with self._lock:
+            self._index(interaction)
+            self._stats["recorded"] += 1
+            self._stats["call_latency_ms"] += interaction["latency_ms"]
+            self._append(interaction)
+
+    def replay(self, kind: str, name: str, request) -> dict:
+        """The recording that answers this call; raises CassetteMiss if there is none."""
+        key = request_key(kind, name, request)
+        with self._lock:
+            exact = self._by_key.get(key, [])
+            for index in exact:
+                if index not in self._used:
+                    return self._take(index, "exact")
+            if exact:
+                # The same request again (a retry, or a repeated prompt).
+                return self._take(exact[-1], "repeated")
+            if not self.strict:
+                for index in self._by_name.get((kind, name), []):
+                    if index not in self._used:
+                        return self._take(index, "by_order")
+            self._stats["misses"] += 1
+        raise CassetteMiss(f"No recorded {kind} call to {name} matches this request (cassette {self.path}).")
+
+    def call(self, kind: str, name: str, request, fn, encode=None, decode=None):
+        """Runs fn() through the cassette: recorded, replayed, or passed through when off."""
+        if self.replaying:
+            interaction = self.replay(kind, name, request)
+            self.sleep(interaction["latency_ms"])
+            response = self.result(interaction)
+            return decode(response) if decode else response
+        if not self.recording:
+            return fn()
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            self.record(kind, name, request, latency_ms=(time.perf_counter() - start) * 1000, error=e)
+            raise
+        self.record(kind, name, request, encode(result) if encode else result, (time.perf_counter() - start) * 1000)
+        return result
+
+    async def acall(self, kind: str, name: str, request, fn, encode=None, decode=None):
+        """call() for a coroutine function."""
+        if self.replaying:
+            interaction = self.replay(kind, name, request)
+            await self.asleep(interaction["latency_ms"])
+            response = self.result(interaction)
+            return decode(response) if decode else response
+        if not self.recording:
+            return await fn()
+        start = time.perf_counter()
+        try:
+            result = await fn()
+        except Exception as e:
+            self.record(kind, name, request, latency_ms=(time.perf_counter() - start) * 1000, error=e)
+            raise
+        self.record(kind, name, request, encode(result) if encode else result, (time.perf_counter() - start) * 1000)
+        return result
+
+    @staticmethod
+    def result(interaction: dict):
+        error = interaction.get("error")
+        if error:
+            raise RecordedError(f"{error['type']}: {error['message']}")
+        return interaction["response"]
+
+    def sleep(self, latency_ms: float):
+        if self.replay_latency > 0 and latency_ms:
+            time.sleep(latency_ms * self.replay_latency / 1000)
+
+    async def asleep(self, latency_ms: float):
+        if self.replay_latency > 0 and latency_ms:
+            await asyncio.sleep(latency_ms * self.replay_latency / 1000)
+
+    def recorded_latency_ms(self) -> dict:
+        """Total recorded latency per kind of call, e.g. {"llm": 5400.0, "tool": 1200.0}."""
+        with self._lock:
+            totals = {}
+            for interaction in self._interactions:
+                totals[interaction["kind"]] = totals.get(interaction["kind"], 0.0) + interaction["latency_ms"]
+            return totals
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path if self.mode != "off" else None,
+                "interactions": len(self._interactions),
+                "unused": len(self._interactions) - len(self._used) if self.replaying else None,
+                **self._stats,
+            }
+
+    def _index(self, interaction: dict):
+        index = len(self._interactions)
+        self._interactions.append(interaction)
+        self._by_key.setdefault(interaction["key"], []).append(index)
+        self._by_name.setdefault((interaction["kind"], interaction["name"]), []).append(index)
+
+    def _take(self, index: int, how: str) -> dict:
+        self._used.add(index)
+        self._stats[how] += 1
+        self._stats["call_latency_ms"] += self._interactions[index]["latency_ms"]
+        return self._interactions[index]
+
+
+cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, replay_latency=CASSETTE_REPLAY_LATENCY, strict=CASSETTE_STRICT)
+
+
+def _canonical_message(message) -> dict:
+    # Only what the model sees; run ids and response metadata differ between runs.
+    data = {"type": message.type, "content": message.content}
+    if getattr(message, "tool_calls", None):
+        data["tool_calls"] = [{"name": c["name"], "args": c["args"], "id": c.get("id")} for c in message.tool_calls]
+    if getattr(message, "tool_call_id", None):
+        data["tool_call_id"] = message.tool_call_id
+    return data
+
+
+def _to_message(response: dict):
+    if "message" in response:
+        return messages_from_dict([response["message"]])[0]
+    merged = AIMessageChunk(content="")
+    for chunk in messages_from_dict(response["chunks"]):
+        merged = merged + chunk
+    return message_chunk_to_message(merged)
+
+
+def _as_chunk(message) -> AIMessageChunk:
+    if isinstance(message, AIMessageChunk):
+        return message
+    return AIMessageChunk(
+        content=message.content,
+        additional_kwargs=message.additional_kwargs,
+        response_metadata=message.response_metadata,
+        tool_call_chunks=[
+            {"name": c["name"], "args": json.dumps(c["args"]), "id": c.get("id"), "index": i}
+            for i, c in enumerate(getattr(message, "tool_calls", None) or [])
+        ],
+    )
+
+
+def _to_chunks(response: dict) -> list:
+    if "chunks" in response:
+        return messages_from_dict(response["chunks"])
+    return [_as_chunk(messages_from_dict([response["message"]])[0])]
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Records the calls made to `inner` into the cassette, or answers them from
+    it on replay (where `inner` may be None). Streamed calls keep their chunks
+    and time to first token, so streaming replays chunk by chunk.
+    """
+
+    inner: object = None
+    cassette: object = None
+    tool_names: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def bind_tools(self, tools, **kwargs):
+        return CassetteChatModel(
+            inner=self.inner.bind_tools(tools, **kwargs) if self.inner is not None else None,
+            cassette=self.cassette,
+            tool_names=[convert_to_openai_tool(t)["function"]["name"] for t in tools],
+        )
+
+    def stats(self) -> dict:
+        # The cassette reports its own stats; these are the wrapped model's.
+        return self.inner.stats() if hasattr(self.inner, "stats") else {}
+
+    def _request(self, messages, stop) -> dict:
+        return {"messages": [_canonical_message(m) for m in messages], "tools": self.tool_names, "stop": stop}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.cassette.call(
+            "llm", "chat", self._request(messages, stop),
+            lambda: self.inner.invoke(messages, config=_INNER_CONFIG, stop=stop, **kwargs),
+            encode=lambda m: {"message": messages_to_dict([m])[0]},
+            decode=_to_message,
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        async def call():
+            return await self.inner.ainvoke(messages, config=_INNER_CONFIG, stop=stop, **kwargs)
+
+        message = await self.cassette.acall(
+            "llm", "chat", self._request(messages, stop), call,
+            encode=lambda m: {"message": messages_to_dict([m])[0]},
+            decode=_to_message,
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        request = self._request(messages, stop)
+        if self.cassette.replaying:
+            interaction = self.cassette.replay("llm", "chat", request)
+            chunks = _to_chunks(self.cassette.result(interaction))
+            first_ms = interaction.get("first_token_ms", interaction["latency_ms"])
+            rest_ms = max(0.0, interaction["latency_ms"] - first_ms) / max(1, len(chunks) - 1)
+            for i, chunk in enumerate(chunks):
+                await self.cassette.asleep(first_ms if i == 0 else rest_ms)
+                yield ChatGenerationChunk(message=chunk)
+            return
+
+        start = time.perf_counter()
+        first_ms = None
+        recorded = []
+        try:
+            async for message in self.inner.astream(messages, config=_INNER_CONFIG, stop=stop, **kwargs):
+                if first_ms is None:
+                    first_ms = (time.perf_counter() - start) * 1000
+                chunk = _as_chunk(message)
+                recorded.append(chunk)
+                yield ChatGenerationChunk(message=chunk)
+        except Exception as e:
+            self.cassette.record("llm", "chat", request, latency_ms=(time.perf_counter() - start) * 1000, error=e)
+            raise
+        self.cassette.record(
+            "llm", "chat", request, {"chunks": messages_to_dict(recorded)},
+            (time.perf_counter() - start) * 1000, first_token_ms=round(first_ms or 0.0, 3),
+        )
+
+
+def cassette_llm(llm, cassette: Cassette = cassette):
+    """Puts `llm` behind the cassette when recording or replaying; returns it unchanged otherwise."""
+    if cassette.mode == "off":
+        return llm
+    if llm is None and not cassette.replaying:
+        return None
+    return CassetteChatModel(inner=llm, cassette=cassette)
+
+
+def cassette_tool(tool: BaseTool, cassette: Cassette = cassette) -> BaseTool:
+    """Records or replays the tool's calls; returns the tool unchanged when the cassette is off."""
+    if cassette.mode == "off":
+        return tool
+    return wrap_tool(
+        tool,
+        lambda args: cassette.call(
+            "tool", tool.name, {"args": normalize_tool_args(tool.name, args)}, lambda: invoke_tool(tool, args)
+        ),
+    )
@@ -0,0 +1,66 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+class LazyThreadPool(Executor):
+    """
+    A ThreadPoolExecutor created on first use, and created again on the next
+    submit after shutdown(). The pools below are module-level, but the app
+    lifespan that shuts them down can run more than once in a process (a second
+    TestClient context, an in-process server restart).
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+            return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+# Blocking work is split across two bounded pools so a burst of slow Firestore
+# round trips can't starve embedding / Chroma work (and vice versa), and so
+# neither can exhaust the loop's default executor that LangChain uses for tools.
+IO_EXECUTOR = LazyThreadPool(
+    max_workers=int(os.getenv("IO_EXECUTOR_WORKERS", "8")),
+    thread_name_prefix="io",
+)
+# The model runs in the embedding batcher's single thread (see
+# embedding_service.py); these workers mostly wait on it and on Chroma, and the
+# more of them are waiting, the larger the batches get.
+EMBEDDING_EXECUTOR = LazyThreadPool(
+    max_workers=int(os.getenv("EMBEDDING_EXECUTOR_WORKERS", "8")),
+    thread_name_prefix="embedding",
+)
+
+
+async def run_blocking(executor, func, *args, **kwargs):
+    """Runs a blocking callable on the given executor without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    # Copy the caller's context so context variables (per-request state,
+    # LangChain run config) are visible inside the worker thread.
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+
+def shutdown_executors():
+    """
+    Waits for queued blocking work to finish. Called from the app lifespan on
+    shutdown; the pools start again on their next use.
+    """
+    IO_EXECUTOR.shutdown(wait=True)
+    EMBEDDING_EXECUTOR.shutdown(wait=True)
@@ -0,0 +1,84 @@
+import asyncio
+import os
+
+from app.core import timing
+from app.core.concurrency import run_blocking, IO_EXECUTOR, EMBEDDING_EXECUTOR
+from app.core.summary_memory import prompt_messages
+from app.services.vector_db_service import search_user_memory
+
+# Per-stage budgets for the pre-LLM context assembly. A stage that overruns
+# its budget is skipped for this request instead of delaying the LLM call.
+HISTORY_TIMEOUT_SECONDS = float(os.getenv("CONTEXT_HISTORY_TIMEOUT_SECONDS", "2.0"))
+RAG_TIMEOUT_SECONDS = float(os.getenv("CONTEXT_RAG_TIMEOUT_SECONDS", "1.0"))
+
+
+async def _run_stage(name: str, coro, timeout: float, default):
+    """
+    Awaits one context stage for at most `timeout` seconds.
+
+    Returns (value, task). On timeout the stage keeps running in the background
+    and `task` can still be awaited later; on error `default` is returned.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        with timing.span(f"context.{name}"):
+            return await asyncio.wait_for(asyncio.shield(task), timeout), task
+    except asyncio.TimeoutError:
+        print(f"⚠ Context stage '{name}' exceeded {timeout}s; continuing without it.")
+        timing.increment(f"context_{name}_timeouts")
+        return default, task
+    except Exception as e:
+        print(f"⚠ Context stage '{name}' failed; continuing without it: {e}")
+        return default, None
+
+
+def _load_history(get_session_history, session_id: str, user_id: str):
+    # Reading the messages may hit a shared store too, so it happens in the worker thread.
+    memory = get_session_history(session_id, user_id)
+    return memory, prompt_messages(memory)
+
+
+async def assemble_context(user_input: str, session_id: str, user_id: str, get_session_history, query_vector: list = None) -> dict:
+    """
+    Loads short-term memory and RAG hits concurrently, each under its own timeout.
+    The RAG search reuses `query_vector`, the input's embedding, when given.
+
+    Returns a dict with the session `memory` (None if it wasn't ready in time),
+    the `chat_history` messages, the `relevant_memories` from the vector DB and
+    `history_task`, which resolves to the memory once seeding finishes.
+    """
+    ((memory, chat_history), history_task), (relevant_memories, _) = await asyncio.gather(
+        _run_stage(
+            "history",
+            run_blocking(IO_EXECUTOR, _load_history, get_session_history, session_id, user_id),
+            HISTORY_TIMEOUT_SECONDS,
+            (None, []),
+        ),
+        _run_stage(
+            "rag",
+            run_blocking(EMBEDDING_EXECUTOR, search_user_memory, user_id, user_input,
+                         **({"query_embedding": query_vector} if query_vector is not None else {})),
+            RAG_TIMEOUT_SECONDS,
+            [],
+        ),
+    )
+    return {
+        "memory": memory,
+        "history_task": history_task,
+        "chat_history": chat_history,
+        "relevant_memories": relevant_memories,
+    }
+
+
+async def resolve_memory(context: dict):
+    """Returns the session memory, waiting for a timed-out history stage if needed."""
+    if context["memory"] is not None:
+        return context["memory"]
+    if context["history_task"] is None:
+        return None
+    try:
+        memory, _ = await context["history_task"]
+        return memory
+    except Exception as e:
+        print(f"Could not load session memory: {e}")
+        return None
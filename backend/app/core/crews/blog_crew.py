@@ -1,7 +1,12 @@
 import os
+import time
 from crewai import Agent, Task, Crew, Process
 from crewai.llm import LLM
 
+from app.core.llm_providers import crew_providers, Provider, LLM_PROVIDERS, LLMUnavailable
+from app.core.cassette import cassette
+from app.core.crews.cassette import cassette_crew_llm, cassette_crew_tools
+
 
 def _get_search_tools():
     tools = []
@@ -27,28 +32,7 @@ def _get_search_tools():
     return tools
 
 
-def _get_groq_llm():
-    groq_api_key = os.getenv("GROQ_API_KEY")
-    if not groq_api_key:
-        raise Exception("GROQ_API_KEY not found in environment.")
-    return LLM(
-        model="groq/llama-3.3-70b-versatile",
-        api_key=groq_api_key,
-        temperature=0.7,
-    )
-
-
-def create_blog_post_crew(topic: str) -> str:
-    """Creates and executes a CrewAI blog post pipeline for the given topic."""
-    print(f"Creating blog post crew for topic: {topic}")
-
-    try:
-        llm = _get_groq_llm()
-    except Exception as e:
-        return f"Cannot start blog crew: {e}"
-
-    available_tools = _get_search_tools()
-
+def _build_crew(topic: str, llm, available_tools) -> Crew:
     researcher = Agent(
         role='Senior Research Analyst',
         goal='Uncover groundbreaking technologies and trends on a given topic using available research tools.',
@@ -113,14 +97,62 @@ def create_blog_post_crew(topic: str) -> str:
         verbose=True,
     )
 
-    try:
-        result = blog_crew.kickoff()
-        print("Blog post creation completed successfully.")
-        return str(result)
-    except Exception as e:
-        print(f"Error executing blog crew: {e}")
-        return (
-            "I apologize, but my AI crew is a bit overwhelmed at the moment. "
-            "This can happen with very broad or complex topics that require a lot of research. "
-            "Please try again in a few moments, or try a more specific topic."
-        )
+    return blog_crew
+
+
+def create_blog_post_crew(topic: str, provider_names: list = None, outcomes: list = None) -> str:
+    """
+    Creates and executes a CrewAI blog post pipeline for the given topic.
+
+    The crew runs on the first provider in `provider_names` (LLM_PROVIDERS by
+    default) whose circuit is closed; if its run fails, the whole crew is
+    retried on the next provider. Each provider's result is recorded in its
+    health, or, when `outcomes` is given (a crew job in a worker process),
+    appended to it for the server to record.
+
+    Raises LLMUnavailable when no provider is configured or every one failed.
+    """
+    print(f"Creating blog post crew for topic: {topic}")
+
+    providers = crew_providers(LLM_PROVIDERS if provider_names is None else provider_names)
+    if cassette.replaying:
+        # The recorded answers stand in for the provider, so no API key is needed.
+        providers = [Provider("cassette", None, crew_kwargs={})]
+    if not providers:
+        raise LLMUnavailable("Cannot start blog crew: no LLM provider is configured (check GROQ_API_KEY / LLM_PROVIDERS).")
+
+    available_tools = cassette_crew_tools(_get_search_tools())
+
+    for provider in providers:
+        if outcomes is None and not provider.health.available():
+            continue
+        started = time.perf_counter()
+        try:
+            llm = cassette_crew_llm(None if cassette.replaying else LLM(**provider.crew_kwargs))
+            blog_crew = _build_crew(topic, llm, available_tools)
+            result = blog_crew.kickoff()
+            _report(provider, outcomes, (time.perf_counter() - started) * 1000)
+            print(f"Blog post creation completed successfully on {provider.name}.")
+            return str(result)
+        except Exception as e:
+            _report(provider, outcomes, (time.perf_counter() - started) * 1000, e)
+            print(f"Error executing blog crew on {provider.name}: {e}")
+
+    raise LLMUnavailable(
+        "I apologize, but my AI crew is a bit overwhelmed at the moment. "
+        "This can happen with very broad or complex topics that require a lot of research. "
+        "Please try again in a few moments, or try a more specific topic."
+    )
+
+
+def _report(provider: Provider, outcomes, elapsed_ms: float, error: Exception = None):
+    if outcomes is not None:
+        outcomes.append({
+            "provider": provider.name,
+            "elapsed_ms": elapsed_ms,
+            "error": None if error is None else f"{type(error).__name__}: {error}",
+        })
+    elif error is None:
+        provider.health.record_success(elapsed_ms)
+    else:
+        provider.health.record_failure(error)
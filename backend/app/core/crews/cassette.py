@@ -0,0 +1,92 @@
+from typing import Any
+
+from crewai.llms.base_llm import BaseLLM
+from crewai.tools import BaseTool
+
+from app.core.cassette import cassette as default_cassette, Cassette
+
+
+def _message_text(message) -> Any:
+    if isinstance(message, dict):
+        return {"role": message.get("role"), "content": message.get("content")}
+    return str(message)
+
+
+class CassetteCrewLLM(BaseLLM):
+    """
+    CrewAI LLM that records the calls made to `inner` into the cassette, or
+    answers them from it on replay (where `inner` may be None).
+
+    Native function calling is reported as unsupported so that the crew drives
+    its tools through text prompts in both modes, and every tool call goes
+    through the (recorded) tools rather than the provider's own loop.
+    """
+
+    inner: Any = None
+    cassette: Any = None
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, from_task=None, from_agent=None, response_model=None):
+        if isinstance(messages, str):
+            request_messages = messages
+        else:
+            request_messages = [_message_text(m) for m in messages]
+        request = {
+            "messages": request_messages,
+            "response_model": response_model.__name__ if response_model is not None else None,
+        }
+
+        def encode(result):
+            return result.model_dump() if hasattr(result, "model_dump") else result
+
+        def decode(response):
+            if response_model is not None and isinstance(response, dict):
+                return response_model.model_validate(response)
+            return response
+
+        return self.cassette.call(
+            "crew_llm", "crew", request,
+            lambda: self.inner.call(messages, callbacks=callbacks, from_task=from_task, from_agent=from_agent, response_model=response_model),
+            encode=encode,
+            decode=decode,
+        )
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+    def get_context_window_size(self) -> int:
+        if self.inner is not None:
+            return self.inner.get_context_window_size()
+        return super().get_context_window_size()
+
+
+class CassetteCrewTool(BaseTool):
+    """A CrewAI tool whose calls are recorded into, or replayed from, the cassette."""
+
+    tool: Any = None
+    cassette: Any = None
+
+    def _run(self, **kwargs) -> Any:
+        return self.cassette.call("crew_tool", self.name, {"args": kwargs}, lambda: self.tool._run(**kwargs))
+
+
+def cassette_crew_llm(llm, cassette: Cassette = default_cassette):
+    """Puts a CrewAI LLM behind the cassette; on replay `llm` may be None. Unchanged when the cassette is off."""
+    if cassette.mode == "off":
+        return llm
+    model = getattr(llm, "model", None) or "cassette"
+    return CassetteCrewLLM(model=model, inner=llm, cassette=cassette)
+
+
+def cassette_crew_tools(tools: list, cassette: Cassette = default_cassette) -> list:
+    if cassette.mode == "off":
+        return tools
+    return [
+        CassetteCrewTool(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            tool=tool,
+            cassette=cassette,
+        )
+        for tool in tools
+    ]
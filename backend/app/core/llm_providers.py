@@ -0,0 +1,407 @@
+import asyncio
+import os
+import threading
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.core import timing
+
+# Providers tried in order, e.g. "groq,ollama". Ollama is only used when listed.
+LLM_PROVIDERS = [name.strip().lower() for name in os.getenv("LLM_PROVIDERS", "groq").split(",") if name.strip()]
+# When > 0, a second provider is started if the first hasn't produced a token
+# (or, without streaming, an answer) within this many milliseconds.
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+LLM_PROVIDER_TIMEOUT_SECONDS = float(os.getenv("LLM_PROVIDER_TIMEOUT_SECONDS", "30"))
+# Retries inside one provider's client; failing over to the next provider is usually faster.
+LLM_PROVIDER_MAX_RETRIES = int(os.getenv("LLM_PROVIDER_MAX_RETRIES", "1"))
+# Consecutive failures that open a provider's circuit, and how long it stays open.
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
+GROQ_CREW_MODEL = os.getenv("GROQ_CREW_MODEL", "llama-3.3-70b-versatile")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+
+# Inner provider calls don't report to the caller's callbacks; the failover model already does.
+_INNER_CONFIG = {"callbacks": []}
+
+
+class LLMUnavailable(Exception):
+    """Raised when every provider failed or has its circuit open."""
+
+
+class ProviderHealth:
+    """
+    Success/failure counters, latency and circuit breaker of one provider.
+
+    After `failure_threshold` consecutive failures the circuit opens and the
+    provider is skipped for `reset_seconds`. It is then tried again: a success
+    closes the circuit, a failure opens it for another period.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._latency_ms = None
+        self._stats = {"successes": 0, "failures": 0, "circuit_opened": 0, "hedges_won": 0}
+        self._last_error = None
+
+    def available(self) -> bool:
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = "half_open"
+            return self._state != "open"
+
+    def record_success(self, elapsed_ms: float):
+        with self._lock:
+            self._state = "closed"
+            self._consecutive_failures = 0
+            self._stats["successes"] += 1
+            # Exponentially weighted, so a slow spell shows up quickly.
+            self._latency_ms = elapsed_ms if self._latency_ms is None else 0.8 * self._latency_ms + 0.2 * elapsed_ms
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self._stats["failures"] += 1
+            self._consecutive_failures += 1
+            self._last_error = f"{type(error).__name__}: {error}"[:300]
+            if self._state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._stats["circuit_opened"] += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+        print(f"⚠ LLM provider '{self.name}' failed: {self._last_error}")
+
+    def record_hedge_won(self):
+        with self._lock:
+            self._stats["hedges_won"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "latency_ms_ewma": round(self._latency_ms, 1) if self._latency_ms is not None else None,
+                "last_error": self._last_error,
+            }
+
+
+class Provider:
+    """One LLM backend: its LangChain chat model, health, and CrewAI LLM settings."""
+
+    def __init__(self, name: str, model, health: ProviderHealth = None, crew_kwargs: dict = None, timeout: float = LLM_PROVIDER_TIMEOUT_SECONDS):
+        self.name = name
+        self.model = model
+        self.health = health or ProviderHealth(name)
+        self.crew_kwargs = crew_kwargs
+        self.timeout = timeout
+
+    def with_model(self, model) -> "Provider":
+        """The same provider (sharing its health) around a derived model, e.g. one with tools bound."""
+        return Provider(self.name, model, self.health, self.crew_kwargs, self.timeout)
+
+
+class FailoverChatModel(BaseChatModel):
+    """
+    A chat model that sends each call to the first healthy provider in order
+    and fails over to the next one on errors or timeouts.
+
+    With `hedge_after_ms` set, async calls also start the next provider when
+    the current one hasn't produced its first token in time, and use whichever
+    answers first; the other call is cancelled.
+    """
+
+    providers: list
+    hedge_after_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "failover"
+
+    def bind_tools(self, tools, **kwargs):
+        return FailoverChatModel(
+            providers=[p.with_model(p.model.bind_tools(tools, **kwargs)) for p in self.providers],
+            hedge_after_ms=self.hedge_after_ms,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "order": [p.name for p in self.providers],
+            "hedge_after_ms": self.hedge_after_ms,
+            "providers": {p.name: p.health.stats() for p in self.providers},
+        }
+
+    def _candidates(self) -> list:
+        candidates = [p for p in self.providers if p.health.available()]
+        if not candidates:
+            raise LLMUnavailable("All LLM providers are unavailable (circuits open).")
+        return candidates
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        errors = []
+        for provider in self._candidates():
+            start = time.perf_counter()
+            try:
+                message = provider.model.invoke(messages, config=_INNER_CONFIG, stop=stop, **kwargs)
+            except Exception as e:
+                provider.health.record_failure(e)
+                errors.append(f"{provider.name}: {e}")
+                continue
+            provider.health.record_success((time.perf_counter() - start) * 1000)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        raise LLMUnavailable("; ".join(errors))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        errors = []
+        for provider in self._candidates():
+            start = time.perf_counter()
+            stream = provider.model.stream(messages, config=_INNER_CONFIG, stop=stop, **kwargs)
+            try:
+                first = next(stream, None)
+            except Exception as e:
+                provider.health.record_failure(e)
+                errors.append(f"{provider.name}: {e}")
+                continue
+            provider.health.record_success((time.perf_counter() - start) * 1000)
+            if first is not None:
+                yield ChatGenerationChunk(message=_as_chunk(first))
+            for message in stream:
+                yield ChatGenerationChunk(message=_as_chunk(message))
+            return
+        raise LLMUnavailable("; ".join(errors))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        async def call(provider):
+            return await provider.model.ainvoke(messages, config=_INNER_CONFIG, stop=stop, **kwargs)
+
+        _, message = await self._race(call)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async def open_stream(provider):
+            stream = provider.model.astream(messages, config=_INNER_CONFIG, stop=stop, **kwargs)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        _, (stream, first) = await self._race(open_stream, discard=lambda opened: opened[0].aclose())
+        try:
+            if first is not None:
+                yield ChatGenerationChunk(message=_as_chunk(first))
+            async for message in stream:
+                yield ChatGenerationChunk(message=_as_chunk(message))
+        finally:
+            await stream.aclose()
+
+    async def _race(self, start, discard=None):
+        """
+        Runs start(provider) on the candidates in order until one succeeds,
+        hedging onto the next candidate if the current one is slow.
+        Returns (provider, result); results of calls that lose a race are passed to discard().
+        """
+        candidates = self._candidates()
+        pending = {}
+        errors = []
+        next_index = 0
+        hedged = False
+
+        def launch():
+            nonlocal next_index
+            provider = candidates[next_index]
+            next_index += 1
+            pending[asyncio.ensure_future(self._timed(provider, start))] = provider
+
+        launch()
+        try:
+            while pending:
+                can_hedge = self.hedge_after_ms > 0 and not hedged and next_index < len(candidates)
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.hedge_after_ms / 1000 if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    timing.increment("llm_hedges")
+                    launch()
+                    continue
+
+                winner = None
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        provider.health.record_failure(e)
+                        errors.append(f"{provider.name}: {e}")
+                        continue
+                    if winner is None:
+                        winner = (provider, result)
+                    elif discard is not None:
+                        await discard(result)
+                if winner is not None:
+                    if hedged and winner[0] is not candidates[0]:
+                        winner[0].health.record_hedge_won()
+                    return winner
+                if not pending and next_index < len(candidates):
+                    timing.increment("llm_failovers")
+                    launch()
+            raise LLMUnavailable("; ".join(errors))
+        finally:
+            for task in pending:
+                task.cancel()
+            for task, provider in list(pending.items()):
+                try:
+                    result = await task
+                except BaseException:
+                    continue
+                if discard is not None:
+                    await discard(result)
+
+    @staticmethod
+    async def _timed(provider: Provider, start):
+        began = time.perf_counter()
+        result = await asyncio.wait_for(start(provider), provider.timeout)
+        provider.health.record_success((time.perf_counter() - began) * 1000)
+        return result
+
+
+def _as_chunk(message) -> AIMessageChunk:
+    if isinstance(message, AIMessageChunk):
+        return message
+    return AIMessageChunk(
+        content=message.content,
+        additional_kwargs=getattr(message, "additional_kwargs", {}),
+        response_metadata=getattr(message, "response_metadata", {}),
+    )
+
+
+def build_groq_provider():
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        print("⚠ GROQ_API_KEY not found; skipping the Groq provider.")
+        return None
+    from langchain_groq import ChatGroq
+
+    model = ChatGroq(
+        groq_api_key=api_key,
+        model_name=GROQ_MODEL,
+        base_url=GROQ_BASE_URL,
+        temperature=0.7,
+        max_retries=LLM_PROVIDER_MAX_RETRIES,
+        timeout=LLM_PROVIDER_TIMEOUT_SECONDS,
+    )
+    crew_kwargs = {"model": f"groq/{GROQ_CREW_MODEL}", "api_key": api_key, "temperature": 0.7}
+    if GROQ_BASE_URL:
+        crew_kwargs["base_url"] = GROQ_BASE_URL
+    return Provider("groq", model, crew_kwargs=crew_kwargs)
+
+
+def build_ollama_provider():
+    try:
+        from langchain_ollama import ChatOllama
+    except ImportError:
+        print("Warning: langchain-ollama not available; skipping the Ollama provider.")
+        return None
+
+    model = ChatOllama(
+        model=OLLAMA_MODEL,
+        base_url=OLLAMA_BASE_URL,
+        temperature=0.7,
+        client_kwargs={"timeout": LLM_PROVIDER_TIMEOUT_SECONDS},
+    )
+    crew_kwargs = {"model": f"ollama/{OLLAMA_MODEL}", "base_url": OLLAMA_BASE_URL, "temperature": 0.7}
+    return Provider("ollama", model, crew_kwargs=crew_kwargs)
+
+
+PROVIDER_BUILDERS = {
+    "groq": build_groq_provider,
+    "ollama": build_ollama_provider,
+}
+
+
+def build_providers(names=LLM_PROVIDERS) -> list:
+    providers = []
+    for name in names:
+        builder = PROVIDER_BUILDERS.get(name)
+        if builder is None:
+            print(f"⚠ Unknown LLM provider '{name}' in LLM_PROVIDERS; skipping it.")
+            continue
+        try:
+            provider = builder()
+        except Exception as e:
+            print(f"❌ Could not initialize LLM provider '{name}': {e}")
+            continue
+        if provider is not None:
+            providers.append(provider)
+    return providers
+
+
+def create_llm(names=LLM_PROVIDERS, hedge_after_ms: float = LLM_HEDGE_AFTER_MS):
+    """The failover chat model over the configured providers, or None if none could be set up."""
+    providers = build_providers(names)
+    if not providers:
+        return None
+    print(f"✅ LLM providers (in order): {', '.join(p.name for p in providers)}"
+          + (f"; hedging after {hedge_after_ms:g}ms" if hedge_after_ms else ""))
+    return FailoverChatModel(providers=providers, hedge_after_ms=hedge_after_ms)
+
+
+# Crew runs happen in worker processes, so their providers' health lives here,
+# in the server process: jobs are started on the providers whose circuit is
+# closed and report back how each provider did.
+_crew_health = {}
+_crew_health_lock = threading.Lock()
+
+
+def crew_health(name: str) -> ProviderHealth:
+    """The health of provider `name` shared by every crew run in this process."""
+    with _crew_health_lock:
+        health = _crew_health.get(name)
+        if health is None:
+            health = _crew_health[name] = ProviderHealth(name)
+        return health
+
+
+def crew_providers(names=LLM_PROVIDERS) -> list:
+    """Providers usable by CrewAI, in configured order, sharing this process's crew health."""
+    providers = [p for p in build_providers(names) if p.crew_kwargs]
+    for provider in providers:
+        provider.health = crew_health(provider.name)
+    return providers
+
+
+def crew_provider_order(names=LLM_PROVIDERS) -> list:
+    """The configured providers a crew job should try, in order, skipping those with an open circuit."""
+    return [name for name in names if name in PROVIDER_BUILDERS and crew_health(name).available()]
+
+
+def record_crew_outcomes(outcomes: list):
+    """Applies the per-provider outcomes reported by a crew run to the shared crew health."""
+    for outcome in outcomes:
+        if outcome["provider"] not in PROVIDER_BUILDERS:
+            continue
+        health = crew_health(outcome["provider"])
+        if outcome["error"] is None:
+            health.record_success(outcome["elapsed_ms"])
+        else:
+            health.record_failure(RuntimeError(outcome["error"]))
+
+
+def crew_health_stats() -> dict:
+    with _crew_health_lock:
+        healths = list(_crew_health.values())
+    return {health.name: health.stats() for health in healths}
@@ -0,0 +1,259 @@
+import os
+import re
+import threading
+from collections import deque
+
+import numpy as np
+
+from app.services.vector_db_service import embed_text
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+# Cosine similarity a query needs with a tool's exemplars to be routed.
+ROUTER_SIMILARITY = float(os.getenv("ROUTER_SIMILARITY", "0.72"))
+# ...and how far ahead of the next best intent it must be.
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))
+# When false, routed answers always use the template instead of the LLM formatting call.
+ROUTER_LLM_FORMATTING = os.getenv("ROUTER_LLM_FORMATTING", "true").lower() == "true"
+
+# Anything that needs several tools, personal data or reasoning stays with the agent.
+NO_ROUTE = "agent"
+
+# Words that signal a query needs more than a single lookup.
+_COMPOUND = re.compile(r"\b(and|also|then|compare|versus|vs\.?|between|chart|plot|tomorrow|forecast|next week|yesterday)\b", re.I)
+_NOT_TICKERS = {"I", "A", "AI", "US", "USA", "UK", "EU", "CEO", "IPO", "ETF", "GDP", "API", "OK"}
+# Ordinary words people type in capitals ("is gold going UP?").
+_SHOUTED_WORDS = {
+    "UP", "DOWN", "NOW", "TODAY", "HIGH", "LOW", "BUY", "SELL", "HOLD", "NEW", "BIG", "ALL", "ANY", "NOT", "NO",
+    "YES", "IS", "IT", "THE", "OF", "TO", "IN", "ON", "AT", "FOR", "OR", "SO", "GO", "ME", "MY", "WHY", "HOW",
+    "WHAT", "WHO", "LOL", "OMG", "PLS", "ASAP", "FYI", "GOLD", "OIL",
+}
+# A "city" with one of these in it refers to something only the user knows ("my hometown").
+_NOT_PLACE_WORDS = {"my", "your", "our", "his", "her", "their", "its", "this", "that", "here", "there", "home", "me", "i", "where"}
+
+
+def _weather_city(text: str):
+    match = (
+        re.search(r"\b(?:weather|temperature)\b.*?\b(?:in|at|for)\s+(?P<arg>[A-Za-z][A-Za-z .,'-]*?)\s*[?.!]*$", text, re.I)
+        or re.search(r"^(?:how is |what is |what's )?(?:the )?(?P<arg>[A-Za-z][A-Za-z .'-]*?)\s+weather\s*(?:like)?\s*(?:today|now)?\s*[?.!]*$", text, re.I)
+    )
+    if not match:
+        return None
+    city = re.sub(r"\s+(?:today|now|right now)$", "", match.group("arg").strip(), flags=re.I)
+    if not city or _NOT_PLACE_WORDS & set(re.findall(r"[a-z]+", city.lower())):
+        return None
+    return city
+
+
+def _stock_ticker(text: str):
+    if not re.search(r"\b(price|prices|stock|quote|trading|shares?|closing)\b", text, re.I):
+        return None
+    tickers = {t.lstrip("$") for t in re.findall(r"\$?\b[A-Z]{1,5}\b", text)} - _NOT_TICKERS - _SHOUTED_WORDS
+    return tickers.pop() if len(tickers) == 1 else None
+
+
+def _news_topic(text: str):
+    match = re.search(r"\b(?:news|headlines)\b\s+(?:about|on|for|regarding|around)\s+(?P<arg>.+?)\s*[?.!]*$", text, re.I)
+    return match.group("arg").strip() if match else None
+
+
+def _lookup_subject(text: str):
+    match = re.search(
+        r"^(?:who\s+(?:is|was|were)|what\s+(?:is|was|are|were)|tell me about|explain)\s+(?:a |an |the )?(?P<arg>.+?)\s*[?.!]*$",
+        text, re.I,
+    )
+    if not match or not re.search(r"[A-Za-z]", match.group("arg")):
+        return None
+    if re.match(r"(?:my|your|our|this|that|it)\b", match.group("arg"), re.I):
+        return None
+    return match.group("arg").strip()
+
+
+# Each route: the tool it calls, how to pull the tool's argument out of the
+# query, whether the whole query is a usable argument, exemplars for the
+# embedding classifier (which must agree with any rule match) and the answer
+# format.
+ROUTES = {
+    "weather_tool": {
+        "extract": _weather_city,
+        "exemplars": [
+            "what's the weather in London",
+            "how hot is it in Lucknow right now",
+            "current temperature in Paris",
+            "is it raining in Mumbai",
+            "weather in Tokyo today",
+        ],
+        "format": "template",
+        "template": "{output}",
+    },
+    "get_daily_stock_prices": {
+        "extract": _stock_ticker,
+        "exemplars": [
+            "what is the price of TSLA",
+            "how is NVDA stock trading",
+            "AAPL share price",
+            "give me the latest quote for MSFT",
+            "closing prices for AMZN",
+        ],
+        "format": "llm",
+        "template": "Here are the recent daily closing prices for {arg}:\n\n{output}",
+    },
+    "news_tool": {
+        "extract": _news_topic,
+        "free_text": True,
+        "exemplars": [
+            "latest news on artificial intelligence",
+            "any headlines about the election",
+            "what's in the news about SpaceX",
+            "recent news regarding climate change",
+        ],
+        "format": "template",
+        "template": "{output}",
+    },
+    "wikipedia_tool": {
+        "extract": _lookup_subject,
+        "free_text": True,
+        "exemplars": [
+            "who was Alan Turing",
+            "who is Marie Curie",
+            "what is the Eiffel Tower",
+            "tell me about the Roman Empire",
+            "what is photosynthesis",
+        ],
+        "format": "template",
+        "template": "{output}",
+    },
+    NO_ROUTE: {
+        "exemplars": [
+            "compare TSLA, NVDA and AAPL and show me the news on each",
+            "write me a poem about the ocean",
+            "hi, how are you today?",
+            "what's on my calendar tomorrow",
+            "plot a chart of Tesla against Nvidia",
+            "what is 17 times 23",
+            "what is my name",
+            "what did I ask you earlier",
+            "summarize our conversation",
+            "what is the best way to learn python",
+        ],
+    },
+}
+
+
+class IntentRouter:
+    """
+    Sends queries that map to exactly one tool straight to that tool.
+
+    Rules (weather in <city>, price of <TICKER>, who is ...) pull out the
+    tool's argument, and the query's embedding must also be clearly closest to
+    that tool's exemplars, since a regex alone can't tell a weather question
+    from a poem about the weather. Anything compound, ambiguous or unmatched
+    returns None and goes to the full agent.
+    """
+
+    def __init__(self, embed, routes: dict = ROUTES, similarity: float = ROUTER_SIMILARITY, margin: float = ROUTER_MARGIN):
+        self._embed = embed
+        self.routes = routes
+        self.similarity = similarity
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._exemplars = None
+        self._routed_ms = deque(maxlen=500)
+        self._agent_ms = deque(maxlen=500)
+        self._stats = {"routed": 0, "fallbacks": 0, "by_tool": {}}
+
+    def classify(self, text: str):
+        """Returns {"tool", "arg", "reason"} for a single-tool query, or None for the agent."""
+        text = text.strip()
+        if not text or _COMPOUND.search(text):
+            return None
+
+        matches = {}
+        for tool, route in self.routes.items():
+            if tool == NO_ROUTE:
+                continue
+            arg = route["extract"](text)
+            if arg:
+                matches[tool] = arg
+
+        intent, score, runner_up = self._nearest_intent(text)
+        if intent == NO_ROUTE or score < self.similarity or score - runner_up < self.margin:
+            return None
+        # With rule matches, the embedding picks between them; it can't add another tool.
+        if matches:
+            return {"tool": intent, "arg": matches[intent], "reason": "rule+embedding"} if intent in matches else None
+        # Embedding-only: only tools that take free text can use the query as is.
+        if self.routes[intent].get("free_text"):
+            return {"tool": intent, "arg": text, "reason": "embedding"}
+        return None
+
+    def record(self, route, elapsed_ms: float):
+        """Records how a query was served, for the hit rate and latency-saved stats."""
+        with self._lock:
+            if route is None:
+                self._stats["fallbacks"] += 1
+                self._agent_ms.append(elapsed_ms)
+            else:
+                self._stats["routed"] += 1
+                self._stats["by_tool"][route["tool"]] = self._stats["by_tool"].get(route["tool"], 0) + 1
+                self._routed_ms.append(elapsed_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._stats["routed"] + self._stats["fallbacks"]
+            routed_avg = sum(self._routed_ms) / len(self._routed_ms) if self._routed_ms else 0.0
+            agent_avg = sum(self._agent_ms) / len(self._agent_ms) if self._agent_ms else 0.0
+            saved = max(0.0, agent_avg - routed_avg) if self._routed_ms and self._agent_ms else 0.0
+            return {
+                "routed": self._stats["routed"],
+                "fallbacks": self._stats["fallbacks"],
+                "hit_rate": round(self._stats["routed"] / total, 4) if total else 0.0,
+                "by_tool": dict(self._stats["by_tool"]),
+                "routed_ms_avg": round(routed_avg, 1),
+                "agent_ms_avg": round(agent_avg, 1),
+                "saved_ms_per_routed_query": round(saved, 1),
+                "saved_ms_total": round(saved * self._stats["routed"], 1),
+            }
+
+    def warm_up(self):
+        """Embeds the exemplars now rather than on the first query."""
+        self._exemplar_matrix()
+
+    def _nearest_intent(self, text: str):
+        labels, matrix = self._exemplar_matrix()
+        scores = matrix @ np.asarray(self._embed(text), dtype=np.float32)
+        best = {}
+        for label, score in zip(labels, scores):
+            best[label] = max(best.get(label, -1.0), float(score))
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        intent, score = ranked[0]
+        return intent, score, ranked[1][1] if len(ranked) > 1 else -1.0
+
+    def _exemplar_matrix(self):
+        with self._lock:
+            if self._exemplars is None:
+                labels, vectors = [], []
+                for intent, route in self.routes.items():
+                    for exemplar in route["exemplars"]:
+                        labels.append(intent)
+                        vectors.append(self._embed(exemplar))
+                self._exemplars = (labels, np.asarray(vectors, dtype=np.float32))
+            return self._exemplars
+
+
+def format_prompt(user_input: str, tool_output: str) -> str:
+    return (
+        "Answer the user's question using only the tool output below. "
+        "Be concise and do not mention the tool.\n\n"
+        f"Question: {user_input}\n\nTool output:\n{tool_output}"
+    )
+
+
+def render_template(route: dict, tool_output: str) -> str:
+    return ROUTES[route["tool"]]["template"].format(arg=route["arg"], output=tool_output)
+
+
+def uses_llm_formatting(route: dict) -> bool:
+    return ROUTER_LLM_FORMATTING and ROUTES[route["tool"]]["format"] == "llm"
+
+
+intent_router = IntentRouter(embed=embed_text)
@@ -0,0 +1,583 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Where session histories live: "memory" (this process only), "sqlite" (a file
+# shared by the workers on one host) or "redis" (shared by every replica).
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+# Conversation turns (user message + agent answer) kept per session for the prompt.
+SESSION_WINDOW_TURNS = int(os.getenv("SESSION_WINDOW_TURNS", "5"))
+SESSION_STORE_MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Sessions not touched for this long are dropped (they re-seed from Firestore if resumed).
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+
+# Rough per-session and per-message overhead on top of the message text.
+_SESSION_OVERHEAD_BYTES = 512
+_MESSAGE_OVERHEAD_BYTES = 64
+
+_HUMAN = "h"
+_AI = "a"
+
+
+def _message_size(text: str) -> int:
+    return len(text.encode("utf-8")) + _MESSAGE_OVERHEAD_BYTES
+
+
+def _summary_size(record) -> int:
+    return len(json.dumps(record).encode("utf-8")) if record else 0
+
+
+def _to_compact(message) -> tuple:
+    text = message.content if isinstance(message.content, str) else str(message.content)
+    return (_HUMAN if message.type == "human" else _AI, text)
+
+
+def _from_compact(items) -> list:
+    return [HumanMessage(content=text) if role == _HUMAN else AIMessage(content=text) for role, text in items]
+
+
+class WindowedChatHistory(BaseChatMessageHistory):
+    """
+    Chat history that only keeps the last `window_turns` turns.
+
+    Messages are stored as compact (role, text) pairs in a ring buffer, so a
+    long session uses a fixed amount of memory. `on_resize` is called with the
+    change in size (bytes) after every append. The session's rolling summary
+    (see summary_memory.py), if any, is kept alongside.
+    """
+
+    def __init__(self, window_turns: int = SESSION_WINDOW_TURNS, on_resize=None):
+        self._buffer = deque(maxlen=window_turns * 2)
+        self._lock = threading.Lock()
+        self._on_resize = on_resize
+        self._summary = None
+        self._appended = 0
+        self.size = 0
+
+    @property
+    def messages(self):
+        with self._lock:
+            items = list(self._buffer)
+        return _from_compact(items)
+
+    def numbered_messages(self) -> list:
+        """(number, message) pairs; numbers grow with every message appended to the session."""
+        with self._lock:
+            items = list(self._buffer)
+            first = self._appended - len(items) + 1
+        return list(enumerate(_from_compact(items), start=first))
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    def add_messages(self, messages):
+        delta = 0
+        with self._lock:
+            for message in messages:
+                item = _to_compact(message)
+                delta += _message_size(item[1])
+                if len(self._buffer) == self._buffer.maxlen:
+                    delta -= _message_size(self._buffer[0][1])
+                self._buffer.append(item)
+            self._appended += len(messages)
+            self.size += delta
+        if self._on_resize is not None:
+            self._on_resize(delta)
+
+    def compact_items(self) -> list:
+        with self._lock:
+            return list(self._buffer)
+
+    def get_summary(self):
+        with self._lock:
+            return self._summary
+
+    def set_summary(self, record: dict):
+        with self._lock:
+            delta = _summary_size(record) - _summary_size(self._summary)
+            self._summary = record
+            self.size += delta
+        if self._on_resize is not None:
+            self._on_resize(delta)
+
+    def clear(self):
+        with self._lock:
+            delta = -self.size
+            self._buffer.clear()
+            self._summary = None
+            self._appended = 0
+            self.size = 0
+        if self._on_resize is not None:
+            self._on_resize(delta)
+
+
+class SharedChatHistory(BaseChatMessageHistory):
+    """
+    A session history kept in a shared store (SQLite or Redis).
+
+    Reads always go to the store, so every worker sees the latest turns, and
+    add_messages() appends a whole turn in one atomic write.
+    """
+
+    def __init__(self, store, user_id: str, session_id: str):
+        self._store = store
+        self._user_id = user_id
+        self._session_id = session_id
+
+    @property
+    def messages(self):
+        return _from_compact(self._store._read(self._user_id, self._session_id))
+
+    def numbered_messages(self) -> list:
+        """(number, message) pairs; numbers grow with every message appended to the session."""
+        numbered = self._store._read_numbered(self._user_id, self._session_id)
+        return list(zip([number for number, _ in numbered], _from_compact([item for _, item in numbered])))
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    def add_messages(self, messages):
+        self._store._append(self._user_id, self._session_id, [_to_compact(message) for message in messages])
+
+    def get_summary(self):
+        return self._store._read_summary(self._user_id, self._session_id)
+
+    def set_summary(self, record: dict):
+        self._store._write_summary(self._user_id, self._session_id, record)
+
+    def clear(self):
+        self._store.discard(self._user_id, self._session_id)
+
+
+class SessionStore:
+    """
+    In-process cache of session histories keyed by (user_id, session_id).
+
+    Sessions are evicted least-recently-used first once the total size passes
+    `max_bytes`, and dropped after `idle_ttl` seconds without use. An evicted
+    session is rebuilt by the `seed` callback the next time it's requested.
+    """
+
+    def __init__(self, max_bytes: int, idle_ttl: float, window_turns: int = SESSION_WINDOW_TURNS):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.window_turns = window_turns
+        self._lock = threading.RLock()
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions_lru": 0, "evictions_idle": 0}
+
+    def get(self, user_id: str, session_id: str, seed=None) -> WindowedChatHistory:
+        """Returns the session's history, creating it (and calling `seed(history)`) on a miss."""
+        key = (user_id, session_id)
+        with self._lock:
+            self._expire_idle()
+            entry = self._sessions.get(key)
+            if entry is not None:
+                entry["last_used"] = time.monotonic()
+                self._sessions.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry["history"]
+            self._stats["misses"] += 1
+
+        # Seeding may hit Firestore; don't hold the lock while it runs.
+        history = WindowedChatHistory(self.window_turns)
+        if seed is not None:
+            seed(history)
+
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None:
+                # Another request seeded the same session first.
+                return entry["history"]
+            history._on_resize = lambda delta: self._resize(key, delta)
+            self._sessions[key] = {"history": history, "last_used": time.monotonic()}
+            self._bytes += history.size + _SESSION_OVERHEAD_BYTES
+            self._evict_over_budget(keep=key)
+            return history
+
+    def discard(self, user_id: str, session_id: str = None):
+        """Forgets one session, or every session of the user when `session_id` is None."""
+        with self._lock:
+            keys = [key for key in self._sessions if key[0] == user_id and session_id in (None, key[1])]
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _resize(self, key, delta: int):
+        with self._lock:
+            if key not in self._sessions:
+                return
+            self._bytes += delta
+            self._evict_over_budget(keep=key)
+
+    def _expire_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        # The dict is kept in last-used order, so idle sessions are at the front.
+        while self._sessions:
+            key, entry = next(iter(self._sessions.items()))
+            if entry["last_used"] > cutoff:
+                break
+            self._remove(key)
+            self._stats["evictions_idle"] += 1
+
+    def _evict_over_budget(self, keep):
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            key = next(iter(self._sessions))
+            if key == keep:
+                self._sessions.move_to_end(key)
+                continue
+            self._remove(key)
+            self._stats["evictions_lru"] += 1
+
+    def _remove(self, key):
+        entry = self._sessions.pop(key)
+        entry["history"]._on_resize = None
+        self._bytes -= entry["history"].size + _SESSION_OVERHEAD_BYTES
+
+
+class SQLiteSessionStore:
+    """
+    Session histories in a local SQLite file, shared by all workers on a host.
+
+    Each append inserts the turn and trims the session back to its window in a
+    single write transaction. Sessions idle for longer than `idle_ttl` are
+    deleted.
+    """
+
+    _SWEEP_INTERVAL_SECONDS = 60
+
+    def __init__(self, path: str, idle_ttl: float, window_turns: int = SESSION_WINDOW_TURNS):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.window_turns = window_turns
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._stats = {"hits": 0, "misses": 0, "evictions_idle": 0}
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (user_id, session_id)
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_by_session ON messages (user_id, session_id, id);
+            CREATE TABLE IF NOT EXISTS summaries (
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (user_id, session_id)
+            );
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; writes take the database lock with BEGIN IMMEDIATE.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: str, session_id: str, seed=None) -> SharedChatHistory:
+        """Returns the session's history, creating it (and calling `seed(history)`) on a miss."""
+        conn = self._conn()
+        now = time.time()
+        self._expire_idle(now)
+        updated = conn.execute(
+            "UPDATE sessions SET last_used = ? WHERE user_id = ? AND session_id = ? AND last_used > ?",
+            (now, user_id, session_id, now - self.idle_ttl),
+        ).rowcount
+        if updated:
+            self._stats["hits"] += 1
+            return SharedChatHistory(self, user_id, session_id)
+
+        self._stats["misses"] += 1
+        seeded = WindowedChatHistory(self.window_turns)
+        if seed is not None:
+            seed(seeded)
+        with self._transaction(conn):
+            conn.execute("DELETE FROM sessions WHERE user_id = ? AND session_id = ? AND last_used <= ?",
+                         (user_id, session_id, now - self.idle_ttl))
+            created = conn.execute(
+                "INSERT OR IGNORE INTO sessions (user_id, session_id, last_used) VALUES (?, ?, ?)",
+                (user_id, session_id, now),
+            ).rowcount
+            # Another worker may have seeded the session meanwhile; its copy wins.
+            if created:
+                conn.execute("DELETE FROM messages WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+                conn.execute("DELETE FROM summaries WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+                self._insert(conn, user_id, session_id, seeded.compact_items())
+        return SharedChatHistory(self, user_id, session_id)
+
+    def discard(self, user_id: str, session_id: str = None):
+        """Forgets one session, or every session of the user when `session_id` is None."""
+        conn = self._conn()
+        where, params = ("user_id = ?", (user_id,)) if session_id is None else \
+            ("user_id = ? AND session_id = ?", (user_id, session_id))
+        with self._transaction(conn):
+            conn.execute(f"DELETE FROM messages WHERE {where}", params)
+            conn.execute(f"DELETE FROM summaries WHERE {where}", params)
+            conn.execute(f"DELETE FROM sessions WHERE {where}", params)
+
+    def clear(self):
+        conn = self._conn()
+        with self._transaction(conn):
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM summaries")
+            conn.execute("DELETE FROM sessions")
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        return {
+            **self._stats,
+            "backend": "sqlite",
+            "sessions": conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+            "messages": conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+        }
+
+    def _read(self, user_id: str, session_id: str) -> list:
+        rows = self._conn().execute(
+            "SELECT role, text FROM messages WHERE user_id = ? AND session_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, session_id, self.window_turns * 2),
+        ).fetchall()
+        return list(reversed(rows))
+
+    def _read_numbered(self, user_id: str, session_id: str) -> list:
+        # Row ids only grow, so they number the session's messages.
+        rows = self._conn().execute(
+            "SELECT id, role, text FROM messages WHERE user_id = ? AND session_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, session_id, self.window_turns * 2),
+        ).fetchall()
+        return [(row_id, (role, text)) for row_id, role, text in reversed(rows)]
+
+    def _append(self, user_id: str, session_id: str, items: list):
+        conn = self._conn()
+        with self._transaction(conn):
+            conn.execute(
+                "INSERT INTO sessions (user_id, session_id, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, session_id) DO UPDATE SET last_used = excluded.last_used",
+                (user_id, session_id, time.time()),
+            )
+            self._insert(conn, user_id, session_id, items)
+            conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE user_id = ? AND session_id = ? ORDER BY id DESC LIMIT ?)",
+                (user_id, session_id, user_id, session_id, self.window_turns * 2),
+            )
+
+    def _read_summary(self, user_id: str, session_id: str):
+        row = self._conn().execute(
+            "SELECT record FROM summaries WHERE user_id = ? AND session_id = ?", (user_id, session_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_summary(self, user_id: str, session_id: str, record: dict):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO summaries (user_id, session_id, record) VALUES (?, ?, ?)",
+            (user_id, session_id, json.dumps(record)),
+        )
+
+    @staticmethod
+    def _insert(conn, user_id: str, session_id: str, items: list):
+        conn.executemany(
+            "INSERT INTO messages (user_id, session_id, role, text) VALUES (?, ?, ?, ?)",
+            [(user_id, session_id, role, text) for role, text in items],
+        )
+
+    def _transaction(self, conn):
+        return _ImmediateTransaction(conn)
+
+    def _expire_idle(self, now: float):
+        if now - self._last_sweep < self._SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        conn = self._conn()
+        with self._transaction(conn):
+            for table in ("messages", "summaries"):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE (user_id, session_id) IN "
+                    "(SELECT user_id, session_id FROM sessions WHERE last_used <= ?)",
+                    (now - self.idle_ttl,),
+                )
+            expired = conn.execute("DELETE FROM sessions WHERE last_used <= ?", (now - self.idle_ttl,)).rowcount
+        self._stats["evictions_idle"] += expired
+
+
+class _ImmediateTransaction:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class RedisSessionStore:
+    """
+    Session histories in Redis, shared by every worker and replica.
+
+    Each session is a capped list of JSON [role, text] pairs, a marker key
+    recording that it has been seeded, a count of the messages ever appended
+    (which numbers them) and, in summary memory mode, a JSON summary key.
+    Appends push, trim, count and refresh the idle TTL in one MULTI/EXEC
+    transaction.
+    """
+
+    def __init__(self, client, idle_ttl: float, window_turns: int = SESSION_WINDOW_TURNS, prefix: str = "session"):
+        self.client = client
+        self.idle_ttl = max(1, int(math.ceil(idle_ttl)))
+        self.window_turns = window_turns
+        self.prefix = prefix
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _keys(self, user_id: str, session_id: str):
+        base = f"{self.prefix}:{user_id}:{session_id}"
+        return f"{base}:messages", f"{base}:seeded"
+
+    def _summary_key(self, user_id: str, session_id: str):
+        return f"{self.prefix}:{user_id}:{session_id}:summary"
+
+    def _count_key(self, user_id: str, session_id: str):
+        return f"{self.prefix}:{user_id}:{session_id}:count"
+
+    def get(self, user_id: str, session_id: str, seed=None) -> SharedChatHistory:
+        """Returns the session's history, creating it (and calling `seed(history)`) on a miss."""
+        messages_key, seeded_key = self._keys(user_id, session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.expire(messages_key, self.idle_ttl)
+        pipe.expire(seeded_key, self.idle_ttl)
+        pipe.expire(self._summary_key(user_id, session_id), self.idle_ttl)
+        pipe.expire(self._count_key(user_id, session_id), self.idle_ttl)
+        if pipe.execute()[1]:
+            self._stats["hits"] += 1
+            return SharedChatHistory(self, user_id, session_id)
+
+        self._stats["misses"] += 1
+        seeded = WindowedChatHistory(self.window_turns)
+        if seed is not None:
+            seed(seeded)
+        # Only the first worker to claim the session writes the seed. Seeded turns
+        # are older than anything appended meanwhile, so they go on the left.
+        if self.client.set(seeded_key, 1, nx=True, ex=self.idle_ttl):
+            self.client.delete(self._summary_key(user_id, session_id))
+            items = seeded.compact_items()
+            if items:
+                count_key = self._count_key(user_id, session_id)
+                pipe = self.client.pipeline(transaction=True)
+                pipe.lpush(messages_key, *[json.dumps(item) for item in reversed(items)])
+                pipe.ltrim(messages_key, -self.window_turns * 2, -1)
+                pipe.expire(messages_key, self.idle_ttl)
+                pipe.incrby(count_key, len(items))
+                pipe.expire(count_key, self.idle_ttl)
+                pipe.execute()
+        return SharedChatHistory(self, user_id, session_id)
+
+    def discard(self, user_id: str, session_id: str = None):
+        """Forgets one session, or every session of the user when `session_id` is None."""
+        if session_id is not None:
+            self.client.delete(*self._keys(user_id, session_id), self._summary_key(user_id, session_id),
+                               self._count_key(user_id, session_id))
+            return
+        keys = list(self.client.scan_iter(match=f"{self.prefix}:{user_id}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self) -> dict:
+        return {**self._stats, "backend": "redis"}
+
+    def _read(self, user_id: str, session_id: str) -> list:
+        messages_key, _ = self._keys(user_id, session_id)
+        return [tuple(json.loads(item)) for item in self.client.lrange(messages_key, -self.window_turns * 2, -1)]
+
+    def _read_numbered(self, user_id: str, session_id: str) -> list:
+        messages_key, _ = self._keys(user_id, session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(messages_key, -self.window_turns * 2, -1)
+        pipe.get(self._count_key(user_id, session_id))
+        raw_items, count = pipe.execute()
+        items = [tuple(json.loads(item)) for item in raw_items]
+        first = int(count or len(items)) - len(items) + 1
+        return list(enumerate(items, start=first))
+
+    def _append(self, user_id: str, session_id: str, items: list):
+        messages_key, seeded_key = self._keys(user_id, session_id)
+        count_key = self._count_key(user_id, session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(messages_key, *[json.dumps(item) for item in items])
+        pipe.ltrim(messages_key, -self.window_turns * 2, -1)
+        pipe.expire(messages_key, self.idle_ttl)
+        pipe.incrby(count_key, len(items))
+        pipe.expire(count_key, self.idle_ttl)
+        pipe.set(seeded_key, 1, ex=self.idle_ttl)
+        pipe.expire(self._summary_key(user_id, session_id), self.idle_ttl)
+        pipe.execute()
+
+    def _read_summary(self, user_id: str, session_id: str):
+        raw = self.client.get(self._summary_key(user_id, session_id))
+        return json.loads(raw) if raw else None
+
+    def _write_summary(self, user_id: str, session_id: str, record: dict):
+        self.client.set(self._summary_key(user_id, session_id), json.dumps(record), ex=self.idle_ttl)
+
+
+def create_session_store(backend: str = SESSION_BACKEND):
+    """Builds the session store selected by SESSION_BACKEND."""
+    if backend == "sqlite":
+        print(f"Session store: SQLite at {SESSION_SQLITE_PATH}")
+        return SQLiteSessionStore(SESSION_SQLITE_PATH, idle_ttl=SESSION_IDLE_TTL_SECONDS)
+    if backend == "redis":
+        if REDIS_AVAILABLE:
+            print("Session store: Redis")
+            return RedisSessionStore(redis.Redis.from_url(SESSION_REDIS_URL), idle_ttl=SESSION_IDLE_TTL_SECONDS)
+        print("Warning: redis not available. Falling back to the in-memory session store.")
+    return SessionStore(max_bytes=SESSION_STORE_MAX_BYTES, idle_ttl=SESSION_IDLE_TTL_SECONDS)
+
+
+session_store = create_session_store()
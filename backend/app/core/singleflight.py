@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the work; callers arriving while it is in
+    flight wait for and receive the same result (or exception). Calls made
+    with a `ttl` also remember a successful result for that many seconds, so
+    late retries of the same key get it too (used for idempotency keys).
+    """
+
+    def __init__(self, max_results: int = 1024):
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._async_calls = {}
+        self._sync_calls = {}
+        self._results = OrderedDict()
+        self._stats = {"executions": 0, "coalesced": 0, "replayed": 0}
+
+    async def do(self, key, fn, ttl: float = 0):
+        """Awaits fn() once per key across concurrent callers and returns its result."""
+        with self._lock:
+            found, result = self._cached_result(key)
+            if found:
+                return result
+            task = self._async_calls.get(key)
+            if task is None:
+                self._stats["executions"] += 1
+                # The shared work runs as its own task, so one caller going away
+                # (e.g. a client disconnect) doesn't cancel it for the others.
+                task = asyncio.ensure_future(fn())
+                self._async_calls[key] = task
+                task.add_done_callback(lambda t: self._finish_async(key, t, ttl))
+            else:
+                self._stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def do_sync(self, key, fn, ttl: float = 0):
+        """Blocking variant of do() for work that runs in worker threads (e.g. tools)."""
+        with self._lock:
+            found, result = self._cached_result(key)
+            if found:
+                return result
+            future = self._sync_calls.get(key)
+            leader = future is None
+            if leader:
+                self._stats["executions"] += 1
+                future = Future()
+                self._sync_calls[key] = future
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._sync_calls.pop(key, None)
+                if ttl > 0 and future.exception() is None:
+                    self._remember(key, future.result(), ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "in_flight": len(self._async_calls) + len(self._sync_calls),
+                "remembered": len(self._results),
+            }
+
+    def _finish_async(self, key, task, ttl):
+        with self._lock:
+            self._async_calls.pop(key, None)
+            if ttl > 0 and not task.cancelled() and task.exception() is None:
+                self._remember(key, task.result(), ttl)
+
+    def _cached_result(self, key):
+        entry = self._results.get(key)
+        if entry is None:
+            return False, None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._results[key]
+            return False, None
+        self._stats["replayed"] += 1
+        return True, result
+
+    def _remember(self, key, result, ttl):
+        self._results[key] = (time.monotonic() + ttl, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
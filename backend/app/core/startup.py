@@ -0,0 +1,161 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from importlib.machinery import ExtensionFileLoader, SourceFileLoader, SourcelessFileLoader
+
+from app.core.concurrency import run_blocking, IO_EXECUTOR, EMBEDDING_EXECUTOR
+
+# Prints the slowest imports of `import main` when the server starts.
+STARTUP_IMPORT_REPORT = os.getenv("STARTUP_IMPORT_REPORT", "true").lower() == "true"
+STARTUP_REPORT_TOP = int(os.getenv("STARTUP_REPORT_TOP", "15"))
+# Builds the embedding model, Chroma client, agent and router exemplars in the
+# background once the server is up, so the first chat doesn't pay for them.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+
+_TIMED_LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+
+class _TimedLoader:
+    """Wraps a module's loader to time its execution; everything else is delegated."""
+
+    def __init__(self, loader, timer, name: str):
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._timer._timed(self._name, self._loader.create_module, spec)
+
+    def exec_module(self, module):
+        self._timer._timed(self._name, self._loader.exec_module, module)
+
+
+class ImportTimer:
+    """
+    Meta path finder that times the imports made while it is installed.
+
+    The app's own modules are timed individually; third-party packages only as
+    a whole (their top-level import), which is where the seconds go. A module's
+    self time excludes the timed modules it imported, so it is the cost of its
+    own code plus any untimed submodules.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._records = {}
+        self._started = None
+        self._elapsed_ms = None
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+            self._started = time.perf_counter()
+
+    def uninstall(self):
+        """Stops timing and records the total time since install()."""
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+            self._elapsed_ms = (time.perf_counter() - self._started) * 1000
+
+    def find_spec(self, fullname, path, target=None):
+        if getattr(self._local, "finding", False):
+            return None
+        if "." in fullname and not fullname.startswith("app."):
+            return None
+        self._local.finding = True
+        try:
+            spec = None
+            for finder in sys.meta_path:
+                find = getattr(finder, "find_spec", None)
+                if finder is self or find is None:
+                    continue
+                spec = find(fullname, path, target)
+                if spec is not None:
+                    break
+        finally:
+            self._local.finding = False
+        if spec is not None and isinstance(spec.loader, _TIMED_LOADERS):
+            spec.loader = _TimedLoader(spec.loader, self, fullname)
+        return spec
+
+    def _timed(self, name: str, fn, arg):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return fn(arg)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                record = self._records.setdefault(name, {"module": name, "cumulative_ms": 0.0, "self_ms": 0.0})
+                record["cumulative_ms"] += elapsed
+                record["self_ms"] += elapsed - children
+
+    def report(self, top: int = STARTUP_REPORT_TOP) -> dict:
+        with self._lock:
+            records = sorted(self._records.values(), key=lambda r: r["self_ms"], reverse=True)[:top]
+            slowest = [
+                {"module": r["module"], "self_ms": round(r["self_ms"], 1), "cumulative_ms": round(r["cumulative_ms"], 1)}
+                for r in records
+            ]
+        elapsed = self._elapsed_ms
+        if elapsed is None and self._started is not None:
+            elapsed = (time.perf_counter() - self._started) * 1000
+        return {
+            "import_ms": round(elapsed, 1) if elapsed is not None else None,
+            "slowest_imports": slowest,
+        }
+
+
+import_timer = ImportTimer()
+_warm_up_ms = {}
+
+
+def print_report():
+    if not STARTUP_IMPORT_REPORT:
+        return
+    report = import_timer.report()
+    if report["import_ms"] is None:
+        return
+    print(f"⏱ Imported the app in {report['import_ms']:.0f} ms. Slowest imports (self / cumulative ms):")
+    for record in report["slowest_imports"]:
+        print(f"   {record['module']:<45} {record['self_ms']:>8.1f} {record['cumulative_ms']:>9.1f}")
+
+
+async def _warm(name: str, executor, build):
+    start = time.perf_counter()
+    try:
+        await run_blocking(executor, build)
+        _warm_up_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+    except Exception as e:
+        print(f"⚠ Warm-up of {name} failed: {e}")
+
+
+async def warm_up():
+    """Builds the lazily initialized components in the background; requests arriving first build what they need."""
+    from app.core.agent import get_agent
+    from app.core.router import intent_router
+    from app.services.vector_db_service import get_embedding_model, get_memory_store
+
+    await asyncio.gather(
+        _warm("embedding_model", EMBEDDING_EXECUTOR, get_embedding_model),
+        _warm("vector_db", IO_EXECUTOR, lambda: get_memory_store().warm_up()),
+        _warm("agent", IO_EXECUTOR, get_agent),
+        _warm("intent_router", EMBEDDING_EXECUTOR, intent_router.warm_up),
+    )
+    print(f"✅ Warm-up done: {_warm_up_ms}")
+
+
+def stats() -> dict:
+    return {**import_timer.report(), "warm_up_ms": dict(_warm_up_ms)}
@@ -0,0 +1,143 @@
+import asyncio
+import os
+
+from langchain_core.messages import SystemMessage
+
+from app.core.admission import llm_admission, BACKGROUND
+from app.core.concurrency import run_blocking, IO_EXECUTOR
+from app.core.token_budget import truncate_to_tokens
+
+# "window" sends the last SESSION_WINDOW_TURNS turns as is; "summary" sends a
+# rolling summary of older turns plus only the last SUMMARY_RAW_TURNS turns.
+SESSION_MEMORY_MODE = os.getenv("SESSION_MEMORY_MODE", "window").lower()
+SUMMARY_RAW_TURNS = int(os.getenv("SUMMARY_RAW_TURNS", "2"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_PROMPT = """Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary.
+Keep names, facts about the user, preferences, decisions and open questions they may come back to. Drop small talk.
+Write at most {max_words} words of plain prose.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+def _split(messages: list, raw_turns: int):
+    """Splits a history into (older, recent) where `recent` holds the last `raw_turns` turns."""
+    cut = max(0, len(messages) - raw_turns * 2)
+    return messages[:cut], messages[cut:]
+
+
+def unfolded(older: list, record) -> list:
+    """
+    The (number, message) pairs in `older` after the last message the summary
+    covers. The summary records that message's number, so a message repeated
+    word for word ("ok", "thanks") can't be mistaken for it.
+    """
+    through = record.get("through") if record else None
+    if not isinstance(through, int):
+        # No summary yet, or one written before messages were numbered.
+        return older
+    return [(number, message) for number, message in older if number > through]
+
+
+def prompt_messages(history, mode: str = None, raw_turns: int = SUMMARY_RAW_TURNS) -> list:
+    """
+    The chat history to send with a request.
+
+    In summary mode that is the rolling summary, any older turns it doesn't
+    cover yet (when the background update is behind) and the last `raw_turns`
+    turns verbatim.
+    """
+    if (mode or SESSION_MEMORY_MODE) != "summary":
+        return history.messages
+    record = history.get_summary()
+    older, recent = _split(history.numbered_messages(), raw_turns)
+    prefix = []
+    if record and record.get("summary"):
+        prefix = [SystemMessage(content=f"Summary of the earlier conversation:\n{record['summary']}")]
+    return prefix + [message for _, message in unfolded(older, record) + recent]
+
+
+class ConversationSummarizer:
+    """
+    Folds turns that leave the raw window into the session's rolling summary.
+
+    Updates run after the answer has been sent, as background LLM calls, and
+    write the new summary back to the session store. At most one update per
+    session runs at a time; turns added meanwhile are picked up by a rerun.
+    """
+
+    def __init__(self, llm, raw_turns: int = SUMMARY_RAW_TURNS, max_tokens: int = SUMMARY_MAX_TOKENS):
+        self.llm = llm
+        self.raw_turns = raw_turns
+        self.max_tokens = max_tokens
+        self._running = {}
+        self._tasks = set()
+        self._stats = {"updates": 0, "messages_folded": 0, "failures": 0}
+
+    def schedule(self, key, load_history):
+        """Starts a background update of one session's summary. `load_history` is a blocking callable."""
+        if self.llm is None:
+            return
+        if key in self._running:
+            self._running[key] = True
+            return
+        self._running[key] = False
+        task = asyncio.ensure_future(self._run(key, load_history))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def update(self, history) -> bool:
+        """Folds the history's not yet summarized older messages into its summary. Returns True if it changed."""
+        try:
+            messages, record = await run_blocking(IO_EXECUTOR, lambda: (history.numbered_messages(), history.get_summary()))
+            older, _ = _split(messages, self.raw_turns)
+            new = unfolded(older, record)
+            if not new:
+                return False
+
+            lines = "\n".join(f"{'User' if m.type == 'human' else 'Assistant'}: {m.content}" for _, m in new)
+            prompt = SUMMARY_PROMPT.format(
+                max_words=int(self.max_tokens * 0.75),
+                summary=(record or {}).get("summary") or "(none)",
+                lines=lines,
+            )
+            async with llm_admission.slot(BACKGROUND):
+                response = await self.llm.ainvoke(prompt, config={"callbacks": []})
+            summary = truncate_to_tokens(response.content.strip(), self.max_tokens)
+
+            await run_blocking(IO_EXECUTOR, history.set_summary, {"summary": summary, "through": new[-1][0]})
+            self._stats["updates"] += 1
+            self._stats["messages_folded"] += len(new)
+            return True
+        except Exception as e:
+            self._stats["failures"] += 1
+            print(f"Could not update conversation summary: {e}")
+            return False
+
+    async def drain(self):
+        """Waits for the scheduled updates to finish."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"mode": SESSION_MEMORY_MODE, "running": len(self._running), **self._stats}
+
+    async def _run(self, key, load_history):
+        try:
+            while True:
+                history = await run_blocking(IO_EXECUTOR, load_history)
+                await self.update(history)
+                if not self._running.get(key):
+                    break
+                self._running[key] = False
+        except Exception as e:
+            self._stats["failures"] += 1
+            print(f"Could not update conversation summary: {e}")
+        finally:
+            self._running.pop(key, None)
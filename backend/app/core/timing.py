@@ -0,0 +1,172 @@
+import contextvars
+import datetime
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Requests slower than this (end to end) are written to the slow-request log.
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "3000"))
+SLOW_REQUEST_LOG_PATH = os.getenv("SLOW_REQUEST_LOG_PATH", "slow_requests.jsonl")
+
+_current_timer = contextvars.ContextVar("request_timer", default=None)
+_log_lock = threading.Lock()
+
+
+class RequestTimer:
+    """Collects named timing spans and counters for a single request."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = datetime.datetime.utcnow()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+        self.counters = {}
+
+    def add_span(self, name: str, start: float, duration_ms: float):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self._start) * 1000, 2),
+                "duration_ms": round(duration_ms, 2),
+            })
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def server_timing_header(self) -> str:
+        """Formats the spans as a Server-Timing header, one metric per span name."""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                duration, count = totals.get(span["name"], (0.0, 0))
+                totals[span["name"]] = (duration + span["duration_ms"], count + 1)
+        metrics = []
+        for name, (duration, count) in totals.items():
+            metric = f"{_metric_name(name)};dur={duration:.1f}"
+            if count > 1:
+                metric += f';desc="x{count}"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(metrics)
+
+    def to_log_record(self, status_code: int) -> dict:
+        with self._lock:
+            return {
+                "timestamp": self.started_at.isoformat() + "Z",
+                "method": self.method,
+                "path": self.path,
+                "status": status_code,
+                "duration_ms": round(self.elapsed_ms(), 2),
+                "counters": dict(self.counters),
+                "spans": list(self.spans),
+            }
+
+
+def _metric_name(name: str) -> str:
+    # Server-Timing metric names must be HTTP tokens.
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", "_", name)
+
+
+def start_request(method: str, path: str):
+    """Starts timing a request. Returns the timer and a token for end_request()."""
+    timer = RequestTimer(method, path)
+    return timer, _current_timer.set(timer)
+
+
+def end_request(token):
+    _current_timer.reset(token)
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+@contextmanager
+def span(name: str):
+    """Records the wall time of the enclosed block on the current request, if any."""
+    timer = _current_timer.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add_span(name, start, (time.perf_counter() - start) * 1000)
+
+
+def increment(name: str, amount: int = 1):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.increment(name, amount)
+
+
+def log_if_slow(timer: RequestTimer, status_code: int):
+    """Appends the request's timing record to the slow-request log if it exceeded the threshold."""
+    if timer.elapsed_ms() < SLOW_REQUEST_THRESHOLD_MS:
+        return
+    record = timer.to_log_record(status_code)
+    try:
+        with _log_lock, open(SLOW_REQUEST_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        print(f"Could not write slow-request log: {e}")
+
+
+class TimingCallbackHandler(BaseCallbackHandler):
+    """Records a span per LLM round trip and per tool call of an agent run."""
+
+    # Run in the caller's context so the current request's timer is visible.
+    run_inline = True
+
+    def __init__(self):
+        self._starts = {}
+
+    def _start(self, run_id):
+        self._starts[run_id] = time.perf_counter()
+
+    def _end(self, run_id, name: str):
+        start = self._starts.pop(run_id, None)
+        timer = _current_timer.get()
+        if start is not None and timer is not None:
+            timer.add_span(name, start, (time.perf_counter() - start) * 1000)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, "llm")
+        increment("llm_round_trips")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "llm")
+        increment("llm_errors")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[run_id] = (time.perf_counter(), (serialized or {}).get("name") or kwargs.get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end_tool(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end_tool(run_id)
+
+    def _end_tool(self, run_id):
+        started = self._starts.pop(run_id, None)
+        timer = _current_timer.get()
+        if started is not None and timer is not None:
+            start, name = started
+            timer.add_span(f"tool.{name}", start, (time.perf_counter() - start) * 1000)
+            timer.increment("tool_calls")
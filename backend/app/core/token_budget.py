@@ -0,0 +1,200 @@
+import math
+import os
+import threading
+from functools import lru_cache
+
+from app.core import timing
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Upper bound on the tokens sent to the LLM per agent step, before the scratchpad.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# Longest a single history message or RAG hit may be (a past blog post gets clipped).
+PROMPT_MAX_ITEM_TOKENS = int(os.getenv("PROMPT_MAX_ITEM_TOKENS", "600"))
+# Longest the user's own input may be.
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "2000"))
+# A leftover smaller than this is not worth a truncated item; the item is dropped.
+PROMPT_MIN_ITEM_TOKENS = int(os.getenv("PROMPT_MIN_ITEM_TOKENS", "48"))
+
+# Role/separator tokens each chat message adds on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_MARKER = " …[truncated]"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Loads the tiktoken encoding once; None if tiktoken or its data isn't available."""
+    global _encoding, TIKTOKEN_AVAILABLE
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"⚠ tiktoken encoding unavailable, estimating tokens from length: {e}")
+                TIKTOKEN_AVAILABLE = False
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of `text`. Exact for cl100k, an approximation for other models' tokenizers."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=16)
+def count_fixed_tokens(text: str) -> int:
+    """count_tokens for text that rarely changes (system prompt, tool descriptions)."""
+    return count_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRUNCATION_MARKER))
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:keep * 4] + TRUNCATION_MARKER
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:keep]) + TRUNCATION_MARKER
+
+
+def _message_tokens(message) -> int:
+    return count_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+
+
+class PromptBudget:
+    """
+    Fits the variable parts of the agent prompt into a token budget.
+
+    The system prompt and tool descriptions are a fixed cost. The input is kept
+    up to PROMPT_MAX_INPUT_TOKENS. The rest of the budget goes to history
+    messages and RAG hits in order of value: the latest turn, the best hit,
+    the turn before, the next hit, and so on. Each item is clipped to
+    max_item_tokens first; items that no longer fit are truncated to the space
+    left or dropped, and once a history message is dropped so are all older ones.
+    """
+
+    def __init__(
+        self,
+        budget: int = PROMPT_TOKEN_BUDGET,
+        max_item_tokens: int = PROMPT_MAX_ITEM_TOKENS,
+        max_input_tokens: int = PROMPT_MAX_INPUT_TOKENS,
+        min_item_tokens: int = PROMPT_MIN_ITEM_TOKENS,
+    ):
+        self.budget = budget
+        self.max_item_tokens = max_item_tokens
+        self.max_input_tokens = max_input_tokens
+        self.min_item_tokens = min_item_tokens
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "trimmed_requests": 0, "tokens_saved": 0}
+
+    def fit(self, fixed_text: str, user_input: str, chat_history: list, memories: list) -> dict:
+        """
+        Returns {"input", "chat_history", "memories", "report"} trimmed to the budget.
+        The report has the tokens per section, before and after, and the tokens saved.
+        """
+        fixed = count_fixed_tokens(fixed_text)
+        before = {
+            "input": count_tokens(user_input),
+            "history": sum(_message_tokens(m) for m in chat_history),
+            "rag": sum(count_tokens(m) for m in memories),
+        }
+
+        user_input = truncate_to_tokens(user_input, self.max_input_tokens)
+        remaining = max(0, self.budget - fixed - count_tokens(user_input))
+
+        kept_history, kept_memories = {}, {}
+        history_closed = False
+        for kind, index in self._by_value(len(chat_history), len(memories)):
+            if kind == "history" and history_closed:
+                continue
+            if kind == "history":
+                text = str(chat_history[index].content)
+                overhead = MESSAGE_OVERHEAD_TOKENS
+            else:
+                text = memories[index]
+                overhead = 0
+            text = truncate_to_tokens(text, self.max_item_tokens)
+            cost = count_tokens(text) + overhead
+            if cost > remaining:
+                if remaining - overhead < self.min_item_tokens:
+                    history_closed = history_closed or kind == "history"
+                    continue
+                text = truncate_to_tokens(text, remaining - overhead)
+                cost = count_tokens(text) + overhead
+            remaining -= cost
+            if kind == "history":
+                kept_history[index] = text
+            else:
+                kept_memories[index] = text
+
+        trimmed_history = [
+            chat_history[i] if kept_history[i] == str(chat_history[i].content)
+            else chat_history[i].model_copy(update={"content": kept_history[i]})
+            for i in sorted(kept_history)
+        ]
+        trimmed_memories = [kept_memories[i] for i in sorted(kept_memories)]
+
+        after = {
+            "input": count_tokens(user_input),
+            "history": sum(_message_tokens(m) for m in trimmed_history),
+            "rag": sum(count_tokens(m) for m in trimmed_memories),
+        }
+        saved = sum(before.values()) - sum(after.values())
+        report = {
+            "budget": self.budget,
+            "fixed": fixed,
+            "before": before,
+            "after": after,
+            "total": fixed + sum(after.values()),
+            "saved": saved,
+            "dropped_messages": len(chat_history) - len(trimmed_history),
+            "dropped_memories": len(memories) - len(trimmed_memories),
+        }
+        self._record(report)
+        return {"input": user_input, "chat_history": trimmed_history, "memories": trimmed_memories, "report": report}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"budget": self.budget, "tokenizer": "tiktoken" if TIKTOKEN_AVAILABLE else "estimate", **self._stats}
+
+    @staticmethod
+    def _by_value(history_count: int, memory_count: int):
+        # History is chronological; a turn is two messages, newest last.
+        turns = [
+            list(range(max(0, end - 2), end))[::-1]
+            for end in range(history_count, 0, -2)
+        ]
+        for i in range(max(len(turns), memory_count)):
+            if i < len(turns):
+                for index in turns[i]:
+                    yield "history", index
+            if i < memory_count:
+                yield "rag", i
+
+    def _record(self, report: dict):
+        with self._lock:
+            self._stats["requests"] += 1
+            if report["saved"] > 0:
+                self._stats["trimmed_requests"] += 1
+                self._stats["tokens_saved"] += report["saved"]
+        if report["saved"] > 0:
+            timing.increment("prompt_tokens_saved", report["saved"])
+            print(
+                f"✂ Prompt trimmed to {report['total']}/{report['budget']} tokens, saved {report['saved']} "
+                f"(dropped {report['dropped_messages']} messages, {report['dropped_memories']} memories)"
+            )
+
+
+prompt_budget = PromptBudget()
@@ -0,0 +1,212 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from app.core import timing
+from app.core.tools.wrappers import wrap_tool, tool_call_key, coalesce_tool, coalesced_call
+
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2048"))
+# SQLite file for the on-disk tier that survives restarts; empty disables it.
+TOOL_CACHE_DISK_PATH = os.getenv("TOOL_CACHE_DISK_PATH", "")
+
+_MARKET_TZ = ZoneInfo("America/New_York")
+_MARKET_CLOSE = datetime.time(16, 0)
+# Daily bars for the session are usually final a few minutes after the bell.
+_MARKET_SETTLE = datetime.timedelta(minutes=15)
+
+
+def seconds_until_market_close(now: float = None) -> float:
+    """Seconds until the next US market close (16:00 New York, weekdays) has settled."""
+    current = datetime.datetime.fromtimestamp(now if now is not None else time.time(), _MARKET_TZ)
+    close = datetime.datetime.combine(current.date(), _MARKET_CLOSE, _MARKET_TZ) + _MARKET_SETTLE
+    while close <= current or close.weekday() >= 5:
+        close = datetime.datetime.combine(close.date() + datetime.timedelta(days=1), _MARKET_CLOSE, _MARKET_TZ) + _MARKET_SETTLE
+    return (close - current).total_seconds()
+
+
+# Freshness per tool: "ttl" is seconds (or a callable returning seconds) during
+# which a result is served as is; for another "stale" seconds it is still
+# served, but refreshed in the background. Tools not listed are not cached.
+TOOL_CACHE_POLICIES = {
+    "weather_tool": {"ttl": 10 * 60, "stale": 10 * 60},
+    "news_tool": {"ttl": 20 * 60, "stale": 20 * 60},
+    "duckduckgo_search": {"ttl": 30 * 60, "stale": 30 * 60},
+    "wikipedia_tool": {"ttl": 24 * 60 * 60, "stale": 24 * 60 * 60},
+    "get_daily_stock_prices": {"ttl": seconds_until_market_close, "stale": 30 * 60},
+    "get_multiple_stock_prices": {"ttl": seconds_until_market_close, "stale": 30 * 60},
+}
+
+# Tool outputs that report a failure are returned but never cached.
+_ERROR_OUTPUT = re.compile(
+    r"^\s*(error\b|an error|an unexpected error|http error|sorry\b|i couldn't|could not|that query is ambiguous|failed\b)",
+    re.I,
+)
+
+
+def is_cacheable_output(output) -> bool:
+    return isinstance(output, str) and bool(output.strip()) and not _ERROR_OUTPUT.match(output)
+
+
+class ToolResultCache:
+    """
+    TTL cache of tool results with an in-memory LRU tier and an optional
+    SQLite tier on disk.
+
+    A fresh result is returned directly. A stale one (past its TTL but inside
+    the tool's stale window) is returned too, and a background refresh is
+    started for it. Anything older is fetched again while the caller waits.
+    """
+
+    def __init__(self, max_entries: int, disk_path: str = "", policies: dict = TOOL_CACHE_POLICIES):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.policies = policies
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tool-cache-refresh")
+        self._local = threading.local()
+        self._stats = {}
+        if disk_path:
+            self._disk().execute(
+                "CREATE TABLE IF NOT EXISTS tool_results ("
+                "key TEXT PRIMARY KEY, tool TEXT NOT NULL, value TEXT NOT NULL, "
+                "fresh_until REAL NOT NULL, stale_until REAL NOT NULL)"
+            )
+
+    def get_or_fetch(self, tool_name: str, key: str, fetch):
+        """Returns the cached result for `key`, calling fetch() on a miss."""
+        now = time.time()
+        entry = self._lookup(tool_name, key, now)
+        if entry is not None:
+            if now < entry["fresh_until"]:
+                self._count(tool_name, "hits")
+                return entry["value"]
+            self._count(tool_name, "stale_hits")
+            self._refresh_in_background(tool_name, key, fetch)
+            return entry["value"]
+
+        self._count(tool_name, "misses")
+        value = fetch()
+        self._store(tool_name, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_path:
+            self._disk().execute("DELETE FROM tool_results")
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_tool = {name: dict(counts) for name, counts in self._stats.items()}
+            entries = len(self._entries)
+        for counts in by_tool.values():
+            served = counts.get("hits", 0) + counts.get("stale_hits", 0)
+            lookups = served + counts.get("misses", 0)
+            counts["hit_rate"] = round(served / lookups, 4) if lookups else 0.0
+        return {"entries": entries, "max_entries": self.max_entries, "disk": bool(self.disk_path), "by_tool": by_tool}
+
+    def _lookup(self, tool_name: str, key: str, now: float):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now < entry["stale_until"]:
+                    self._entries.move_to_end(key)
+                    return entry
+                del self._entries[key]
+        if not self.disk_path:
+            return None
+        row = self._disk().execute(
+            "SELECT value, fresh_until, stale_until FROM tool_results WHERE key = ? AND stale_until > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self._count(tool_name, "disk_hits")
+        entry = {"value": json.loads(row[0]), "fresh_until": row[1], "stale_until": row[2]}
+        self._remember(key, entry)
+        return entry
+
+    def _store(self, tool_name: str, key: str, value):
+        if not is_cacheable_output(value):
+            self._count(tool_name, "not_cached")
+            return
+        policy = self.policies[tool_name]
+        ttl = policy["ttl"]() if callable(policy["ttl"]) else policy["ttl"]
+        now = time.time()
+        entry = {"value": value, "fresh_until": now + ttl, "stale_until": now + ttl + policy.get("stale", 0)}
+        self._remember(key, entry)
+        if self.disk_path:
+            try:
+                self._disk().execute(
+                    "INSERT OR REPLACE INTO tool_results (key, tool, value, fresh_until, stale_until) VALUES (?, ?, ?, ?, ?)",
+                    (key, tool_name, json.dumps(value), entry["fresh_until"], entry["stale_until"]),
+                )
+            except Exception as e:
+                print(f"Could not write tool cache entry to disk: {e}")
+
+    def _remember(self, key: str, entry: dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh_in_background(self, tool_name: str, key: str, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._store(tool_name, key, fetch())
+                self._count(tool_name, "refreshes")
+            except Exception as e:
+                print(f"Background refresh of {tool_name} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresher.submit(refresh)
+
+    def _count(self, tool_name: str, name: str):
+        with self._lock:
+            counts = self._stats.setdefault(tool_name, {})
+            counts[name] = counts.get(name, 0) + 1
+        timing.increment(f"tool_cache_{name}")
+
+    def _disk(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.disk_path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+tool_cache = ToolResultCache(max_entries=TOOL_CACHE_MAX_ENTRIES, disk_path=TOOL_CACHE_DISK_PATH)
+
+
+def cache_tool(tool: BaseTool, cache: ToolResultCache = tool_cache) -> StructuredTool:
+    """
+    Wraps a tool with the result cache (when it has a freshness policy) and
+    with single-flight coalescing of concurrent identical calls.
+    """
+    if not TOOL_CACHE_ENABLED or tool.name not in cache.policies:
+        return coalesce_tool(tool)
+    fetch = coalesced_call(tool)
+    return wrap_tool(
+        tool,
+        lambda args: cache.get_or_fetch(tool.name, tool_call_key(tool.name, args), lambda: fetch(args)),
+    )
@@ -1,23 +1,18 @@
 import os
 import json
-import pandas as pd
-import matplotlib.pyplot as plt
+import importlib.util
 from datetime import datetime
 from langchain.tools import tool
 
-# Try to import optional dependencies
-try:
-    import yfinance as yf
-    YFINANCE_AVAILABLE = True
-except ImportError:
-    YFINANCE_AVAILABLE = False
+# yfinance, alpha_vantage and matplotlib (with pandas) take about a second to
+# import, so only their availability is checked here; the tools import them
+# when they first run.
+YFINANCE_AVAILABLE = importlib.util.find_spec("yfinance") is not None
+if not YFINANCE_AVAILABLE:
     print("Warning: yfinance not available. Some features will be limited.")
 
-try:
-    from alpha_vantage.timeseries import TimeSeries
-    ALPHA_VANTAGE_AVAILABLE = True
-except ImportError:
-    ALPHA_VANTAGE_AVAILABLE = False
+ALPHA_VANTAGE_AVAILABLE = importlib.util.find_spec("alpha_vantage") is not None
+if not ALPHA_VANTAGE_AVAILABLE:
     print("Warning: alpha_vantage not available. Some features will be limited.")
 
 def ensure_static_dir():
@@ -43,6 +38,7 @@ def get_daily_stock_prices(ticker_symbol: str) -> str:
         api_key = os.getenv("ALPHA_VANTAGE_API_KEY")
         if api_key and ALPHA_VANTAGE_AVAILABLE:
             try:
+                from alpha_vantage.timeseries import TimeSeries
                 ts = TimeSeries(key=api_key, output_format='pandas')
                 data, meta_data = ts.get_daily(symbol=ticker_symbol, outputsize='compact')
                 
@@ -54,6 +50,7 @@ def get_daily_stock_prices(ticker_symbol: str) -> str:
         
         # Fallback to yfinance
         if YFINANCE_AVAILABLE:
+            import yfinance as yf
             stock = yf.Ticker(ticker_symbol)
             hist = stock.history(period="3mo")
             
@@ -79,6 +76,7 @@ def get_multiple_stock_prices(ticker_symbols: str) -> str:
     try:
         if not YFINANCE_AVAILABLE:
             return "Error: yfinance package is required for multiple stock downloads. Please install it with: pip install yfinance"
+        import yfinance as yf
         
         # Parse ticker symbols
         tickers = [ticker.strip().upper() for ticker in ticker_symbols.split(',')]
@@ -118,6 +116,8 @@ def create_stock_comparison_chart(ticker_symbols: str, period: str = "1y") -> st
     try:
         if not YFINANCE_AVAILABLE:
             return "Error: yfinance package is required for chart creation. Please install it with: pip install yfinance"
+        import yfinance as yf
+        import matplotlib.pyplot as plt
         
         ensure_static_dir()
         
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+import re
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from app.core import timing
+from app.core.concurrency import run_blocking
+from app.core.singleflight import SingleFlight
+
+# Upper bound on a single tool call made by the agent. A call that overruns
+# returns an error observation so the agent can answer with what it has.
+TOOL_CALL_TIMEOUT_SECONDS = float(os.getenv("TOOL_CALL_TIMEOUT_SECONDS", "20"))
+
+# Tools whose arguments are case-sensitive (code); all other string arguments
+# are compared case-insensitively ("TSLA" == "tsla", "Lucknow" == "lucknow").
+CASE_SENSITIVE_TOOLS = {"code_interpreter_tool"}
+
+tool_flights = SingleFlight()
+
+
+def normalize_tool_args(tool_name: str, args: dict) -> dict:
+    """Normalizes tool arguments so equivalent calls compare equal."""
+    normalized = {}
+    for name, value in args.items():
+        if isinstance(value, str):
+            value = re.sub(r"\s+", " ", value.strip().strip("'\""))
+            if tool_name not in CASE_SENSITIVE_TOOLS:
+                value = value.casefold()
+        normalized[name] = value
+    return normalized
+
+
+def tool_call_key(tool_name: str, args: dict) -> str:
+    return f"{tool_name}:{json.dumps(normalize_tool_args(tool_name, args), sort_keys=True, default=str)}"
+
+
+def invoke_tool(tool: BaseTool, args: dict):
+    """Runs the wrapped tool directly, without re-emitting callbacks for the proxy's run."""
+    return tool.invoke(args, config={"callbacks": []})
+
+
+def wrap_tool(tool: BaseTool, call, timeout: float = None) -> StructuredTool:
+    """
+    Returns a proxy with the same name, description and arguments as `tool`,
+    whose calls are routed through call(args: dict).
+
+    Async calls (the agent's) run on the default executor and give up after
+    `timeout` seconds (TOOL_CALL_TIMEOUT_SECONDS by default), so concurrent
+    tool calls in one agent step are each bounded.
+    """
+    field_names = list(tool.args)
+
+    def func(*args, **kwargs):
+        # ReAct agents pass a bare string, which arrives positionally.
+        kwargs.update(zip(field_names, args))
+        return call(kwargs)
+
+    async def coroutine(*args, **kwargs):
+        kwargs.update(zip(field_names, args))
+        limit = timeout if timeout is not None else TOOL_CALL_TIMEOUT_SECONDS
+        try:
+            return await asyncio.wait_for(run_blocking(None, call, kwargs), limit)
+        except asyncio.TimeoutError:
+            timing.increment("tool_timeouts")
+            return f"Error: {tool.name} timed out after {limit:g}s. Answer with the information you already have."
+
+    return StructuredTool.from_function(
+        func=func,
+        coroutine=coroutine,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+    )
+
+
+def coalesced_call(tool: BaseTool):
+    """Returns call(args) for the tool that shares one execution between concurrent identical calls."""
+    def call(args: dict):
+        return tool_flights.do_sync(tool_call_key(tool.name, args), lambda: invoke_tool(tool, args))
+    return call
+
+
+def coalesce_tool(tool: BaseTool) -> StructuredTool:
+    """Shares one execution between concurrent identical calls of the tool, across all users."""
+    return wrap_tool(tool, coalesced_call(tool))
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+# Directory of the memory-mapped on-disk store; empty keeps the cache in memory only.
+# Each server process needs its own directory.
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "")
+EMBED_CACHE_DISK_ROWS = int(os.getenv("EMBED_CACHE_DISK_ROWS", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalizes the text and collapses whitespace, which the tokenizer ignores anyway."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_key(model_id: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class DiskEmbeddingStore:
+    """
+    Embeddings in a memory-mapped file of `capacity` rows, reused as a ring.
+
+    Each row holds its key, a write sequence number and the vector. A row is
+    marked invalid while it is being overwritten, so a crash mid-write loses
+    that entry rather than pairing a key with another text's vector. The file
+    is created on the first put, once the vector size is known.
+    """
+
+    def __init__(self, directory: str, capacity: int, model_id: str):
+        self.directory = directory
+        self.capacity = capacity
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self._records = None
+        self._rows = {}
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        meta = self._read_meta()
+        if meta is not None:
+            self._open(meta["dim"], create=False)
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.json")
+
+    @property
+    def _data_path(self) -> str:
+        return os.path.join(self.directory, "embeddings.mmap")
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠ Unreadable embedding store metadata in {self.directory}; starting it over: {e}")
+            return None
+        if meta.get("capacity") != self.capacity or meta.get("model_id") != self.model_id or not os.path.exists(self._data_path):
+            return None
+        return meta
+
+    def _open(self, dim: int, create: bool):
+        dtype = np.dtype([("sequence", "<i8"), ("key", "u1", 32), ("vector", "<f4", dim)])
+        self._records = np.memmap(self._data_path, dtype=dtype, mode="w+" if create else "r+", shape=(self.capacity,))
+        if create:
+            with open(self._meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model_id": self.model_id, "capacity": self.capacity, "dim": dim}, f)
+            return
+        valid = np.flatnonzero(self._records["sequence"] > 0)
+        for row in valid:
+            self._rows[self._records["key"][row].tobytes()] = int(row)
+        if len(valid):
+            self._sequence = int(self._records["sequence"][valid].max())
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, key: bytes):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            return np.array(self._records["vector"][row])
+
+    def put(self, key: bytes, vector: np.ndarray):
+        with self._lock:
+            if self._records is None:
+                self._open(len(vector), create=True)
+            if len(vector) != self._records.dtype["vector"].shape[0] or key in self._rows:
+                return
+            self._sequence += 1
+            row = (self._sequence - 1) % self.capacity
+            record = self._records[row]
+            if record["sequence"] > 0:
+                self._rows.pop(record["key"].tobytes(), None)
+            self._records["sequence"][row] = 0
+            self._records["key"][row] = np.frombuffer(key, dtype=np.uint8)
+            self._records["vector"][row] = vector
+            self._records["sequence"][row] = self._sequence
+            self._rows[key] = row
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings.
+
+    Entries are keyed by a hash of the model id and the normalized text, so
+    the same text is only encoded once per model. The most recently used
+    `max_entries` vectors are kept in memory; with a directory, every vector
+    is also written to a DiskEmbeddingStore that survives restarts.
+    """
+
+    def __init__(self, model_id: str, max_entries: int = EMBED_CACHE_SIZE, directory: str = EMBED_CACHE_DIR,
+                 disk_rows: int = EMBED_CACHE_DISK_ROWS):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self._directory = directory
+        self._disk_rows = disk_rows
+        self._disk = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+    def key(self, text: str) -> bytes:
+        return embedding_key(self.model_id, text)
+
+    def get(self, key: bytes):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return vector
+        disk = self._disk_store()
+        vector = disk.get(key) if disk is not None else None
+        with self._lock:
+            if vector is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, vector)
+        return vector
+
+    def put(self, key: bytes, vector: np.ndarray):
+        # Copied: a view would pin the array it was sliced from, outside max_entries' bound.
+        vector = np.array(vector, dtype=np.float32, copy=True)
+        with self._lock:
+            self._remember(key, vector)
+        disk = self._disk_store()
+        if disk is not None:
+            try:
+                disk.put(key, vector)
+            except Exception as e:
+                print(f"⚠ Could not write to the embedding store: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "disk_entries": len(self._disk) if self._disk is not None else None,
+            }
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_store(self):
+        if not self._directory:
+            return None
+        if self._disk is None:
+            with self._lock:
+                if self._disk is None:
+                    try:
+                        self._disk = DiskEmbeddingStore(self._directory, self._disk_rows, self.model_id)
+                    except Exception as e:
+                        print(f"⚠ Embedding store unavailable, caching in memory only: {e}")
+                        self._directory = ""
+                        return None
+        return self._disk
@@ -0,0 +1,147 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+EMBED_BATCHING = os.getenv("EMBED_BATCHING", "true").lower() == "true"
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "64"))
+# How long the first request of a batch waits for others to join it. With 0,
+# a batch is whatever queued up while the previous one was encoding. There is
+# no wait while the load is light (the previous batch served a single request).
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "2"))
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches encode requests from concurrent callers.
+
+    Each caller's texts are queued and a single worker thread encodes the
+    queued requests together in one model.encode call, as soon as the batch
+    is full or its first request has waited `max_wait_ms` (only under load, so
+    a lone request isn't delayed). Callers block until
+    their own vectors are ready. One batched call uses the model's vectorized
+    kernels far better than many single-text calls contending for the GIL.
+
+    With a `cache` (see embedding_cache.py), texts already seen are answered
+    from it and only the rest reach the model; a text repeated within a batch
+    is encoded once.
+    """
+
+    def __init__(self, load_model, max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+                 max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS, enabled: bool = EMBED_BATCHING, cache=None):
+        self._load_model = load_model
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.enabled = enabled
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._last_batch_requests = 0
+        self._batch_sizes = deque(maxlen=500)
+        self._stats = {"requests": 0, "texts": 0, "batches": 0, "largest_batch": 0, "errors": 0}
+
+    def encode(self, texts, normalize: bool = False):
+        """
+        Encodes one text (returns a vector) or a list of texts (returns one row per text).
+        With `normalize`, the vectors are scaled to unit length.
+        """
+        single = isinstance(texts, str)
+        items = [texts] if single else list(texts)
+        if not items:
+            return np.empty((0, 0), dtype=np.float32)
+        if self.cache is None:
+            vectors = self._encode(items)
+        else:
+            vectors = self._encode_cached(items)
+        if normalize:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors[0] if single else vectors
+
+    def _encode(self, items: list):
+        if not self.enabled:
+            return self._load_model().encode(items)
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((items, future))
+        return future.result()
+
+    def _encode_cached(self, items: list):
+        keys = [self.cache.key(text) for text in items]
+        found = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(found) if vector is None]
+        if not missing:
+            return np.stack(found)
+        encoded = self._encode([items[i] for i in missing])
+        if not isinstance(encoded, np.ndarray):
+            # Only real arrays are cached (a stubbed model may return anything).
+            return encoded
+        for i, vector in zip(missing, encoded):
+            self.cache.put(keys[i], vector)
+            found[i] = vector
+        return encoded if len(missing) == len(items) else np.stack(found)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = list(self._batch_sizes)
+            return {
+                **self._stats,
+                "enabled": self.enabled,
+                "avg_batch": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                "queued": self._queue.qsize(),
+            }
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + (self.max_wait if self._last_batch_requests > 1 else 0)
+            while size < self.max_batch_size:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._last_batch_requests = len(pending)
+            self._encode_batch(pending)
+
+    def _encode_batch(self, pending: list):
+        texts = [text for items, _ in pending for text in items]
+        unique = list(dict.fromkeys(texts))
+        try:
+            vectors = self._load_model().encode(unique, batch_size=max(len(unique), 1))
+            if len(unique) < len(texts):
+                rows = {text: row for row, text in enumerate(unique)}
+                vectors = vectors[[rows[text] for text in texts]]
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self._stats["requests"] += len(pending)
+            self._stats["texts"] += len(unique)
+            self._stats["batches"] += 1
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(texts))
+            self._batch_sizes.append(len(texts))
+        offset = 0
+        for items, future in pending:
+            # A copy, so a caller (or the cache) holding its rows doesn't keep the whole batch alive.
+            future.set_result(vectors[offset:offset + len(items)].copy())
+            offset += len(items)
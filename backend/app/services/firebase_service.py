@@ -1,6 +1,20 @@
 import firebase_admin
 from firebase_admin import firestore, auth
+import asyncio
 import datetime
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from app.core import timing
+from app.core.concurrency import run_blocking, IO_EXECUTOR
+
+AUTH_TOKEN_CACHE_ENABLED = os.getenv("AUTH_TOKEN_CACHE_ENABLED", "true").lower() == "true"
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+# How often Google's ID-token signing certificates are refetched in the background.
+AUTH_CERT_REFRESH_SECONDS = float(os.getenv("AUTH_CERT_REFRESH_SECONDS", "3600"))
+ID_TOKEN_CERT_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
 
 # --- THIS IS THE FIX ---
 # We no longer call firestore.client() at the top level.
@@ -34,6 +48,25 @@ def save_message_to_firestore(user_id: str, session_id: str, sender: str, text:
     except Exception as e:
         print(f"Error saving message to Firestore for user {user_id}: {e}")
 
+def save_messages_to_firestore(user_id: str, session_id: str, messages: list) -> bool:
+    """Saves several messages (dicts with sender, text, timestamp) in one batched write."""
+    try:
+        db = get_db_client()
+        messages_ref = db.collection('conversations').document(user_id).collection('messages')
+        batch = db.batch()
+        for message in messages:
+            batch.set(messages_ref.document(), {
+                'session_id': session_id,
+                'sender': message['sender'],
+                'text': message['text'],
+                'timestamp': message.get('timestamp') or datetime.datetime.utcnow()
+            })
+        batch.commit()
+        return True
+    except Exception as e:
+        print(f"Error saving messages to Firestore for user {user_id}: {e}")
+        return False
+
 def get_conversations_from_firestore(user_id: str):
     """Retrieves all messages for a specific user, ordered by timestamp."""
     try:
@@ -86,15 +119,16 @@ def get_recent_session_messages(user_id: str, session_id: str, limit: int = 10)
     try:
         db = get_db_client()
         messages_ref = db.collection('conversations').document(user_id).collection('messages')
-        docs = (
-            messages_ref
-            .where('session_id', '==', session_id)
-            .order_by('timestamp', direction=firestore.Query.DESCENDING)
-            .limit(limit)
-            .stream()
-        )
-        # Reverse so oldest comes first (chronological order for memory seeding)
-        messages = [doc.to_dict() for doc in docs]
+        with timing.span("firestore_seed"):
+            docs = (
+                messages_ref
+                .where('session_id', '==', session_id)
+                .order_by('timestamp', direction=firestore.Query.DESCENDING)
+                .limit(limit)
+                .stream()
+            )
+            # Reverse so oldest comes first (chronological order for memory seeding)
+            messages = [doc.to_dict() for doc in docs]
         messages.reverse()
         return messages
     except Exception as e:
@@ -102,12 +136,116 @@ def get_recent_session_messages(user_id: str, session_id: str, limit: int = 10)
         return []
 
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of decoded Firebase ID tokens, keyed by the token's SHA-256.
+
+    The frontend sends the same ID token for up to an hour, so a token whose
+    signature has been verified once is trusted until its own `exp` claim.
+    Expired entries are never returned.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _key(id_token: str) -> str:
+        return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+    def get(self, id_token: str) -> dict:
+        key = self._key(id_token)
+        with self._lock:
+            decoded = self._entries.get(key)
+            if decoded is None or decoded.get("exp", 0) <= time.time():
+                if decoded is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return decoded
+
+    def put(self, id_token: str, decoded: dict):
+        if decoded.get("exp", 0) <= time.time():
+            return
+        key = self._key(id_token)
+        with self._lock:
+            self._entries[key] = decoded
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+token_cache = VerifiedTokenCache(max_entries=AUTH_TOKEN_CACHE_MAX_ENTRIES)
+
 def verify_firebase_token(id_token: str) -> dict:
     """Verifies the Firebase ID token from the frontend and returns the user's data."""
+    if AUTH_TOKEN_CACHE_ENABLED:
+        decoded_token = token_cache.get(id_token)
+        if decoded_token is not None:
+            return decoded_token
     try:
         # The auth module doesn't need the client, it uses the default initialized app
-        decoded_token = auth.verify_id_token(id_token)
+        with timing.span("auth"):
+            decoded_token = auth.verify_id_token(id_token)
+        if AUTH_TOKEN_CACHE_ENABLED:
+            token_cache.put(id_token, decoded_token)
         return decoded_token
     except Exception as e:
         print(f"Error verifying Firebase token: {e}")
         return None
+
+def refresh_signing_certs() -> bool:
+    """
+    Refetches Google's ID-token signing certificates into the verifier's HTTP cache.
+
+    verify_id_token() otherwise refetches them on the request path whenever the
+    cached copy goes stale.
+    """
+    try:
+        # The verifier keeps its certificates in a Cache-Control aware session;
+        # "no-cache" bypasses the stored copy and stores the fresh response.
+        request = auth._get_client(None)._token_verifier.request
+        response = request(ID_TOKEN_CERT_URL, method="GET", headers={"Cache-Control": "no-cache"})
+        return response.status == 200
+    except Exception as e:
+        print(f"Could not refresh Firebase signing certificates: {e}")
+        return False
+
+async def refresh_signing_certs_periodically(interval: float = AUTH_CERT_REFRESH_SECONDS):
+    """Background task: keeps the signing certificates warm until cancelled."""
+    while True:
+        await run_blocking(IO_EXECUTOR, refresh_signing_certs)
+        await asyncio.sleep(interval)
+
+def save_job_to_firestore(job: dict) -> bool:
+    """Creates or overwrites a background job's record (status, result, timestamps)."""
+    try:
+        db = get_db_client()
+        db.collection('jobs').document(job['job_id']).set(job)
+        return True
+    except Exception as e:
+        print(f"Error saving job {job.get('job_id')} to Firestore: {e}")
+        return False
+
+def get_job_from_firestore(job_id: str) -> dict:
+    """Returns a background job's record, or None if it doesn't exist or can't be read."""
+    try:
+        db = get_db_client()
+        doc = db.collection('jobs').document(job_id).get()
+        return doc.to_dict() if doc.exists else None
+    except Exception as e:
+        print(f"Error fetching job {job_id} from Firestore: {e}")
+        return None
@@ -0,0 +1,219 @@
+import asyncio
+import datetime
+import multiprocessing
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.core.admission import llm_admission, AdmissionRejected, BACKGROUND
+from app.core.concurrency import run_blocking, IO_EXECUTOR
+from app.core.llm_providers import LLMUnavailable, crew_provider_order, record_crew_outcomes, crew_health_stats
+from app.services.firebase_service import save_job_to_firestore, get_job_from_firestore
+
+CREW_MAX_WORKERS = int(os.getenv("CREW_MAX_WORKERS", "2"))
+# Finished jobs kept in memory for fast polling; older ones are read back from Firestore.
+JOB_MEMORY_LIMIT = int(os.getenv("JOB_MEMORY_LIMIT", "500"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED)
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+
+def run_blog_crew(topic: str, provider_names: list) -> dict:
+    """
+    Runs the blog crew on `provider_names`; CrewAI is imported here, in the
+    worker, not with the server. Returns the post (or why there is none) and
+    how each provider did.
+    """
+    from app.core.crews.blog_crew import create_blog_post_crew
+    outcomes = []
+    try:
+        result = create_blog_post_crew(topic, provider_names, outcomes)
+    except LLMUnavailable as e:
+        return {"result": None, "error": str(e), "outcomes": outcomes}
+    return {"result": result, "error": None, "outcomes": outcomes}
+
+
+def _default_executor_factory(max_workers: int):
+    # "spawn" so workers don't inherit the server's threads, sockets and Firebase app.
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class JobManager:
+    """
+    Runs long crew pipelines as background jobs.
+
+    submit() records the job and returns its id immediately. The crew itself
+    runs in a bounded pool of worker processes, so it neither blocks the event
+    loop nor competes with the chat pipeline for the GIL. Every status change
+    is written to Firestore, so a finished job can be fetched again later
+    without rerunning it, and is pushed to any subscribers.
+    """
+
+    def __init__(self, max_workers: int, executor_factory=_default_executor_factory):
+        self.max_workers = max_workers
+        self._executor_factory = executor_factory
+        self._executor = None
+        self._free_workers = None
+        self._jobs = OrderedDict()
+        self._subscribers = {}
+        self._tasks = set()
+        self._stats = {"submitted": 0, "succeeded": 0, "failed": 0}
+
+    async def submit(self, user_id: str, topic: str, fn=None) -> dict:
+        """Queues the blog crew (or `fn(topic)`) as a job owned by `user_id` and returns the job record."""
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "kind": "blog_crew",
+            "topic": topic,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self._remember(job)
+        self._stats["submitted"] += 1
+        await run_blocking(IO_EXECUTOR, save_job_to_firestore, dict(job))
+        task = asyncio.create_task(self._run(job, fn))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return dict(job)
+
+    async def get(self, job_id: str, user_id: str) -> dict:
+        """Returns the job if it exists and belongs to `user_id`, otherwise None."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = await run_blocking(IO_EXECUTOR, get_job_from_firestore, job_id)
+        if job is None or job.get("user_id") != user_id:
+            return None
+        return dict(job)
+
+    async def subscribe(self, job_id: str, user_id: str):
+        """Yields the job record now and after every status change, until it finishes."""
+        job = await self.get(job_id, user_id)
+        if job is None:
+            return
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        try:
+            # Re-read after subscribing so a change in between isn't missed.
+            job = dict(self._jobs.get(job_id, job))
+            while True:
+                yield job
+                if job["status"] in TERMINAL_STATUSES:
+                    return
+                job = await queue.get()
+        finally:
+            subscribers = self._subscribers.get(job_id, [])
+            if queue in subscribers:
+                subscribers.remove(queue)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    def stats(self) -> dict:
+        statuses = [job["status"] for job in self._jobs.values()]
+        return {
+            **self._stats,
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "max_workers": self.max_workers,
+            "providers": crew_health_stats(),
+        }
+
+    def shutdown(self):
+        """Cancels pending jobs and stops the worker processes without waiting for running crews."""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._free_workers = None
+
+    async def _run(self, job: dict, fn):
+        try:
+            # Wait for a pool worker before taking an LLM slot, so jobs queued
+            # behind the running crews don't sit on slots that chat needs.
+            async with self._worker(), llm_admission.slot(BACKGROUND):
+                await self._update(job, status=RUNNING, started_at=_now())
+                if fn is None:
+                    result = await self._run_blog_crew(job["topic"])
+                else:
+                    result = await self._run_in_pool(fn, job["topic"])
+            await self._update(job, status=SUCCEEDED, result=result, finished_at=_now())
+            self._stats["succeeded"] += 1
+        except asyncio.CancelledError:
+            await asyncio.shield(self._update(job, status=FAILED, error="Job was cancelled.", finished_at=_now()))
+            self._stats["failed"] += 1
+            raise
+        except AdmissionRejected as e:
+            await self._update(job, status=FAILED, error=f"Server busy: {e.reason}", finished_at=_now())
+            self._stats["failed"] += 1
+        except LLMUnavailable as e:
+            await self._update(job, status=FAILED, error=str(e), finished_at=_now())
+            self._stats["failed"] += 1
+        except Exception as e:
+            print(f"Job {job['job_id']} failed: {e}")
+            await self._update(job, status=FAILED, error="An error occurred while the AI crew was working.", finished_at=_now())
+            self._stats["failed"] += 1
+
+    def _worker(self) -> asyncio.Semaphore:
+        # Created on first use, inside the running loop (a new one after shutdown()).
+        if self._free_workers is None:
+            self._free_workers = asyncio.Semaphore(self.max_workers)
+        return self._free_workers
+
+    async def _run_blog_crew(self, topic: str) -> str:
+        """
+        Runs the crew on the providers whose circuit is closed here and records
+        the outcomes the worker reports, so every job shares one breaker.
+        """
+        provider_names = crew_provider_order()
+        if not provider_names:
+            raise LLMUnavailable("All LLM providers are unavailable (circuits open). Please try again shortly.")
+        run = await self._run_in_pool(run_blog_crew, topic, provider_names)
+        record_crew_outcomes(run["outcomes"])
+        if run["error"]:
+            raise LLMUnavailable(run["error"])
+        return run["result"]
+
+    async def _run_in_pool(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = self._executor_factory(self.max_workers)
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); replace the pool so later jobs can still run.
+            self._executor = None
+            raise
+
+    async def _update(self, job: dict, **changes):
+        job.update(changes)
+        await run_blocking(IO_EXECUTOR, save_job_to_firestore, dict(job))
+        for queue in self._subscribers.get(job["job_id"], []):
+            queue.put_nowait(dict(job))
+        if job["status"] in TERMINAL_STATUSES:
+            self._trim()
+
+    def _remember(self, job: dict):
+        self._jobs[job["job_id"]] = job
+        self._trim()
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in TERMINAL_STATUSES]
+        for job_id in finished[:max(0, len(finished) - JOB_MEMORY_LIMIT)]:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager(max_workers=CREW_MAX_WORKERS)
@@ -0,0 +1,305 @@
+"""
+Per-user memory as memory-mapped NumPy matrices (VECTOR_DB_BACKEND=numpy).
+
+Each user's directory holds an append-only file of embedding rows
+(vectors.bin, float32 or float16), one JSON line per row with its id,
+document and metadata (records.jsonl), and the row size (meta.json). A
+search is an exact, vectorized L2 top-k over the memory-mapped rows, which
+for a few thousand memories takes well under a millisecond. Past
+VECTOR_STORE_ANN_THRESHOLD rows the user's search switches to an hnswlib
+index (if installed), saved next to the rows and extended as rows are added.
+
+Like Chroma's PersistentClient, a directory takes writes from one server
+process only.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "./vector_store")
+# float16 halves the disk and page cache footprint, but every query converts
+# the rows to float32 for scoring, which makes exact search several times slower.
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")
+VECTOR_STORE_ANN_THRESHOLD = int(os.getenv("VECTOR_STORE_ANN_THRESHOLD", "20000"))
+# hnswlib search breadth: higher finds more of the true nearest memories, slower.
+VECTOR_STORE_ANN_EF = int(os.getenv("VECTOR_STORE_ANN_EF", "200"))
+# Users whose rows, documents and index stay open in memory.
+VECTOR_STORE_OPEN_USERS = int(os.getenv("VECTOR_STORE_OPEN_USERS", "1024"))
+
+VECTORS_FILE = "vectors.bin"
+RECORDS_FILE = "records.jsonl"
+META_FILE = "meta.json"
+INDEX_FILE = "index.hnsw"
+INDEX_META_FILE = "index.json"
+# Rows converted to float32 at a time when scoring float16 matrices.
+SCORE_CHUNK_ROWS = 65536
+
+
+def user_directory_name(user_id: str) -> str:
+    if re.fullmatch(r"[A-Za-z0-9_-]{1,128}", user_id):
+        return user_id
+    return "h_" + hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+
+
+def _hnswlib():
+    try:
+        import hnswlib
+        return hnswlib
+    except ImportError:
+        return None
+
+
+class UserVectors:
+    """
+    One user's rows. Appends write the vectors before the records, and
+    opening trims whichever file is ahead, so a crash mid-append loses that
+    append rather than pairing a document with another's vector.
+    """
+
+    def __init__(self, directory: str, dtype: str = None, dim: int = None, lock=None):
+        self.directory = directory
+        self.lock = lock or threading.Lock()
+        self.index = None
+        self.index_rows = 0
+        self._saved_index_rows = 0
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        else:
+            if dim is None:
+                raise LookupError(f"No vector store in {directory}")
+            os.makedirs(directory, exist_ok=True)
+            meta = {"dim": dim, "dtype": dtype}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self._row_bytes = self.dim * self.dtype.itemsize
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        self.documents = []
+        record_bytes = 0
+        try:
+            with open(self._path(RECORDS_FILE), "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self.documents.append(json.loads(line)["document"])
+                    record_bytes += len(line)
+        except FileNotFoundError:
+            pass
+        vector_bytes = os.path.getsize(self._path(VECTORS_FILE)) if os.path.exists(self._path(VECTORS_FILE)) else 0
+        self.count = min(len(self.documents), vector_bytes // self._row_bytes)
+
+        if self.count < len(self.documents) or vector_bytes != self.count * self._row_bytes:
+            print(f"⚠ Trimming an incomplete append in {self.directory} to {self.count} rows.")
+            self.documents = self.documents[:self.count]
+            with open(self._path(RECORDS_FILE), "rb") as f:
+                kept = b"".join(line for _, line in zip(range(self.count), f))
+            with open(self._path(RECORDS_FILE), "wb") as f:
+                f.write(kept)
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.truncate(self.count * self._row_bytes)
+        elif os.path.exists(self._path(RECORDS_FILE)) and os.path.getsize(self._path(RECORDS_FILE)) != record_bytes:
+            with open(self._path(RECORDS_FILE), "ab") as f:
+                f.truncate(record_bytes)
+        self._map()
+
+    def _map(self):
+        if self.count == 0:
+            self.matrix = np.empty((0, self.dim), dtype=self.dtype)
+            self.sq_norms = np.empty(0, dtype=np.float32)
+            return
+        self.matrix = np.memmap(self._path(VECTORS_FILE), dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+        self.sq_norms = self._squared_norms(0, self.count)
+
+    def _squared_norms(self, start: int, stop: int) -> np.ndarray:
+        norms = np.empty(stop - start, dtype=np.float32)
+        for i in range(start, stop, SCORE_CHUNK_ROWS):
+            rows = np.asarray(self.matrix[i:min(i + SCORE_CHUNK_ROWS, stop)], dtype=np.float32)
+            norms[i - start:i - start + len(rows)] = np.einsum("ij,ij->i", rows, rows)
+        return norms
+
+    def append(self, embeddings: np.ndarray, ids: list, documents: list, metadatas: list):
+        rows = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        if rows.ndim != 2 or rows.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got shape {rows.shape}")
+        with open(self._path(VECTORS_FILE), "ab") as f:
+            f.write(rows.tobytes())
+        lines = [json.dumps({"id": record_id, "document": document, "metadata": metadata}, ensure_ascii=False) + "\n"
+                 for record_id, document, metadata in zip(ids, documents, metadatas)]
+        with open(self._path(RECORDS_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+        start = self.count
+        self.count += len(rows)
+        self.documents.extend(documents)
+        self.matrix = np.memmap(self._path(VECTORS_FILE), dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+        self.sq_norms = np.concatenate([self.sq_norms, self._squared_norms(start, self.count)])
+
+    def exact_top_k(self, query: np.ndarray, k: int) -> np.ndarray:
+        """Row numbers of the k nearest rows by L2 distance, nearest first."""
+        if self.dtype == np.float32:
+            dots = self.matrix @ query
+        else:
+            dots = np.concatenate([np.asarray(self.matrix[i:i + SCORE_CHUNK_ROWS], dtype=np.float32) @ query
+                                   for i in range(0, self.count, SCORE_CHUNK_ROWS)])
+        # |x - q|^2 = |x|^2 - 2 x.q + |q|^2, and |q|^2 doesn't change the order.
+        distances = self.sq_norms - 2 * dots
+        if k < self.count:
+            candidates = np.argpartition(distances, k)[:k]
+            return candidates[np.argsort(distances[candidates], kind="stable")]
+        return np.argsort(distances, kind="stable")
+
+    def ensure_index(self, hnswlib) -> bool:
+        """Builds (or loads, then extends) the user's hnswlib index; returns whether one is available."""
+        if self.index is None:
+            index = hnswlib.Index(space="l2", dim=self.dim)
+            capacity = max(2 * self.count, 1024)
+            try:
+                with open(self._path(INDEX_META_FILE), encoding="utf-8") as f:
+                    saved_rows = json.load(f)["rows"]
+                if saved_rows > self.count:
+                    raise ValueError("index is ahead of the rows")
+                index.load_index(self._path(INDEX_FILE), max_elements=capacity)
+                self.index_rows = self._saved_index_rows = saved_rows
+            except Exception:
+                print(f"Building the vector index for {self.directory} ({self.count} rows)...")
+                index.init_index(max_elements=capacity, ef_construction=200, M=16)
+                self.index_rows = self._saved_index_rows = 0
+            self.index = index
+
+        if self.index_rows < self.count:
+            if self.count > self.index.get_max_elements():
+                self.index.resize_index(2 * self.count)
+            self.index.add_items(np.asarray(self.matrix[self.index_rows:], dtype=np.float32),
+                                 np.arange(self.index_rows, self.count))
+            self.index_rows = self.count
+        # Save again once the rows added since the last save would take a while to re-index.
+        if self.index_rows - self._saved_index_rows >= max(1000, self._saved_index_rows // 10):
+            self.index.save_index(self._path(INDEX_FILE))
+            with open(self._path(INDEX_META_FILE), "w", encoding="utf-8") as f:
+                json.dump({"rows": self.index_rows}, f)
+            self._saved_index_rows = self.index_rows
+        return True
+
+    def ann_top_k(self, query: np.ndarray, k: int) -> np.ndarray:
+        self.index.set_ef(max(VECTOR_STORE_ANN_EF, 4 * k))
+        labels, _ = self.index.knn_query(query, k=min(k, self.count))
+        return labels[0]
+
+
+class NumpyVectorStore:
+    """
+    User memories as memory-mapped matrices, one directory per user.
+
+    The most recently used `max_open_users` users stay open (their mapped
+    rows, documents, squared norms and index); others are reopened from disk
+    on their next request.
+
+    Every read or write of a user happens under that user directory's lock,
+    which outlives the user's eviction for as long as anyone holds it, and
+    looks up the open UserVectors while holding it. So an evicted copy is
+    never written alongside a reopened one, and a reopen never reads a
+    half-written append.
+    """
+
+    name = "numpy"
+
+    def __init__(self, directory: str = VECTOR_STORE_DIR, dtype: str = VECTOR_STORE_DTYPE,
+                 ann_threshold: int = VECTOR_STORE_ANN_THRESHOLD, max_open_users: int = VECTOR_STORE_OPEN_USERS):
+        self.directory = directory
+        self.dtype = np.dtype(dtype).name
+        self.ann_threshold = ann_threshold
+        self.max_open_users = max_open_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._directory_locks = weakref.WeakValueDictionary()
+        self._hnswlib = None
+        self._warned_no_ann = False
+        self._stats = {"exact_queries": 0, "ann_queries": 0, "opens": 0}
+
+    def warm_up(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _directory_lock(self, user_id: str):
+        directory = os.path.join(self.directory, user_directory_name(user_id))
+        with self._lock:
+            lock = self._directory_locks.get(directory)
+            if lock is None:
+                lock = self._directory_locks[directory] = threading.Lock()
+            return directory, lock
+
+    def _user(self, user_id: str, directory: str, lock, dim: int = None) -> UserVectors:
+        """The user's open UserVectors, opened if needed. Call with the directory's `lock` held."""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                self._users.move_to_end(user_id)
+                return user
+        user = UserVectors(directory, self.dtype, dim, lock=lock)
+        with self._lock:
+            self._users[user_id] = user
+            self._stats["opens"] += 1
+            while len(self._users) > self.max_open_users:
+                self._users.popitem(last=False)
+        return user
+
+    def require(self, user_id: str):
+        """Raises LookupError if the user has no memories."""
+        directory, lock = self._directory_lock(user_id)
+        with lock:
+            count = self._user(user_id, directory, lock).count
+        if count == 0:
+            raise LookupError(f"No memories stored for user {user_id}")
+
+    def add(self, user_id: str, embeddings: list, documents: list, metadatas: list, ids: list):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        directory, lock = self._directory_lock(user_id)
+        with lock:
+            self._user(user_id, directory, lock, dim=embeddings.shape[1]).append(embeddings, ids, documents, metadatas)
+
+    def query(self, user_id: str, embedding: list, n_results: int) -> list:
+        """Returns the documents of the n_results nearest memories, nearest first."""
+        query = np.asarray(embedding, dtype=np.float32)
+        directory, lock = self._directory_lock(user_id)
+        with lock:
+            user = self._user(user_id, directory, lock)
+            if user.count == 0:
+                return []
+            if user.count >= self.ann_threshold and self._ann():
+                user.ensure_index(self._hnswlib)
+                rows = user.ann_top_k(query, n_results)
+                kind = "ann_queries"
+            else:
+                rows = user.exact_top_k(query, n_results)
+                kind = "exact_queries"
+            documents = [user.documents[row] for row in rows]
+        with self._lock:
+            self._stats[kind] += 1
+        return documents
+
+    def _ann(self) -> bool:
+        if self._hnswlib is None:
+            self._hnswlib = _hnswlib() or False
+            if not self._hnswlib and not self._warned_no_ann:
+                self._warned_no_ann = True
+                print("⚠ hnswlib is not installed; large users are searched exactly.")
+        return bool(self._hnswlib)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "open_users": len(self._users), "dtype": self.dtype,
+                    "ann_threshold": self.ann_threshold}
@@ -0,0 +1,195 @@
+"""
+ONNX Runtime backend for the sentence embedding model (EMBEDDING_BACKEND=onnx).
+
+Runs an exported copy of the SentenceTransformer model through onnxruntime
+with the `tokenizers` library, so the server needs neither torch nor
+sentence-transformers at runtime. Export the model once (this step does need
+torch, sentence-transformers and onnx):
+    python -m app.services.onnx_embedder all-MiniLM-L6-v2 models/all-MiniLM-L6-v2-onnx
+
+The export writes model.onnx, an int8 dynamically quantized model_int8.onnx,
+the tokenizer and the pooling settings, and checks that both models agree
+with the original on cosine similarity.
+"""
+
+import argparse
+import inspect
+import json
+import os
+
+import numpy as np
+
+CONFIG_FILE = "embedder_config.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+
+SAMPLE_TEXTS = [
+    "What's the weather in Lucknow?",
+    "Latest news on Nvidia",
+    "Compare TSLA and NVDA and tell me which moved more this quarter",
+    "thanks!",
+    "Remind me what I said about my trip to Delhi last week",
+]
+
+
+class OnnxEmbeddingModel:
+    """
+    Drop-in replacement for SentenceTransformer.encode over an exported model.
+
+    Texts are sorted by length and encoded in batches so padding stays short,
+    then mean- (or CLS-) pooled and normalized the way the original pipeline
+    does.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = True, threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), encoding="utf-8") as f:
+            self.config = json.load(f)
+        model_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE if quantized else MODEL_FILE)
+        if quantized and not os.path.exists(model_path):
+            print(f"⚠ No quantized model in {model_dir}; using the float32 one.")
+            model_path = os.path.join(model_dir, MODEL_FILE)
+        self.model_path = model_path
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=self.config["max_length"])
+        self._tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [i.name for i in self._session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        """Embeds a text (one vector) or a list of texts (one row each). Other SentenceTransformer options are ignored."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        output = np.empty((len(texts), self.config["dimension"]), dtype=np.float32)
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), max(batch_size, 1)):
+            rows = order[start:start + batch_size]
+            output[rows] = self._encode_batch([texts[i] for i in rows])
+        return output[0] if single else output
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        available = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self._session.run(None, {name: available[name] for name in self._input_names})[0]
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        if self.config["normalize"]:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled
+
+
+def _cosines(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def _pooling_mode(config: dict) -> str:
+    # sentence-transformers >= 6 has a "pooling_mode" entry; older versions one flag per mode.
+    modes = config.get("pooling_mode") or [
+        key[len("pooling_mode_"):] for key, enabled in config.items() if key.startswith("pooling_mode_") and enabled is True
+    ]
+    modes = [modes] if isinstance(modes, str) else list(modes)
+    names = {"mean": "mean", "mean_tokens": "mean", "cls": "cls", "cls_token": "cls"}
+    if len(modes) != 1 or modes[0] not in names:
+        raise ValueError(f"Unsupported pooling for ONNX export: {modes}")
+    return names[modes[0]]
+
+
+def export_model(model_name: str, output_dir: str, quantize: bool = True, opset: int = 14) -> dict:
+    """
+    Exports a SentenceTransformer model for OnnxEmbeddingModel and returns the
+    minimum cosine similarity of each exported model's vectors with the original's.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer, tokenizer = model[0].auto_model, model.tokenizer
+    modules = {type(m).__name__: m for m in model}
+    pooling = _pooling_mode(modules["Pooling"].get_config_dict())
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+    config = {
+        "model_id": model_name,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_length": model.max_seq_length,
+        "pooling": pooling,
+        "normalize": "Normalize" in modules,
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    sample = tokenizer(SAMPLE_TEXTS[:2], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, *inputs):
+            return self.inner(**dict(zip(input_names, inputs))).last_hidden_state
+
+    axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    # torch >= 2.9 defaults to the torch.export-based exporter; the TorchScript one handles dynamic axes here.
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates(transformer.eval()),
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=axes,
+            opset_version=opset,
+            **legacy,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(model_path, os.path.join(output_dir, QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+
+    reference = model.encode(SAMPLE_TEXTS)
+    agreement = {"float32": float(_cosines(reference, OnnxEmbeddingModel(output_dir, quantized=False).encode(SAMPLE_TEXTS)).min())}
+    if quantize:
+        agreement["int8"] = float(_cosines(reference, OnnxEmbeddingModel(output_dir, quantized=True).encode(SAMPLE_TEXTS)).min())
+    return agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a SentenceTransformer model to ONNX for EMBEDDING_BACKEND=onnx")
+    parser.add_argument("model", help="model name or path, e.g. all-MiniLM-L6-v2")
+    parser.add_argument("output_dir")
+    parser.add_argument("--no-quantize", action="store_true", help="skip the int8 model")
+    args = parser.parse_args()
+
+    agreement = export_model(args.model, args.output_dir, quantize=not args.no_quantize)
+    for name, cosine in agreement.items():
+        print(f"{name}: minimum cosine similarity with the original model {cosine:.5f}")
+
+
+if __name__ == "__main__":
+    main()
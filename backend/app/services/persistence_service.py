@@ -0,0 +1,134 @@
+import asyncio
+import datetime
+import os
+
+from app.core.concurrency import run_blocking, IO_EXECUTOR, EMBEDDING_EXECUTOR
+from app.services.firebase_service import save_messages_to_firestore
+from app.services.vector_db_service import add_texts_to_vector_db
+
+PERSISTENCE_QUEUE_SIZE = int(os.getenv("PERSISTENCE_QUEUE_SIZE", "1000"))
+PERSISTENCE_WORKERS = int(os.getenv("PERSISTENCE_WORKERS", "2"))
+PERSISTENCE_MAX_RETRIES = int(os.getenv("PERSISTENCE_MAX_RETRIES", "5"))
+PERSISTENCE_RETRY_BASE_SECONDS = float(os.getenv("PERSISTENCE_RETRY_BASE_SECONDS", "0.5"))
+PERSISTENCE_FLUSH_TIMEOUT_SECONDS = float(os.getenv("PERSISTENCE_FLUSH_TIMEOUT_SECONDS", "30"))
+
+
+class PersistenceQueue:
+    """
+    Write-behind persistence for chat turns.
+
+    Each turn (the user's message and the agent's answer) is queued and written
+    by background workers: one batched Firestore write and one batched Chroma
+    add. A stage that fails is retried with exponential backoff without
+    repeating the stage that already succeeded. The queue is bounded, so when
+    the stores fall behind, new turns wait for space instead of piling up.
+    """
+
+    def __init__(self, maxsize: int, workers: int, max_retries: int, retry_base_seconds: float):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self._queue = None
+        self._tasks = []
+        self._stats = {"enqueued": 0, "written": 0, "retries": 0, "dropped": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Starts the background workers. Must be called from the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"Persistence queue started with {self.workers} workers.")
+
+    async def stop(self, timeout: float = PERSISTENCE_FLUSH_TIMEOUT_SECONDS):
+        """Flushes queued turns (up to `timeout` seconds) and stops the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Persistence queue flush timed out; {self._queue.qsize()} turns were not written.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        print("Persistence queue stopped.")
+
+    async def enqueue_turn(self, user_id: str, session_id: str, user_text: str, agent_text: str,
+                           user_timestamp: datetime.datetime = None, user_embedding: list = None):
+        """Queues both messages of a chat turn for persistence; `user_embedding` saves re-encoding the user's message."""
+        turn = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "user_embedding": user_embedding,
+            "messages": [
+                {"sender": "user", "text": user_text, "timestamp": user_timestamp or datetime.datetime.utcnow()},
+                {"sender": "agent", "text": agent_text, "timestamp": datetime.datetime.utcnow()},
+            ],
+        }
+        self._stats["enqueued"] += 1
+        if not self.running:
+            # No background workers (scripts, tests): write on the caller's path.
+            await self._write_turn(turn)
+            return
+        await self._queue.put(turn)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "maxsize": self.maxsize,
+        }
+
+    async def _worker(self):
+        while True:
+            turn = await self._queue.get()
+            try:
+                await self._write_turn(turn)
+            except Exception as e:
+                print(f"Unexpected error persisting chat turn for user {turn['user_id']}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _write_turn(self, turn: dict):
+        user_id, session_id, messages = turn["user_id"], turn["session_id"], turn["messages"]
+        stages = {
+            "firestore": lambda: run_blocking(IO_EXECUTOR, save_messages_to_firestore, user_id, session_id, messages),
+            "vector_db": lambda: run_blocking(
+                EMBEDDING_EXECUTOR, add_texts_to_vector_db,
+                user_id,
+                [m["text"] for m in messages],
+                [{"sender": m["sender"], "session_id": session_id} for m in messages],
+                **({"embeddings": [turn["user_embedding"], None]} if turn.get("user_embedding") is not None else {}),
+            ),
+        }
+
+        for attempt in range(self.max_retries + 1):
+            names = list(stages)
+            results = await asyncio.gather(*(stages[name]() for name in names), return_exceptions=True)
+            for name, ok in zip(names, results):
+                if ok is True:
+                    del stages[name]
+            if not stages:
+                self._stats["written"] += 1
+                return
+            if attempt < self.max_retries:
+                self._stats["retries"] += 1
+                await asyncio.sleep(self.retry_base_seconds * (2 ** attempt))
+
+        self._stats["dropped"] += 1
+        print(f"Giving up on persisting chat turn for user {user_id} ({', '.join(stages)}) "
+              f"after {self.max_retries + 1} attempts.")
+
+
+persistence_queue = PersistenceQueue(
+    maxsize=PERSISTENCE_QUEUE_SIZE,
+    workers=PERSISTENCE_WORKERS,
+    max_retries=PERSISTENCE_MAX_RETRIES,
+    retry_base_seconds=PERSISTENCE_RETRY_BASE_SECONDS,
+)
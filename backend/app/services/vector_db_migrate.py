@@ -0,0 +1,137 @@
+"""
+Moves user memories between the Chroma storage layouts (VECTOR_DB_LAYOUT).
+
+    python -m app.services.vector_db_migrate --to sharded --shards 16
+    python -m app.services.vector_db_migrate --to per_user
+
+Records are copied page by page with their original ids, embeddings,
+documents and metadata, using upsert, so an interrupted run can simply be
+started again. Every page is checked in the destination before the next one
+is read. Sources are only deleted with --delete-source, once all their
+records have been verified. Moving to a different shard count (resharding)
+works the same way: the old shards are the sources.
+
+Run it with the server stopped (or restart the server afterwards), and set
+VECTOR_DB_LAYOUT / VECTOR_DB_SHARDS to match before starting it again.
+"""
+
+import argparse
+import re
+
+from app.services.vector_db_service import user_collection
+
+PER_USER_PREFIX = "user_"
+SHARD_PATTERN = re.compile(r"^memory_shard_(\d+)_of_(\d+)$")
+
+
+def _collection_names(client) -> list:
+    # chromadb < 0.6 returns Collection objects here, 0.6 names and 1.x Collection objects again.
+    return sorted(getattr(c, "name", c) for c in client.list_collections())
+
+
+def source_collections(client, layout: str, shards: int) -> list:
+    """Returns the names of the collections that don't belong to the target layout."""
+    sources = []
+    for name in _collection_names(client):
+        shard = SHARD_PATTERN.match(name)
+        if name.startswith(PER_USER_PREFIX) and layout != "per_user":
+            sources.append(name)
+        elif shard and (layout != "sharded" or int(shard.group(2)) != shards):
+            sources.append(name)
+    return sources
+
+
+def _owner(collection_name: str, metadata: dict):
+    if collection_name.startswith(PER_USER_PREFIX):
+        return collection_name[len(PER_USER_PREFIX):]
+    return (metadata or {}).get("user_id")
+
+
+def migrate_collection(client, name: str, layout: str, shards: int, page_size: int = 500,
+                       dry_run: bool = False) -> dict:
+    """
+    Copies one source collection into the target layout. Returns counts of the
+    records copied and of those skipped because their owner is unknown.
+    """
+    source = client.get_collection(name=name)
+    destinations = {}
+    copied = skipped = offset = 0
+    while True:
+        page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        ids = page["ids"]
+        if not ids:
+            break
+        offset += len(ids)
+
+        batches = {}
+        for i, record_id in enumerate(ids):
+            metadata = dict(page["metadatas"][i] or {})
+            user_id = _owner(name, metadata)
+            if not user_id:
+                skipped += 1
+                continue
+            target, where = user_collection(user_id, layout, shards)
+            if where is None:
+                metadata.pop("user_id", None)
+            else:
+                metadata.update(where)
+            batch = batches.setdefault(target, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+            batch["ids"].append(record_id)
+            batch["embeddings"].append(page["embeddings"][i])
+            batch["documents"].append(page["documents"][i])
+            batch["metadatas"].append(metadata or None)
+
+        for target, batch in batches.items():
+            copied += len(batch["ids"])
+            if dry_run:
+                continue
+            if target not in destinations:
+                destinations[target] = client.get_or_create_collection(name=target)
+            destinations[target].upsert(**batch)
+            found = destinations[target].get(ids=batch["ids"], include=[])["ids"]
+            if len(found) != len(batch["ids"]):
+                raise RuntimeError(f"{len(batch['ids']) - len(found)} records from {name} missing in {target} after the copy")
+    return {"copied": copied, "skipped": skipped}
+
+
+def migrate(client, layout: str, shards: int, page_size: int = 500, dry_run: bool = False,
+            delete_source: bool = False) -> dict:
+    """Migrates every collection outside the target layout; returns per-collection counts."""
+    if layout not in ("per_user", "sharded"):
+        raise ValueError(f"Unknown layout: {layout}")
+    report = {}
+    for name in source_collections(client, layout, shards):
+        counts = migrate_collection(client, name, layout, shards, page_size=page_size, dry_run=dry_run)
+        if delete_source and not dry_run:
+            if counts["skipped"]:
+                print(f"⚠ Keeping {name}: {counts['skipped']} records without a user_id were not copied.")
+            else:
+                client.delete_collection(name=name)
+                counts["deleted"] = True
+        report[name] = counts
+        print(f"{'Would copy' if dry_run else '✅ Copied'} {counts['copied']} records from {name}")
+    return report
+
+
+def main():
+    from app.services.vector_db_service import VECTOR_DB_SHARDS
+
+    parser = argparse.ArgumentParser(description="Move user memories between the Chroma storage layouts")
+    parser.add_argument("--to", required=True, choices=["per_user", "sharded"], help="target layout")
+    parser.add_argument("--shards", type=int, default=VECTOR_DB_SHARDS, help="shard count of the sharded layout")
+    parser.add_argument("--path", default="./chroma_db", help="Chroma persistence directory")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be copied")
+    parser.add_argument("--delete-source", action="store_true", help="delete each source collection once verified")
+    args = parser.parse_args()
+
+    import chromadb
+    client = chromadb.PersistentClient(path=args.path)
+    report = migrate(client, args.to, args.shards, page_size=args.page_size, dry_run=args.dry_run,
+                     delete_source=args.delete_source)
+    total = sum(counts["copied"] for counts in report.values())
+    print(f"{len(report)} source collections, {total} records{' (dry run)' if args.dry_run else ''}.")
+
+
+if __name__ == "__main__":
+    main()
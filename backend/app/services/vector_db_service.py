@@ -1,28 +1,276 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
+import hashlib
+import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from app.core import timing
+from app.services.embedding_cache import EmbeddingCache, normalize_text
+from app.services.embedding_service import EmbeddingBatcher
 
-# This creates a persistent client that saves data to disk in a 'chroma_db' directory.
-client = chromadb.PersistentClient(path="./chroma_db")
+EMBEDDING_MODEL_ID = 'all-MiniLM-L6-v2'
+# "sentence_transformers" runs the model through PyTorch; "onnx" runs an export
+# of it through onnxruntime (see onnx_embedder.py), without torch.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence_transformers").lower()
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", f"models/{EMBEDDING_MODEL_ID}-onnx")
+EMBEDDING_ONNX_QUANTIZED = os.getenv("EMBEDDING_ONNX_QUANTIZED", "true").lower() == "true"
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+# Extra hits fetched per search to make up for skipped copies of the query and duplicates.
+SEARCH_OVERFETCH = int(os.getenv("SEARCH_OVERFETCH", "3"))
+# "chroma" keeps memories in Chroma collections; "numpy" in memory-mapped
+# per-user matrices under VECTOR_STORE_DIR (see numpy_vector_store.py).
+VECTOR_DB_BACKEND = os.getenv("VECTOR_DB_BACKEND", "chroma").lower()
+# "per_user" keeps one collection per user (user_<id>); "sharded" keeps
+# VECTOR_DB_SHARDS collections shared by all users and filters them by a
+# user_id metadata field. Move existing data with vector_db_migrate.py.
+VECTOR_DB_LAYOUT = os.getenv("VECTOR_DB_LAYOUT", "per_user").lower()
+VECTOR_DB_SHARDS = int(os.getenv("VECTOR_DB_SHARDS", "16"))
+COLLECTION_CACHE_SIZE = int(os.getenv("COLLECTION_CACHE_SIZE", "4096"))
+# How long a user without a collection is remembered as such, so their searches skip the lookup.
+COLLECTION_MISSING_TTL_SECONDS = float(os.getenv("COLLECTION_MISSING_TTL_SECONDS", "30"))
 
-# This model runs locally on your machine to turn text into vectors.
-print("Loading embedding model...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-print("Embedding model loaded.")
+# Chroma and the embedding model take seconds to import and load, so both are
+# created on first use (or by the startup warm-up) instead of at import time.
+client = None
+embedding_model = None
+_client_lock = threading.Lock()
+_model_lock = threading.Lock()
+
+def get_client():
+    """
+    Returns the persistent Chroma client, which saves data to disk in a 'chroma_db' directory.
+    """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                import chromadb
+                client = chromadb.PersistentClient(path="./chroma_db")
+    return client
+
+def get_embedding_model():
+    """
+    Returns the embedding model, which runs locally on your machine to turn text into vectors.
+    """
+    global embedding_model
+    if embedding_model is None:
+        with _model_lock:
+            if embedding_model is None:
+                print("Loading embedding model...")
+                if EMBEDDING_BACKEND == "onnx":
+                    from app.services.onnx_embedder import OnnxEmbeddingModel
+                    embedding_model = OnnxEmbeddingModel(EMBEDDING_ONNX_PATH, quantized=EMBEDDING_ONNX_QUANTIZED,
+                                                         threads=EMBEDDING_ONNX_THREADS)
+                else:
+                    from sentence_transformers import SentenceTransformer
+                    embedding_model = SentenceTransformer(EMBEDDING_MODEL_ID)
+                print(f"Embedding model loaded ({EMBEDDING_BACKEND}).")
+    return embedding_model
+
+def shard_collection_name(shard: int, shards: int = None) -> str:
+    # The shard count is part of the name, so changing VECTOR_DB_SHARDS never
+    # looks users up in the wrong shard; the migration tool reshards.
+    shards = shards or VECTOR_DB_SHARDS
+    return f"memory_shard_{shard:03d}_of_{shards:03d}"
+
+def user_shard(user_id: str, shards: int = None) -> int:
+    digest = hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % (shards or VECTOR_DB_SHARDS)
+
+def user_collection(user_id: str, layout: str = None, shards: int = None) -> tuple:
+    """
+    Returns the collection holding a user's memories and the `where` filter that selects them.
+    """
+    if (layout or VECTOR_DB_LAYOUT) == "sharded":
+        return shard_collection_name(user_shard(user_id, shards), shards), {"user_id": user_id}
+    return f"user_{user_id}", None
+
+def _is_missing_collection(error: Exception) -> bool:
+    # chromadb raises NotFoundError (older versions InvalidCollectionException or
+    # ValueError) for a collection that doesn't exist or was deleted.
+    message = str(error).lower()
+    return (type(error).__name__ in ("NotFoundError", "InvalidCollectionException")
+            or "does not exist" in message or "not found" in message)
+
+class CollectionCache:
+    """
+    Open Chroma collection handles, so a request doesn't pay for the SQLite
+    metadata lookup behind get_collection / get_or_create_collection.
+
+    Up to `max_entries` handles are kept, least recently used first out.
+    Collections that don't exist are remembered for `missing_ttl` seconds,
+    which saves first-time users a failed lookup per search. Everything is
+    dropped when the client changes, and `run` reopens a handle once if the
+    collection was deleted behind it.
+    """
+
+    def __init__(self, get_client, max_entries: int = COLLECTION_CACHE_SIZE,
+                 missing_ttl: float = COLLECTION_MISSING_TTL_SECONDS):
+        self._get_client = get_client
+        self.max_entries = max_entries
+        self.missing_ttl = missing_ttl
+        self._lock = threading.Lock()
+        self._client = None
+        self._handles = OrderedDict()
+        self._missing = {}
+        self._stats = {"hits": 0, "opens": 0, "missing_hits": 0, "reopens": 0}
+
+    def get(self, name: str, create: bool = False):
+        client = self._get_client()
+        with self._lock:
+            if client is not self._client:
+                self._client = client
+                self._handles.clear()
+                self._missing.clear()
+            handle = self._handles.get(name)
+            if handle is not None:
+                self._handles.move_to_end(name)
+                self._stats["hits"] += 1
+                return handle
+            if not create and self._missing.get(name, 0) > time.monotonic():
+                self._stats["missing_hits"] += 1
+                raise LookupError(f"Collection {name} does not exist")
+
+        try:
+            handle = client.get_or_create_collection(name=name) if create else client.get_collection(name=name)
+        except Exception as e:
+            if not create and _is_missing_collection(e):
+                with self._lock:
+                    if client is self._client:
+                        self._missing[name] = time.monotonic() + self.missing_ttl
+            raise
+
+        with self._lock:
+            self._stats["opens"] += 1
+            if client is self._client:
+                self._missing.pop(name, None)
+                self._handles[name] = handle
+                while len(self._handles) > self.max_entries:
+                    self._handles.popitem(last=False)
+        return handle
+
+    def run(self, name: str, create: bool, operation):
+        """Calls `operation(collection)`, reopening the collection once if its cached handle went stale."""
+        handle = self.get(name, create=create)
+        try:
+            return operation(handle)
+        except Exception as e:
+            if not _is_missing_collection(e):
+                raise
+            self.invalidate(name)
+            with self._lock:
+                self._stats["reopens"] += 1
+            return operation(self.get(name, create=create))
+
+    def invalidate(self, name: str = None):
+        """Forgets one collection, or all of them (e.g. after deleting or migrating collections)."""
+        with self._lock:
+            if name is None:
+                self._handles.clear()
+                self._missing.clear()
+            else:
+                self._handles.pop(name, None)
+                self._missing.pop(name, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "open_handles": len(self._handles), "known_missing": len(self._missing),
+                    "layout": VECTOR_DB_LAYOUT, "shards": VECTOR_DB_SHARDS if VECTOR_DB_LAYOUT == "sharded" else None}
+
+collections = CollectionCache(lambda: get_client())
+
+def _tagged(user_id: str, metadatas: list, where: dict) -> list:
+    # Shared (sharded) collections need the owner on every record for the search filter.
+    if where is None:
+        return metadatas
+    return [{**(metadata or {}), **where} for metadata in metadatas]
+
+class ChromaMemoryStore:
+    """
+    User memories in Chroma: one collection per user, or records tagged with
+    their user_id in shared shards (VECTOR_DB_LAYOUT).
+    """
+
+    name = "chroma"
+
+    def warm_up(self):
+        get_client()
+
+    def require(self, user_id: str):
+        """Raises if the user has no memories yet."""
+        collections.get(user_collection(user_id)[0])
+
+    def add(self, user_id: str, embeddings: list, documents: list, metadatas: list, ids: list):
+        name, where = user_collection(user_id)
+        records = dict(embeddings=embeddings, documents=documents, metadatas=_tagged(user_id, metadatas, where), ids=ids)
+        collections.run(name, True, lambda collection: collection.add(**records))
+
+    def query(self, user_id: str, embedding: list, n_results: int) -> list:
+        """Returns the documents of the n_results nearest memories, nearest first."""
+        name, where = user_collection(user_id)
+        query = dict(query_embeddings=[embedding], n_results=n_results)
+        if where is not None:
+            query["where"] = where
+        results = collections.run(name, False, lambda collection: collection.query(**query))
+        return results.get('documents', [[]])[0]
+
+    def stats(self) -> dict:
+        return collections.stats()
+
+memory_store = None
+_store_lock = threading.Lock()
+
+def get_memory_store():
+    """
+    Returns the store behind add_text(s)_to_vector_db and search_user_memory, picked by VECTOR_DB_BACKEND.
+    """
+    global memory_store
+    if memory_store is None:
+        with _store_lock:
+            if memory_store is None:
+                if VECTOR_DB_BACKEND == "numpy":
+                    from app.services.numpy_vector_store import NumpyVectorStore
+                    memory_store = NumpyVectorStore()
+                else:
+                    memory_store = ChromaMemoryStore()
+    return memory_store
+
+# Concurrent encode calls from all requests are micro-batched into one model
+# call, and texts seen before are answered from the embedding cache.
+# The ONNX vectors are close to, not identical with, PyTorch's, so each backend
+# has its own cache entries.
+def _embedding_cache_id() -> str:
+    if EMBEDDING_BACKEND == "onnx":
+        return f"{EMBEDDING_MODEL_ID}+onnx{'-int8' if EMBEDDING_ONNX_QUANTIZED else ''}"
+    return EMBEDDING_MODEL_ID
+
+embedding_cache = EmbeddingCache(_embedding_cache_id())
+embedder = EmbeddingBatcher(get_embedding_model, cache=embedding_cache)
+
+def _as_list(vector) -> list:
+    return vector.tolist() if hasattr(vector, "tolist") else list(vector)
+
+def embed_text(text: str) -> list:
+    """
+    Returns the normalized embedding of a single text (the same vectors stored in the collections).
+    """
+    with timing.span("embed"):
+        return embedder.encode(text, normalize=True).tolist()
 
 def add_text_to_vector_db(user_id: str, text: str, metadata: dict):
     """
-    Creates an embedding for a piece of text and stores it in a user-specific collection.
+    Creates an embedding for a piece of text and stores it in the user's collection.
     """
     try:
         # --- THIS IS THE FIX ---
-        # Get or create a collection named specifically for the user (e.g., "user_RYXUt8...")
-        # This ensures each user has their own private memory.
-        collection = client.get_or_create_collection(name=f"user_{user_id}")
+        # Each user has their own private memory: their own collection (e.g. "user_RYXUt8..."),
+        # their records in a shared shard, or their own directory in the NumPy store.
+        store = get_memory_store()
         
-        embedding = embedding_model.encode(text).tolist()
+        embedding = embedder.encode(text).tolist()
         
-        collection.add(
+        store.add(
+            user_id,
             embeddings=[embedding],
             documents=[text],
             metadatas=[metadata],
@@ -34,25 +282,70 @@ def add_text_to_vector_db(user_id: str, text: str, metadata: dict):
         print(f"Error adding text to vector DB for user {user_id}: {e}")
 
 
-def search_user_memory(user_id: str, query_text: str, n_results: int = 3) -> list:
+def add_texts_to_vector_db(user_id: str, texts: list, metadatas: list, embeddings: list = None) -> bool:
+    """
+    Embeds several texts in one batched encode and stores them with a single add to the memory store.
+    `embeddings` may supply vectors already computed for some texts (None for the others).
+    """
+    try:
+        store = get_memory_store()
+
+        known = embeddings or [None] * len(texts)
+        missing = [i for i, vector in enumerate(known) if vector is None]
+        embeddings = [_as_list(vector) if vector is not None else None for vector in known]
+        if missing:
+            with timing.span("embed"):
+                for i, vector in zip(missing, embedder.encode([texts[i] for i in missing]).tolist()):
+                    embeddings[i] = vector
+
+        with timing.span(f"{store.name}_add"):
+            store.add(
+                user_id,
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=metadatas,
+                ids=[str(uuid.uuid4()) for _ in texts]
+            )
+        print(f"Successfully added {len(texts)} texts to vector DB for user {user_id}")
+        return True
+
+    except Exception as e:
+        print(f"Error adding texts to vector DB for user {user_id}: {e}")
+        return False
+
+
+def search_user_memory(user_id: str, query_text: str, n_results: int = 3, query_embedding: list = None) -> list:
     """
     Searches a user's memory for the most relevant past conversations.
+
+    Stored copies of the query itself (e.g. the current message, or the same
+    question asked before) and duplicate memories are skipped, so they don't
+    take up result slots. `query_embedding` reuses a vector already computed
+    for the query.
     """
     try:
         # --- THIS IS THE FIX ---
-        # We now get the specific collection for the user, ensuring we only search their memories.
-        collection = client.get_collection(name=f"user_{user_id}")
+        # We only search the user's own memories.
+        store = get_memory_store()
+        store.require(user_id)  # raises before encoding if the user has no memories yet
         
-        query_embedding = embedding_model.encode(query_text).tolist()
+        if query_embedding is None:
+            with timing.span("embed"):
+                query_embedding = embedder.encode(query_text).tolist()
         
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
+        with timing.span(f"{store.name}_query"):
+            documents = store.query(user_id, _as_list(query_embedding), n_results + SEARCH_OVERFETCH)
         
-        return results.get('documents', [[]])[0]
+        seen = {normalize_text(query_text)}
+        memories = []
+        for document in documents:
+            key = normalize_text(document)
+            if key not in seen:
+                seen.add(key)
+                memories.append(document)
+        return memories[:n_results]
 
     except Exception as e:
         # This is expected if the user has no history yet.
-        print(f"Could not search memory for user {user_id} (collection might not exist yet): {e}")
+        print(f"Could not search memory for user {user_id} (no memories stored yet?): {e}")
         return []
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+ReAct vs. tool-calling agent benchmark on multi-tool prompts.
+
+Runs the same prompts through run_agent in both AGENT_MODEs and reports LLM
+round trips, tool calls and wall-clock time. The LLM is a scripted fake with a
+fixed latency per round trip, and the tools sleep for a fixed time, so the
+benchmark runs offline and only measures how the agent schedules work:
+    python benchmarks/bench_agent_modes.py --llm-seconds 0.8 --tool-seconds 1.0
+
+ReAct issues one tool call per round trip (and stops at max_iterations); the
+tool-calling agent asks for all independent calls in one step and runs them
+concurrently.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import tool
+
+from app.core import agent as agent_module
+from app.core import timing
+from app.core.tools.wrappers import coalesce_tool
+
+# Prompt -> the (tool, argument) calls it needs.
+PROMPTS = {
+    "Price of TSLA, NVDA and AAPL": [
+        ("get_daily_stock_prices", "TSLA"),
+        ("get_daily_stock_prices", "NVDA"),
+        ("get_daily_stock_prices", "AAPL"),
+    ],
+    "Compare TSLA, NVDA and AAPL and show me the news on each": [
+        ("get_daily_stock_prices", "TSLA"),
+        ("get_daily_stock_prices", "NVDA"),
+        ("get_daily_stock_prices", "AAPL"),
+        ("news_tool", "Tesla"),
+        ("news_tool", "Nvidia"),
+        ("news_tool", "Apple"),
+    ],
+    "Weather in Lucknow and Delhi": [
+        ("weather_tool", "Lucknow"),
+        ("weather_tool", "Delhi"),
+    ],
+}
+ARG_NAMES = {"get_daily_stock_prices": "ticker_symbol", "news_tool": "query", "weather_tool": "city"}
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Replies from a script, taking `latency` seconds per round trip."""
+
+    script: list
+    latency: float
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next(self):
+        message = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self._next()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._next()
+
+
+def react_script(calls):
+    steps = [
+        AIMessage(content=f"Thought: Do I need to use a tool? Yes\nAction: {name}\nAction Input: {arg}")
+        for name, arg in calls
+    ]
+    return steps + [AIMessage(content="Thought: Do I need to use a tool? No\nFinal Answer: Done.")]
+
+
+def tool_calling_script(calls):
+    tool_calls = [
+        {"name": name, "args": {ARG_NAMES[name]: arg}, "id": f"call_{i}", "type": "tool_call"}
+        for i, (name, arg) in enumerate(calls)
+    ]
+    return [AIMessage(content="", tool_calls=tool_calls), AIMessage(content="Done.")]
+
+
+def make_tools(tool_seconds: float):
+    @tool
+    def get_daily_stock_prices(ticker_symbol: str) -> str:
+        """Daily closing prices for one ticker."""
+        time.sleep(tool_seconds)
+        return f"{ticker_symbol}: 100.0"
+
+    @tool
+    def news_tool(query: str) -> str:
+        """Latest news on a topic."""
+        time.sleep(tool_seconds)
+        return f"Headlines about {query}"
+
+    @tool
+    def weather_tool(city: str) -> str:
+        """Current weather for a city."""
+        time.sleep(tool_seconds)
+        return f"{city}: 30C"
+
+    return [coalesce_tool(t) for t in (get_daily_stock_prices, news_tool, weather_tool)]
+
+
+async def run_once(mode: str, prompt: str, calls, llm_seconds: float, tools):
+    script = react_script(calls) if mode == "react" else tool_calling_script(calls)
+    llm = ScriptedChatModel(script=script, latency=llm_seconds)
+    agent = agent_module.create_agent(llm, tools, mode=mode)
+
+    with patch.object(agent_module, "llm", llm), \
+         patch.object(agent_module, "agent", agent), \
+         patch.object(agent_module, "tools", tools), \
+         patch.object(agent_module, "AGENT_MODE", mode), \
+         patch.object(agent_module, "ROUTER_ENABLED", False), \
+         patch.object(agent_module, "get_recent_session_messages", return_value=[]), \
+         patch("app.core.context.search_user_memory", return_value=[]):
+        timer, token = timing.start_request("BENCH", mode)
+        try:
+            start = time.perf_counter()
+            result = await agent_module.run_agent(prompt, f"bench-{mode}", "bench-user")
+            elapsed = time.perf_counter() - start
+        finally:
+            timing.end_request(token)
+
+    completed = not result["output"].startswith("Agent stopped due to")
+    return {
+        "round_trips": timer.counters.get("llm_round_trips", 0),
+        "tool_calls": timer.counters.get("tool_calls", 0),
+        "seconds": elapsed,
+        "completed": completed,
+    }
+
+
+async def main_async(args):
+    tools = make_tools(args.tool_seconds)
+    rows = []
+    for prompt, calls in PROMPTS.items():
+        for mode in ("react", "tool_calling"):
+            rows.append((prompt, mode, await run_once(mode, prompt, calls, args.llm_seconds, tools)))
+
+    # The agent is verbose, so the table is printed once everything has run.
+    print(f"\nLLM {args.llm_seconds}s/round trip, tools {args.tool_seconds}s/call\n")
+    print(f"{'prompt':<58} {'mode':<13} {'LLM trips':>9} {'tools':>6} {'seconds':>8}  completed")
+    for prompt, mode, stats in rows:
+        print(f"{prompt[:57]:<58} {mode:<13} {stats['round_trips']:>9} {stats['tool_calls']:>6} "
+              f"{stats['seconds']:>8.2f}  {stats['completed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-seconds", type=float, default=0.8, help="simulated latency per LLM round trip")
+    parser.add_argument("--tool-seconds", type=float, default=1.0, help="simulated latency per tool call")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
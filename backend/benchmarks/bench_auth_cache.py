@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Auth overhead microbenchmark for get_current_user.
+
+Signs Firebase-style RS256 ID tokens with a local key and verifies them with
+the real firebase_admin verification path (signature, issuer, audience and
+expiry checks). Google's certificate endpoint is replaced with an in-memory
+transport serving the matching certificate, so the benchmark runs offline:
+    python benchmarks/bench_auth_cache.py --requests 2000 --tokens 10
+
+Reports the per-request cost with the verified-token cache off and on.
+"""
+
+import argparse
+import datetime
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import firebase_admin
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from firebase_admin import auth, credentials
+from google.auth.credentials import AnonymousCredentials
+
+from app.api.v1.chat import get_current_user
+from app.services import firebase_service
+
+PROJECT_ID = "omnileap-bench"
+KEY_ID = "bench-key"
+
+
+class _BenchCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+class _CertResponse:
+    def __init__(self, body: bytes):
+        self.status = 200
+        self.headers = {"content-type": "application/json"}
+        self.data = body
+
+
+class _CertTransport:
+    """Stands in for the verifier's HTTP session; serves the local signing cert."""
+
+    def __init__(self, cert_pem: str):
+        self._body = json.dumps({KEY_ID: cert_pem}).encode("utf-8")
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        return _CertResponse(self._body)
+
+
+def make_signing_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.bench")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    return key_pem, cert.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+
+
+def make_id_token(key_pem: bytes, uid: str) -> str:
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "auth_time": now,
+        "user_id": uid,
+        "sub": uid,
+        "iat": now,
+        "exp": now + 3600,
+    }
+    return jwt.encode(claims, key_pem, algorithm="RS256", headers={"kid": KEY_ID})
+
+
+def install_verifier(cert_pem: str):
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(_BenchCredential(), {"projectId": PROJECT_ID})
+    auth._get_client(None)._token_verifier.request = _CertTransport(cert_pem)
+
+
+def measure(tokens, requests: int, cached: bool):
+    firebase_service.AUTH_TOKEN_CACHE_ENABLED = cached
+    firebase_service.token_cache.clear()
+    samples = []
+    for i in range(requests):
+        token = tokens[i % len(tokens)]
+        start = time.perf_counter()
+        user = get_current_user(token)
+        samples.append((time.perf_counter() - start) * 1e6)
+        assert user["uid"]
+    return samples
+
+
+def report(label: str, samples):
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<10} mean={statistics.mean(samples):9.1f}us  p50={statistics.median(samples):9.1f}us  p99={p99:9.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="authenticated requests per run")
+    parser.add_argument("--tokens", type=int, default=10, help="distinct users/tokens in rotation")
+    args = parser.parse_args()
+
+    key_pem, cert_pem = make_signing_key()
+    install_verifier(cert_pem)
+    tokens = [make_id_token(key_pem, f"user-{i}") for i in range(args.tokens)]
+
+    print(f"{args.requests} requests over {args.tokens} tokens")
+    uncached = measure(tokens, args.requests, cached=False)
+    cached = measure(tokens, args.requests, cached=True)
+    report("no cache", uncached)
+    report("cache", cached)
+    print(f"speedup    {statistics.mean(uncached) / statistics.mean(cached):.1f}x (mean)")
+    print(f"cache stats {firebase_service.token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
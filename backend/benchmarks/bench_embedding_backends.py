@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Encode latency, throughput and resident memory of the embedding backends.
+
+Compares the current SentenceTransformer (PyTorch) backend with the ONNX
+Runtime one, float32 and int8, on the same texts. Export the ONNX models
+first (see app/services/onnx_embedder.py), then:
+    python benchmarks/bench_embedding_backends.py --onnx-dir models/all-MiniLM-L6-v2-onnx
+
+Each backend runs in its own process, so the resident memory it reports
+(after loading and encoding) includes only that backend's libraries. The
+agreement column is the minimum cosine similarity with the PyTorch vectors:
+existing collections stay usable when it is close to 1.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+TEXTS = [
+    "What's the weather in Lucknow?",
+    "Latest news on Nvidia",
+    "What was TSLA's closing price yesterday?",
+    "Compare TSLA and NVDA and tell me which moved more this quarter",
+    "Who founded Nvidia?",
+    "thanks!",
+    "Summarize what we talked about so far.",
+    "Remind me what I said about my trip to Delhi last week, and whether I booked the hotel",
+]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker(args):
+    """Loads one backend, encodes and prints its measurements as JSON."""
+    start = time.perf_counter()
+    if args.worker == "sentence_transformers":
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model, device="cpu")
+    else:
+        from app.services.onnx_embedder import OnnxEmbeddingModel
+        model = OnnxEmbeddingModel(args.onnx_dir, quantized=args.worker == "onnx-int8", threads=args.threads)
+    load_s = time.perf_counter() - start
+
+    model.encode(TEXTS)  # warm up
+    latencies = []
+    for i in range(args.single):
+        text = TEXTS[i % len(TEXTS)]
+        start = time.perf_counter()
+        model.encode([text])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    batch = [f"{TEXTS[i % len(TEXTS)]} #{i}" for i in range(args.batch)]
+    start = time.perf_counter()
+    for _ in range(args.batch_rounds):
+        model.encode(batch, batch_size=args.batch)
+    throughput = args.batch * args.batch_rounds / (time.perf_counter() - start)
+
+    print(json.dumps({
+        "load_s": load_s,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": sorted(latencies)[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+        "texts_per_s": throughput,
+        "rss_mb": rss_mb(),
+        "vectors": [list(map(float, v)) for v in model.encode(TEXTS)],
+    }))
+
+
+def cosine_floor(a: list, b: list) -> float:
+    import numpy as np
+    a, b = np.asarray(a), np.asarray(b)
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float((a * b).sum(axis=1).min())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--onnx-dir", default="models/all-MiniLM-L6-v2-onnx")
+    parser.add_argument("--backends", nargs="+", default=["sentence_transformers", "onnx", "onnx-int8"])
+    parser.add_argument("--single", type=int, default=200, help="single-text encodes for the latency percentiles")
+    parser.add_argument("--batch", type=int, default=64, help="texts per batched encode")
+    parser.add_argument("--batch-rounds", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime intra-op threads (0 = its default)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    results = {}
+    for backend in args.backends:
+        command = [sys.executable, __file__, "--worker", backend, "--model", args.model, "--onnx-dir", args.onnx_dir,
+                   "--single", str(args.single), "--batch", str(args.batch), "--batch-rounds", str(args.batch_rounds),
+                   "--threads", str(args.threads)]
+        completed = subprocess.run(command, capture_output=True, text=True, env={**os.environ, "TOKENIZERS_PARALLELISM": "false"})
+        if completed.returncode != 0:
+            print(f"❌ {backend} failed:\n{completed.stderr.strip().splitlines()[-1] if completed.stderr else ''}")
+            continue
+        results[backend] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    reference = results.get("sentence_transformers")
+    print(f"\n{'backend':<22} {'load s':>7} {'p50 ms':>8} {'p99 ms':>8} {'texts/s':>9} {'RSS MB':>8} {'agreement':>10}")
+    for backend, r in results.items():
+        agreement = f"{cosine_floor(reference['vectors'], r['vectors']):.5f}" if reference else "n/a"
+        print(f"{backend:<22} {r['load_s']:>7.2f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+              f"{r['texts_per_s']:>9.1f} {r['rss_mb']:>8.0f} {agreement:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Embedding throughput and latency with and without cross-request micro-batching.
+
+At each concurrency level, that many threads each encode --requests short
+texts one at a time, the way concurrent chat turns call the embedder. The
+unbatched run calls model.encode per text (the previous behaviour); the
+batched run goes through EmbeddingBatcher. Reports texts/s and per-call
+p50/p99 latency:
+    python benchmarks/bench_embedding_batching.py --concurrency 1 8 32 128
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.embedding_service import EmbeddingBatcher
+
+TEXTS = [
+    "What's the weather in Lucknow?",
+    "Latest news on Nvidia",
+    "What was TSLA's closing price yesterday?",
+    "Compare TSLA and NVDA and tell me which moved more this quarter",
+    "Who founded Nvidia?",
+    "thanks!",
+    "Summarize what we talked about so far.",
+    "Remind me what I said about my trip to Delhi last week",
+]
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(encode, concurrency: int, requests: int) -> dict:
+    def caller(index: int) -> list:
+        latencies = []
+        for i in range(requests):
+            text = f"{TEXTS[(index + i) % len(TEXTS)]} #{index}-{i}"
+            start = time.perf_counter()
+            encode(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = [ms for result in pool.map(caller, range(concurrency)) for ms in result]
+    elapsed = time.perf_counter() - start
+    return {
+        "texts_per_s": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=20, help="encodes per caller")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(args.model)
+    model.encode(TEXTS)  # warm up
+
+    batcher = EmbeddingBatcher(lambda: model, max_batch_size=args.max_batch, max_wait_ms=args.max_wait_ms)
+    print(f"{args.model}: {args.requests} encodes per caller, batches of up to {args.max_batch}, "
+          f"max wait {args.max_wait_ms:g} ms\n")
+    print(f"{'callers':>7} {'mode':>9} {'texts/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for mode, encode in (("unbatched", model.encode), ("batched", batcher.encode)):
+            result = run(encode, concurrency, args.requests)
+            print(f"{concurrency:>7} {mode:>9} {result['texts_per_s']:>9.1f} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+    stats = batcher.stats()
+    print(f"\nbatcher: {stats['batches']} batches, average {stats['avg_batch']} texts, largest {stats['largest_batch']}")
+
+
+if __name__ == "__main__":
+    main()
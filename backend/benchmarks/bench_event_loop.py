@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Event-loop responsiveness benchmark for the chat pipeline.
+
+Fires N slow chat requests at the app and, while they are in flight, measures
+the latency of cheap endpoints (the root health check and /history). With the
+async pipeline the p50/p99 of the cheap endpoints should stay flat as N grows.
+
+The LLM, Firestore and Chroma calls are replaced with sleeps of realistic
+duration so the benchmark runs offline:
+    python benchmarks/bench_event_loop.py --chats 1 8 32 --llm-seconds 2
+
+Pass --blocking to simulate the previous behaviour, where the agent run and the
+persistence writes blocked the event loop.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+
+from main import app
+from app.api.v1 import chat
+from app.core.limiter import limiter
+from app.services import persistence_service
+from app.services.persistence_service import persistence_queue
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def install_fakes(llm_seconds: float, write_seconds: float, blocking: bool):
+    """Swaps the slow external calls for sleeps of comparable duration."""
+
+    async def fake_run_agent(user_input, session_id, user_id):
+        if blocking:
+            time.sleep(llm_seconds)
+        else:
+            await asyncio.sleep(llm_seconds)
+        return {"output": f"echo: {user_input}"}
+
+    def fake_write(*args, **kwargs):
+        time.sleep(write_seconds)
+        return True
+
+    def fake_history(user_id):
+        time.sleep(0.005)
+        return []
+
+    chat.run_agent = fake_run_agent
+    persistence_service.add_texts_to_vector_db = fake_write
+    persistence_service.save_messages_to_firestore = fake_write
+    chat.get_conversations_from_firestore = fake_history
+
+    if blocking:
+        async def inline(executor, func, *args, **kwargs):
+            return func(*args, **kwargs)
+        chat.run_blocking = inline
+        persistence_service.run_blocking = inline
+
+    app.dependency_overrides[chat.get_current_user] = lambda: {"uid": "bench-user"}
+    limiter.enabled = False
+
+
+async def probe(client: httpx.AsyncClient, path: str, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(path)
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def run_round(n_chats: int, probe_seconds: float, blocking: bool):
+    if not blocking:
+        persistence_queue.start()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        samples = {"/": [], "/api/v1/chat/history": []}
+        stop = asyncio.Event()
+        probes = [asyncio.create_task(probe(client, path, samples[path], stop)) for path in samples]
+
+        chats = [
+            asyncio.create_task(client.post("/api/v1/chat", json={"user_input": f"q{i}", "session_id": f"s{i}"}))
+            for i in range(n_chats)
+        ]
+        await asyncio.sleep(probe_seconds)
+        stop.set()
+        await asyncio.gather(*probes)
+        await asyncio.gather(*chats)
+    await persistence_queue.stop()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, nargs="+", default=[0, 1, 8, 32])
+    parser.add_argument("--llm-seconds", type=float, default=2.0)
+    parser.add_argument("--write-seconds", type=float, default=0.1)
+    parser.add_argument("--probe-seconds", type=float, default=1.5)
+    parser.add_argument("--blocking", action="store_true", help="simulate the old synchronous pipeline")
+    args = parser.parse_args()
+
+    install_fakes(args.llm_seconds, args.write_seconds, args.blocking)
+    mode = "blocking" if args.blocking else "async"
+
+    print(f"Mode: {mode}  (llm={args.llm_seconds}s, writes={args.write_seconds}s)")
+    print(f"{'in-flight chats':>16} {'endpoint':<24} {'n':>5} {'p50 ms':>9} {'p99 ms':>9}")
+    for n_chats in args.chats:
+        samples = asyncio.run(run_round(n_chats, args.probe_seconds, args.blocking))
+        for path, values in samples.items():
+            if not values:
+                print(f"{n_chats:>16} {path:<24} {0:>5} {'-':>9} {'-':>9}")
+                continue
+            print(
+                f"{n_chats:>16} {path:<24} {len(values):>5} "
+                f"{statistics.median(values):>9.1f} {percentile(values, 99):>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
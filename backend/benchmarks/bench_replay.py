@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the chat pipeline's own overhead, from a cassette.
+
+First record the LLM and tool calls of a few chat turns against the live
+services (needs GROQ_API_KEY and the tool API keys):
+    python benchmarks/bench_replay.py record --cassette cassettes/bench.jsonl
+
+Then replay them as often as needed, with no network access:
+    python benchmarks/bench_replay.py replay --cassette cassettes/bench.jsonl --rounds 5
+
+Each turn goes through POST /api/v1/chat in-process: the answer cache, the
+intent router, the agent, RAG over Chroma and the turn's persistence
+(written inline; Firestore writes are skipped). Replayed calls answer
+instantly by default, so the wall time per turn is the orchestration
+overhead; --latency 1 reproduces the recorded LLM and tool latencies instead.
+Each round uses a new user so its prompts, history and memories match the
+recording. --max-overhead-ms makes the run fail when the median turn is
+slower, for catching regressions in CI.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+from unittest.mock import patch
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Turns of one conversation, in order; later ones lean on the earlier ones.
+PROMPTS = [
+    "What's the weather in Lucknow?",
+    "Latest news on Nvidia",
+    "What was TSLA's closing price?",
+    "Compare TSLA and NVDA and tell me which moved more",
+    "Who founded Nvidia? Check Wikipedia.",
+    "Summarize what we talked about so far.",
+]
+
+
+def parse_server_timing(header: str) -> dict:
+    """{"agent": 812.4, "total": 830.1, ...} from a Server-Timing header."""
+    durations = {}
+    for metric in header.split(","):
+        parts = [p.strip() for p in metric.split(";")]
+        for part in parts[1:]:
+            if part.startswith("dur="):
+                durations[parts[0]] = float(part[4:])
+    return durations
+
+
+async def run_round(client, user_id: str, prompts: list, cassette) -> list:
+    session_id = f"{user_id}-session"
+    rows = []
+    for prompt in prompts:
+        upstream_before = cassette.stats()["call_latency_ms"]
+        start = time.perf_counter()
+        response = await client.post("/api/v1/chat", json={"user_input": prompt, "session_id": session_id},
+                                     headers={"X-Bench-User": user_id})
+        wall_ms = (time.perf_counter() - start) * 1000
+        rows.append({
+            "prompt": prompt,
+            "status": response.status_code,
+            "wall_ms": wall_ms,
+            "upstream_ms": cassette.stats()["call_latency_ms"] - upstream_before,
+            "spans": parse_server_timing(response.headers.get("server-timing", "")),
+        })
+    return rows
+
+
+async def main_async(args):
+    import httpx
+    from fastapi import Request
+
+    from main import app
+    from app.api.v1.chat import get_current_user
+    from app.core.cassette import cassette
+    from app.core.limiter import limiter
+
+    def bench_user(request: Request) -> dict:
+        return {"uid": request.headers["X-Bench-User"]}
+
+    app.dependency_overrides[get_current_user] = bench_user
+    limiter.enabled = False
+
+    prompts = PROMPTS
+    if args.prompts:
+        prompts = [line.strip() for line in Path(args.prompts).read_text(encoding="utf-8").splitlines() if line.strip()]
+
+    rounds = 1 if args.mode == "record" else args.rounds
+    # Recorded calls take their real time; replayed ones their recorded time times --latency.
+    latency = 1.0 if args.mode == "record" else args.latency
+    run_id = uuid.uuid4().hex[:8]
+    transport = httpx.ASGITransport(app=app)
+    results = []
+    with patch("app.services.persistence_service.save_messages_to_firestore", return_value=True), \
+         patch("app.core.agent.get_recent_session_messages", return_value=[]):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            for round_index in range(rounds):
+                results.append(await run_round(client, f"bench-{run_id}-{round_index}", prompts, cassette))
+            if args.crew:
+                from app.core.crews.blog_crew import create_blog_post_crew
+                start = time.perf_counter()
+                await asyncio.to_thread(create_blog_post_crew, args.crew)
+                crew_ms = (time.perf_counter() - start) * 1000
+            else:
+                crew_ms = None
+
+    # The agent is verbose, so the tables are printed once everything has run.
+    stats = cassette.stats()
+    print(f"\n{args.mode} {args.cassette}: {rounds} round(s) of {len(prompts)} turns, "
+          f"upstream latency x{latency:g}\n")
+    print(f"{'turn':<52} {'status':>6} {'median ms':>10} {'upstream ms':>12} {'overhead ms':>12}")
+    overheads = []
+    for index, prompt in enumerate(prompts):
+        turns = [round_rows[index] for round_rows in results]
+        wall = statistics.median(t["wall_ms"] for t in turns)
+        upstream = statistics.median(t["upstream_ms"] for t in turns) * latency
+        # Concurrent tool calls overlap, so this undercounts the overhead of those turns.
+        overhead = max(0.0, wall - upstream)
+        overheads.append(overhead)
+        statuses = sorted({t["status"] for t in turns})
+        print(f"{prompt[:51]:<52} {'/'.join(map(str, statuses)):>6} {wall:>10.1f} {upstream:>12.1f} "
+              f"{overhead:>12.1f}")
+
+    span_names = sorted({name for round_rows in results for t in round_rows for name in t["spans"]})
+    if span_names:
+        print("\nServer-Timing spans (median ms per turn, over all turns):")
+        for name in span_names:
+            values = [t["spans"].get(name, 0.0) for round_rows in results for t in round_rows]
+            print(f"  {name:<28} {statistics.median(values):>10.1f}")
+    if crew_ms is not None:
+        print(f"\nblog crew '{args.crew}': {crew_ms:.1f} ms")
+    print(f"\ncassette: {stats['interactions']} interactions, {stats['recorded']} recorded, "
+          f"{stats['exact']} exact, {stats['repeated']} repeated, {stats['by_order']} by order, {stats['misses']} misses")
+
+    if stats["misses"]:
+        print("⚠ Some calls had no recording; re-record the cassette after changing prompts or tools.")
+    if args.max_overhead_ms and statistics.median(overheads) > args.max_overhead_ms:
+        print(f"❌ Median overhead {statistics.median(overheads):.1f} ms is above {args.max_overhead_ms:g} ms")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--cassette", default="cassettes/bench.jsonl", help="cassette file to write or read")
+    parser.add_argument("--rounds", type=int, default=3, help="replay rounds over the prompts")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="multiplier on recorded latencies during replay (0 = instant, 1 = as recorded)")
+    parser.add_argument("--strict", action="store_true", help="fail calls whose request wasn't recorded verbatim")
+    parser.add_argument("--prompts", help="file with one prompt per line instead of the built-in turns")
+    parser.add_argument("--crew", metavar="TOPIC", help="also run the blog crew on TOPIC")
+    parser.add_argument("--max-overhead-ms", type=float, default=0.0,
+                        help="exit with status 1 if the median per-turn overhead is above this")
+    args = parser.parse_args()
+
+    # Recording appends to the cassette, so start a new recording from an empty file.
+    if args.mode == "record" and os.path.exists(args.cassette):
+        os.remove(args.cassette)
+    # The cassette is configured from the environment when the app is imported.
+    os.environ["CASSETTE_MODE"] = args.mode
+    os.environ["CASSETTE_PATH"] = args.cassette
+    os.environ["CASSETTE_REPLAY_LATENCY"] = str(args.latency)
+    os.environ["CASSETTE_STRICT"] = "true" if args.strict else "false"
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Memory search latency of the Chroma and memory-mapped NumPy stores.
+
+For each user size (memories per user), fills one user in each store with
+normalized vectors clustered around random topics (closer to conversation
+embeddings than uniformly random vectors), then times --queries searches the
+way search_user_memory runs them (require + top-k query), after a few
+warm-up queries. The NumPy store searches exactly below --ann-threshold rows
+and through hnswlib above it; the recall column is the share of the exact
+top-k each store returns.
+    python benchmarks/bench_vector_backends.py --sizes 100 1000 10000 50000
+"""
+
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.numpy_vector_store import NumpyVectorStore
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ChromaStore:
+    """ChromaMemoryStore's calls on a client of its own (one collection per user)."""
+
+    name = "chroma"
+
+    def __init__(self, path: str):
+        import chromadb
+        from app.services.vector_db_service import CollectionCache
+        self.client = chromadb.PersistentClient(path=path)
+        self.collections = CollectionCache(lambda: self.client)
+
+    def add(self, user_id, embeddings, documents, metadatas, ids):
+        self.collections.get(f"user_{user_id}", create=True).add(
+            embeddings=embeddings, documents=documents, metadatas=metadatas, ids=ids)
+
+    def require(self, user_id):
+        self.collections.get(f"user_{user_id}")
+
+    def query(self, user_id, embedding, n_results):
+        return self.collections.get(f"user_{user_id}").query(query_embeddings=[embedding], n_results=n_results)["documents"][0]
+
+
+def fill(store, size: int, vectors: np.ndarray, batch: int = 1000):
+    for start in range(0, size, batch):
+        rows = vectors[start:start + batch]
+        store.add("bench", rows.tolist() if store.name == "chroma" else rows,
+                  [f"memory {i}" for i in range(start, start + len(rows))],
+                  [{"sender": "user"}] * len(rows), [str(i) for i in range(start, start + len(rows))])
+
+
+def measure(store, queries: np.ndarray, k: int) -> tuple:
+    for query in queries[:5]:
+        store.query("bench", query.tolist(), k)
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        store.require("bench")
+        documents = store.query("bench", query.tolist(), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(documents)
+    return latencies, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy", "numpy-float16"])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=6, help="results per query (3 memories plus the search over-fetch)")
+    parser.add_argument("--ann-threshold", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{args.dim}-dim, top-{args.k}, {args.queries} queries, NumPy ANN above {args.ann_threshold} rows\n")
+    print(f"{'memories':>8} {'backend':>14} {'build s':>8} {'p50 ms':>8} {'p99 ms':>8} {'recall':>7}")
+    for size in args.sizes:
+        topics = rng.standard_normal((max(size // 50, 2), args.dim)).astype(np.float32)
+        vectors = topics[rng.integers(0, len(topics), size)] + 0.6 * rng.standard_normal((size, args.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = vectors[rng.integers(0, size, args.queries)] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        distances = (vectors ** 2).sum(axis=1)[None, :] - 2 * queries @ vectors.T
+        exact = [set(f"memory {i}" for i in np.argsort(row)[:args.k]) for row in distances]
+
+        for backend in args.backends:
+            directory = tempfile.mkdtemp(prefix="bench_vector_backends_")
+            try:
+                start = time.perf_counter()
+                if backend == "chroma":
+                    store = ChromaStore(directory)
+                else:
+                    store = NumpyVectorStore(directory, dtype="float16" if backend.endswith("float16") else "float32",
+                                             ann_threshold=args.ann_threshold)
+                fill(store, size, vectors)
+                build_s = time.perf_counter() - start
+                latencies, results = measure(store, queries, args.k)
+                recall = statistics.mean(len(exact[i] & set(r)) / args.k for i, r in enumerate(results))
+                print(f"{size:>8} {backend:>14} {build_s:>8.2f} {statistics.median(latencies):>8.3f} "
+                      f"{percentile(latencies, 0.99):>8.3f} {recall:>7.3f}")
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
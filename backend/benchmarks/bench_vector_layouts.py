@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Collection open / query latency and footprint of the Chroma storage layouts.
+
+For each user count, builds a fresh PersistentClient in each layout
+(per_user: one collection per user; sharded: --shards collections with a
+user_id filter) holding --records random memories per user, then measures in
+a separate process:
+  - cold open: the first get_collection for a user, as every request paid before
+  - cached open: the same through CollectionCache
+  - query p50/p99 of a top-6 search (the filtered search in the sharded layout)
+  - resident memory after the queries, and the size of the directory on disk
+    python benchmarks/bench_vector_layouts.py --users 10 1000 10000
+
+Populating 10k per-user collections takes a while; --keep reuses a directory
+built by an earlier run.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.vector_db_service import CollectionCache, user_collection
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def disk_mb(path: str) -> float:
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file()) / 2**20
+
+
+def vectors(rng, count: int, dim: int) -> list:
+    rows = []
+    for _ in range(count):
+        row = [rng.gauss(0, 1) for _ in range(dim)]
+        norm = sum(x * x for x in row) ** 0.5
+        rows.append([x / norm for x in row])
+    return rows
+
+
+def populate(path: str, layout: str, users: int, records: int, shards: int, dim: int):
+    import chromadb
+    client = chromadb.PersistentClient(path=path)
+    rng = random.Random(0)
+    pending = {}
+    for u in range(users):
+        user_id = f"bench{u:06d}"
+        name, where = user_collection(user_id, layout, shards)
+        batch = pending.setdefault(name, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+        for r in range(records):
+            batch["ids"].append(f"{user_id}-{r}")
+            batch["documents"].append(f"memory {r} of {user_id}")
+            batch["metadatas"].append({"sender": "user", "session_id": "bench", **(where or {})})
+        batch["embeddings"].extend(vectors(rng, records, dim))
+        if layout == "per_user" or len(batch["ids"]) >= 5000:
+            client.get_or_create_collection(name=name).add(**pending.pop(name))
+    for name, batch in pending.items():
+        client.get_or_create_collection(name=name).add(**batch)
+
+
+def worker(args):
+    """Opens the client, measures a sample of users and prints the results as JSON."""
+    import chromadb
+    start = time.perf_counter()
+    client = chromadb.PersistentClient(path=args.path)
+    client_s = time.perf_counter() - start
+
+    rng = random.Random(1)
+    sample = [f"bench{rng.randrange(args.users_count):06d}" for _ in range(args.queries)]
+    queries = vectors(rng, len(sample), args.dim)
+    cache = CollectionCache(lambda: client)
+
+    cold, cached, query = [], [], []
+    for user_id, embedding in zip(sample, queries):
+        name, where = user_collection(user_id, args.worker, args.shards)
+        start = time.perf_counter()
+        client.get_collection(name=name)
+        cold.append((time.perf_counter() - start) * 1000)
+
+        cache.get(name)
+        start = time.perf_counter()
+        collection = cache.get(name)
+        cached.append((time.perf_counter() - start) * 1000)
+
+        request = {"query_embeddings": [embedding], "n_results": 6}
+        if where is not None:
+            request["where"] = where
+        start = time.perf_counter()
+        collection.query(**request)
+        query.append((time.perf_counter() - start) * 1000)
+
+    print(json.dumps({
+        "client_s": client_s,
+        "cold_open_p50_ms": statistics.median(cold),
+        "cached_open_p50_ms": statistics.median(cached),
+        "query_p50_ms": statistics.median(query),
+        "query_p99_ms": percentile(query, 0.99),
+        "rss_mb": rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--layouts", nargs="+", default=["per_user", "sharded"])
+    parser.add_argument("--records", type=int, default=20, help="memories per user")
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=300, help="users sampled for the measurements")
+    parser.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "bench_vector_layouts"))
+    parser.add_argument("--keep", action="store_true", help="keep (and reuse) the populated directories")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    parser.add_argument("--users-count", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    print(f"{args.records} memories per user, {args.dim}-dim, {args.shards} shards, {args.queries} sampled users\n")
+    print(f"{'users':>6} {'layout':>9} {'build s':>8} {'client s':>9} {'cold open':>10} {'cached open':>12} "
+          f"{'query p50':>10} {'query p99':>10} {'RSS MB':>7} {'disk MB':>8}")
+    for users in args.users:
+        for layout in args.layouts:
+            path = os.path.join(args.dir, f"{layout}-{users}")
+            build_s = 0.0
+            if not (args.keep and os.path.isdir(path)):
+                shutil.rmtree(path, ignore_errors=True)
+                start = time.perf_counter()
+                populate(path, layout, users, args.records, args.shards, args.dim)
+                build_s = time.perf_counter() - start
+
+            command = [sys.executable, __file__, "--worker", layout, "--path", path, "--users-count", str(users),
+                       "--shards", str(args.shards), "--dim", str(args.dim), "--queries", str(args.queries)]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"❌ {layout} at {users} users failed:\n{completed.stderr.strip()[-2000:]}")
+                continue
+            r = json.loads(completed.stdout.strip().splitlines()[-1])
+            print(f"{users:>6} {layout:>9} {build_s:>8.1f} {r['client_s']:>9.2f} {r['cold_open_p50_ms']:>8.3f}ms "
+                  f"{r['cached_open_p50_ms']:>10.4f}ms {r['query_p50_ms']:>8.2f}ms {r['query_p99_ms']:>8.2f}ms "
+                  f"{r['rss_mb']:>7.0f} {disk_mb(path):>8.1f}")
+            if not args.keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
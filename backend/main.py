@@ -1,9 +1,14 @@
+# Times the imports below for the startup report (see app/core/startup.py).
+from app.core import startup
+startup.import_timer.install()
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 from app.api.v1 import chat
 from app.api.v1 import debug
+import asyncio
 import os
 from contextlib import asynccontextmanager
 import firebase_admin
@@ -11,7 +16,16 @@ from firebase_admin import credentials
 from slowapi.errors import RateLimitExceeded
 
 from app.core.limiter import limiter
+from app.core import timing
+from app.core.admission import AdmissionRejected
+from app.core.concurrency import shutdown_executors
+from app.core.agent import summarizer
+from app.services.persistence_service import persistence_queue
+from app.services.job_service import job_manager
 from app.services.secrets_service import load_secrets_from_gcp
+from app.services.firebase_service import refresh_signing_certs_periodically
+
+startup.import_timer.uninstall()
 
 
 @asynccontextmanager
@@ -25,8 +39,20 @@ async def lifespan(app: FastAPI):
         print("Firebase Admin SDK initialized successfully within lifespan event.")
     except Exception as e:
         print(f"CRITICAL ERROR during startup: Could not initialize Firebase Admin SDK: {e}")
+    persistence_queue.start()
+    cert_refresh_task = asyncio.create_task(refresh_signing_certs_periodically())
+    startup.print_report()
+    # The models and the agent load in the background so the server answers health checks right away.
+    warm_up_task = asyncio.create_task(startup.warm_up()) if startup.STARTUP_WARMUP else None
     yield
     print("Application shutdown...")
+    cert_refresh_task.cancel()
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    job_manager.shutdown()
+    await persistence_queue.stop()
+    await summarizer.drain()
+    shutdown_executors()
 
 
 app = FastAPI(
@@ -38,21 +64,36 @@ app = FastAPI(
 
 app.state.limiter = limiter
 
+def _cors_headers(request: Request) -> dict:
+    origin = request.headers.get("origin", "")
+    if origin in ALLOWED_ORIGINS:
+        return {"Access-Control-Allow-Origin": origin, "Access-Control-Allow-Credentials": "true"}
+    return {}
+
 # CORS-aware 429 handler — must add CORS headers manually because exception
 # handler responses bypass the CORS middleware.
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
-    origin = request.headers.get("origin", "")
     headers = {"Retry-After": str(exc.retry_after)} if hasattr(exc, "retry_after") else {}
-    if origin in ALLOWED_ORIGINS:
-        headers["Access-Control-Allow-Origin"] = origin
-        headers["Access-Control-Allow-Credentials"] = "true"
+    headers.update(_cors_headers(request))
     return JSONResponse(
         status_code=429,
         content={"detail": f"Rate limit exceeded: {exc.detail}"},
         headers=headers,
     )
 
+# LLM admission control: the server is at its concurrency cap and the request
+# couldn't be queued or admitted before its deadline.
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    headers = {"Retry-After": str(exc.retry_after)}
+    headers.update(_cors_headers(request))
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy: {exc.reason}"},
+        headers=headers,
+    )
+
 static_dir = "static"
 if not os.path.exists(static_dir):
     os.makedirs(static_dir)
@@ -80,6 +121,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """Attaches per-stage timings as a Server-Timing header and logs slow requests."""
+    timer, token = timing.start_request(request.method, request.url.path)
+    try:
+        response = await call_next(request)
+    finally:
+        timing.end_request(token)
+    response.headers["Server-Timing"] = timer.server_timing_header()
+    origin = request.headers.get("origin", "")
+    if origin in ALLOWED_ORIGINS:
+        # Lets the frontend read the timings through the Performance API.
+        response.headers["Timing-Allow-Origin"] = origin
+    if not response.headers.get("content-type", "").startswith("text/event-stream"):
+        timing.log_if_slow(timer, response.status_code)
+    return response
+
 app.include_router(chat.router, prefix="/api/v1/chat", tags=["Chat"])
 app.include_router(debug.router, prefix="/debug", tags=["Debug"])
 
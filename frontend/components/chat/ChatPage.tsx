@@ -20,6 +20,9 @@ interface ChatPageProps {
   setMessages: React.Dispatch<React.SetStateAction<Message[]>>;
 }
 
+const CREW_POLL_INTERVAL_MS = 3000;
+const CREW_POLL_MAX_ATTEMPTS = 400; // ~20 minutes
+
 const WelcomeScreen = ({ setInput }: { setInput: (val: string) => void }) => {
     const examplePrompts = ["What's the weather in Lucknow?", "Who was Alan Turing?", "/blog The Future of AI"];
     return (
@@ -78,10 +81,24 @@ export const ChatPage = ({ sessionId, messages, setMessages }: ChatPageProps) =>
           },
           body: JSON.stringify({ topic: topic }),
         });
-        if (!response.ok) throw new Error('The AI crew failed to complete the task.');
-        
-        const data = await response.json();
-        const agentMessage: Message = { id: uuidv4(), text: data.result, sender: 'agent' };
+        if (!response.ok) throw new Error('The AI crew could not be started.');
+
+        // The crew runs as a background job; poll it until it finishes.
+        const { job_id } = await response.json();
+        let job: any = null;
+        for (let attempt = 0; attempt < CREW_POLL_MAX_ATTEMPTS; attempt++) {
+          await new Promise(resolve => setTimeout(resolve, CREW_POLL_INTERVAL_MS));
+          const jobResponse = await fetch(`${BACKEND_URL}/api/v1/chat/invoke_crew/${job_id}`, {
+            headers: { 'Authorization': `Bearer ${await user.getIdToken()}` },
+          });
+          if (!jobResponse.ok) continue;
+          job = await jobResponse.json();
+          if (job.status === 'succeeded' || job.status === 'failed') break;
+        }
+        if (!job || job.status === 'failed') throw new Error(job?.error || 'The AI crew failed to complete the task.');
+        if (job.status !== 'succeeded') throw new Error('The AI crew is taking longer than expected. Please try again later.');
+
+        const agentMessage: Message = { id: uuidv4(), text: job.result, sender: 'agent' };
         setMessages(prev => [...prev, agentMessage]);
       
       } catch (error: any) {